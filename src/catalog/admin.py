@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Category, Product
+from .signals import catalog_changes, report_product_changes
 
 
 @admin.register(Category)
@@ -24,13 +25,20 @@ class ProductAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related("category")
 
     def activate(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        rows = list(queryset.values_list("pk", "category_id"))
+        with catalog_changes():
+            updated = queryset.update(is_active=True)
+            # les produits activés peuvent entrer dans les résultats de leurs catégories
+            report_product_changes([pk for pk, _ in rows], [cat for _, cat in rows])
         self.message_user(request, f"{updated} produit(s) activé(s).")
 
     activate.short_description = "Activer les produits sélectionnés"
 
     def deactivate(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        pks = list(queryset.values_list("pk", flat=True))
+        with catalog_changes():
+            updated = queryset.update(is_active=False)
+            report_product_changes(pks)
         self.message_user(request, f"{updated} produit(s) désactivé(s).")
 
     deactivate.short_description = "Désactiver les produits sélectionnés"
@@ -1,5 +1,5 @@
 import logging
-from time import monotonic
+from time import monotonic, time
 
 from django.conf import settings
 from django.contrib.auth import authenticate
@@ -17,12 +17,15 @@ from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
 
 from ml import assistant as ml_assistant
-from ml import products_index
-from ml.cache import buster_key, make_key
+from ml import assistant_index, neighbors, products_index
+from ml import dense as dense_index
+from ml.cache import buster_key, fill, fill_stats, get_many_tagged, invalidations, make_key, product_tag, product_tags, set_many_tagged, tier_stats
 from ml.metrics import get_counter, incr_counter, p95, record_duration
+from ml.versions import context as versions
 
 from .models import Category, Order, Product
 from .permissions import IsOwnerOrAdmin, IsStaffOrDjangoModelPermissionsOrAnonReadOnly
+from .responses import prerender, rendered_data, rendered_response
 from .serializers import (
     CategorySerializer,
     OrderSerializer,
@@ -292,7 +295,12 @@ class JWTLogoutView(APIView):
 @extend_schema(
     tags=["products"],
     summary="Recommandations basées contenu",
-    parameters=[OpenApiParameter(name="k", description="Top-K recommandations", required=False, type=int)],
+    parameters=[
+        OpenApiParameter(name="k", description="Top-K recommandations", required=False, type=int),
+        OpenApiParameter(name="diversify", description="mmr (défaut: ML_RECO_DIVERSIFY) ou none", required=False, type=str),
+        OpenApiParameter(name="mode", description="dense (index ANN LSA) ou sparse (TF-IDF exact); défaut: ML_RECO_DENSE", required=False, type=str),
+        OpenApiParameter(name="nprobe", description="Listes IVF sondées en mode dense (défaut: ML_DENSE_NPROBE)", required=False, type=int),
+    ],
 )
 class ProductRecommendationsView(APIView):
     permission_classes = [AllowAny]
@@ -300,35 +308,80 @@ class ProductRecommendationsView(APIView):
     def get(self, request, pk: int):
         t0 = monotonic()
         k = int(request.query_params.get("k", 10))
-        diversify = (request.query_params.get("diversify") or "").lower()
-        idx_manifest = products_index.read_manifest("product_index") if hasattr(products_index, "read_manifest") else {"version": "0"}
-        version = (idx_manifest or {}).get("version", "0")
-        key = make_key("reco", version, buster_key(), pk, k)
-        cached = cache.get(key)
-        if cached:
-            return Response(cached, status=200)
-        if diversify == "mmr":
-            recs = products_index.recommend_mmr(product_id=pk, k=k)
-        else:
-            recs = products_index.recommend(product_id=pk, k=k, exclude_self=True, ensure_diversity=True)
-        recs = products_index.recommend(product_id=pk, k=k, exclude_self=True, ensure_diversity=True)
-        ids = [r["product_id"] for r in recs]
-        qs = Product.objects.filter(id__in=ids).select_related("category")
-        prod_by_id = {p.id: p for p in qs}
-        ordered = [prod_by_id[i] for i in ids if i in prod_by_id]
-        data = ProductListSerializer(ordered, many=True).data
-        decorated = []
-        for item, r in zip(data, recs, strict=False):
-            item["reason"] = r["reason"]
-            item["score"] = round(r["score"], 6)
-            decorated.append(item)
-        resp = {"results": decorated, "version": version}
-        cache.set(key, resp, timeout=300)
+        diversify = (request.query_params.get("diversify") or settings.ML_RECO_DIVERSIFY).lower()
+        # index qui calcule la réponse: pendant un rechargement en arrière-plan, encore l'ancienne version
+        idx = products_index.get_index()
+        version = idx.version
+        dense, nprobe = _dense_params(request, settings.ML_RECO_DENSE)
+        key = make_key("reco", version, idx.built_at, buster_key(), pk, k, diversify, *_dense_key(idx, dense, nprobe))
+        computed = []
+
+        def compute():
+            if diversify == "mmr":
+                recs = products_index.recommend_mmr(product_id=pk, k=k, dense=dense, nprobe=nprobe, idx=idx)
+            else:
+                recs = products_index.recommend(product_id=pk, k=k, exclude_self=True, ensure_diversity=True, dense=dense, nprobe=nprobe, idx=idx)
+            computed.append(recs)
+            ids = [r["product_id"] for r in recs]
+            prods = list(Product.objects.filter(id__in=ids).select_related("category"))
+            decorated = _decorate_hits(recs, {p.id: p for p in prods})
+            # invalidée par une modification du produit source ou de l'un des produits recommandés
+            return prerender({"results": decorated, "version": version}), product_tags(prods) | {product_tag(pk)}
+
+        entry = fill(key, compute, timeout=300)
+        if not computed:
+            return rendered_response(request, entry)
+        recs = computed[0]
         dt_ms = int((monotonic() - t0) * 1000)
         record_duration("reco_ms", dt_ms)
         incr_counter("reco_impressions", 1)
         logger.info("RECO time_ms=%s pk=%s k=%s version=%s top=%s", dt_ms, pk, k, version, [(r.get("product_id"), round(r.get("score", 0), 6)) for r in recs[:3]])
-        return Response(resp, status=200)
+        return rendered_response(request, entry)
+
+
+def _dense_params(request, default):
+    """(dense, nprobe) de la requête: ?mode=dense|sparse (défaut: réglage), ?nprobe=N."""
+    mode = (request.query_params.get("mode") or ("dense" if default else "sparse")).lower()
+    if mode not in ("dense", "sparse"):
+        raise ValidationError({"mode": "dense ou sparse"})
+    nprobe = request.query_params.get("nprobe")
+    return mode == "dense", int(nprobe) if nprobe else None
+
+
+def _dense_key(idx, dense, nprobe):
+    # table servie pour ``idx``: sans table à jour, la recherche reste exacte (mêmes résultats qu'en sparse)
+    table = dense_index.get_table() if dense else None
+    if table is None or not table.current_for(idx):
+        return ("sparse",)
+    return ("dense", table.built_at, nprobe or 0)
+
+
+def _search_fallback(q, k):
+    qs = (
+        Product.objects.filter(is_active=True)
+        .filter(Q(name__icontains=q) | Q(description__icontains=q) | Q(slug__icontains=q) | Q(category__name__icontains=q))
+        .select_related("category")
+        .order_by("name")[:k]
+    )
+    data = ProductListSerializer(qs, many=True).data
+    for item in data:
+        item["score"] = 0.0
+        item["reason"] = "Correspondance texte (fallback)"
+    return data
+
+
+def _fallback_tags(data):
+    return {product_tag(item["id"]) for item in data}
+
+
+def _decorate_hits(hits, prod_by_id):
+    # appariement par id: un produit absent (inactif, supprimé) ne décale pas les scores des suivants
+    kept = [h for h in hits if h["product_id"] in prod_by_id]
+    data = ProductListSerializer([prod_by_id[h["product_id"]] for h in kept], many=True).data
+    for item, h in zip(data, kept, strict=True):
+        item["score"] = round(h["score"], 6)
+        item["reason"] = h["reason"]
+    return list(data)
 
 
 @extend_schema(
@@ -337,6 +390,8 @@ class ProductRecommendationsView(APIView):
     parameters=[
         OpenApiParameter(name="q", description="Requête", required=True, type=str),
         OpenApiParameter(name="k", description="Top-K", required=False, type=int),
+        OpenApiParameter(name="mode", description="dense (index ANN LSA) ou sparse (TF-IDF exact); défaut: ML_SEARCH_DENSE", required=False, type=str),
+        OpenApiParameter(name="nprobe", description="Listes IVF sondées en mode dense (défaut: ML_DENSE_NPROBE)", required=False, type=int),
     ],
 )
 class SearchView(APIView):
@@ -348,45 +403,92 @@ class SearchView(APIView):
         if not q:
             return Response({"detail": "missing q"}, status=400)
         k = int(request.query_params.get("k", 10))
-        idx_manifest = products_index.read_manifest("product_index") if hasattr(products_index, "read_manifest") else {"version": "0"}
-        version = (idx_manifest or {}).get("version", "0")
-        key = make_key("search", version, buster_key(), q, k)
-        cached = cache.get(key)
-        if cached:
-            return Response(cached, status=200)
-        hits = products_index.search(q=q, k=k)
-        if not hits:
-            qs = (
-                Product.objects.filter(is_active=True)
-                .filter(Q(name__icontains=q) | Q(description__icontains=q) | Q(slug__icontains=q) | Q(category__name__icontains=q))
-                .select_related("category")
-                .order_by("name")[:k]
-            )
-            data = ProductListSerializer(qs, many=True).data
-            for item in data:
-                item["score"] = 0.0
-                item["reason"] = "Correspondance texte (fallback)"
-            resp = {"results": data, "version": version}
-            if data:
-                cache.set(key, resp, timeout=300)  # ne pas cacher si vide
-            return Response(resp, status=200)
-        ids = [h["product_id"] for h in hits]
-        qs = Product.objects.filter(id__in=ids, is_active=True).select_related("category")
-        prod_by_id = {p.id: p for p in qs}
-        ordered = [prod_by_id[i] for i in ids if i in prod_by_id]
-        data = ProductListSerializer(ordered, many=True).data
-        out = []
-        for item, h in zip(data, hits, strict=False):
-            item["score"] = round(h["score"], 6)
-            item["reason"] = h["reason"]
-            out.append(item)
-        resp = {"results": out, "version": version}
-        cache.set(key, resp, timeout=300)
-        # SearchView.get — après composition de resp (les deux branches, hits ou fallback)
+        idx = products_index.get_index()
+        version = idx.version
+        dense, nprobe = _dense_params(request, settings.ML_SEARCH_DENSE)
+        key = make_key("search", version, idx.built_at, buster_key(), q, k, *_dense_key(idx, dense, nprobe))
+        computed = []
+
+        def compute():
+            hits = products_index.search(q=q, k=k, dense=dense, nprobe=nprobe, idx=idx)
+            computed.append(hits)
+            if not hits:
+                data = _search_fallback(q, k)
+                return prerender({"results": data, "version": version}), _fallback_tags(data) if data else None  # ne pas cacher si vide
+            ids = [h["product_id"] for h in hits]
+            prods = list(Product.objects.filter(id__in=ids, is_active=True).select_related("category"))
+            out = _decorate_hits(hits, {p.id: p for p in prods})
+            # y compris les produits écartés (inactifs): leur réactivation doit invalider la réponse
+            return prerender({"results": out, "version": version}), product_tags(prods) | {product_tag(i) for i in ids}
+
+        # un seul calcul par requête à la fois, valeur périmée servie pendant son recalcul; corps JSON déjà rendu
+        entry = fill(key, compute, timeout=300)
+        if not computed or not computed[0]:
+            return rendered_response(request, entry)
+        hits = computed[0]
         dt_ms = int((monotonic() - t0) * 1000)
         record_duration("search_ms", dt_ms)
         logger.info("SEARCH time_ms=%s q_len=%s k=%s version=%s top=%s", dt_ms, len(q), k, version, [(h.get("product_id"), round(h.get("score", 0), 6)) for h in hits[:3]] if hits else [])
-        return Response(resp, status=200)
+        return rendered_response(request, entry)
+
+
+@extend_schema(
+    tags=["search"],
+    summary="Recherche par lot (TF-IDF local)",
+    description="Jusqu'à ML_SEARCH_BATCH_MAX requêtes {q, k}; résultats dans l'ordre des requêtes, cache par requête partagé avec /search/.",
+    request=None,
+    examples=[OpenApiExample("Requête", value={"queries": [{"q": "casque audio", "k": 5}, {"q": "chaise"}]}, request_only=True)],
+)
+class SearchBatchView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        t0 = monotonic()
+        raw = (request.data or {}).get("queries") if isinstance(request.data, dict) else None
+        if not isinstance(raw, list) or not raw:
+            return Response({"detail": "missing queries"}, status=400)
+        if len(raw) > settings.ML_SEARCH_BATCH_MAX:
+            return Response({"detail": f"too many queries (max {settings.ML_SEARCH_BATCH_MAX})"}, status=400)
+        queries = []
+        for i, item in enumerate(raw):
+            q = str(item.get("q") or "").strip() if isinstance(item, dict) else ""
+            if not q:
+                return Response({"detail": f"missing q (queries[{i}])"}, status=400)
+            try:
+                k = int(item.get("k", 10))
+            except (TypeError, ValueError):
+                k = 0
+            if k <= 0:
+                return Response({"detail": f"invalid k (queries[{i}])"}, status=400)
+            queries.append((q, k))
+        idx = products_index.get_index()
+        version = idx.version
+        buster = buster_key()
+        keys = [make_key("search", version, idx.built_at, buster, q, k, *_dense_key(idx, False, None)) for q, k in queries]
+        # entrées pré-rendues de /search/: décodées pour composer la réponse du lot
+        found = {key: rendered_data(v) for key, v in get_many_tagged(keys).items() if v}
+        # requêtes manquantes, dédoublonnées: une seule vectorisation et un seul produit matriciel pour le lot
+        todo = {key: qk for key, qk in zip(keys, queries, strict=True) if key not in found}
+        if todo:
+            since = time()
+            hits_by_key = dict(zip(todo, products_index.search_many(list(todo.values()), idx=idx), strict=True))
+            ids = {h["product_id"] for hits in hits_by_key.values() for h in hits}
+            prod_by_id = {p.id: p for p in Product.objects.filter(id__in=ids, is_active=True).select_related("category")} if ids else {}
+            fresh = {}
+            for key, (q, k) in todo.items():
+                hits = hits_by_key[key]
+                data = _decorate_hits(hits, prod_by_id) if hits else _search_fallback(q, k)
+                found[key] = {"results": data, "version": version}
+                if data:
+                    tags = product_tags(prod_by_id[h["product_id"]] for h in hits if h["product_id"] in prod_by_id) | {product_tag(h["product_id"]) for h in hits} if hits else _fallback_tags(data)
+                    fresh[key] = (prerender(found[key]), tags)
+            if fresh:
+                set_many_tagged(fresh, since, timeout=300)
+        results = [{"q": q, "k": k, **found[key]} for key, (q, k) in zip(keys, queries, strict=True)]
+        dt_ms = int((monotonic() - t0) * 1000)
+        record_duration("search_batch_ms", dt_ms)
+        logger.info("SEARCH_BATCH time_ms=%s queries=%s computed=%s version=%s", dt_ms, len(queries), len(todo), version)
+        return Response({"results": results, "version": version}, status=200)
 
 
 @extend_schema(
@@ -418,14 +520,18 @@ class AssistantAskView(APIView):
             return Response({"detail": "throttled"}, status=429)
         cache.set(tkey, count + 1, timeout=60)
 
-        key = make_key("assistant", buster_key(), q, k)
-        cached = cache.get(key)
-        if cached:
-            return Response(cached, status=200)
-        result = ml_assistant.answer(q=q, k=k)
-        dt_ms = int((monotonic() - t0) * 1000)
-        record_duration("assistant_ms", dt_ms)
-        cache.set(key, result, timeout=120)
+        # réponses tirées du corpus documentaire: indépendantes des écritures produits, suivent la version de l'index
+        idx = assistant_index.get_index()
+        key = make_key("assistant", idx.version, buster_key(), q, k)
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return ml_assistant.answer(q=q, k=k, idx=idx), ()
+
+        result = fill(key, compute, timeout=120)
+        if computed:
+            record_duration("assistant_ms", int((monotonic() - t0) * 1000))
         return Response(result, status=200)
 
 
@@ -455,5 +561,10 @@ class MetricsView(APIView):
             "reco": {"impressions": impressions, "clicks": clicks, "ctr": round(ctr, 4), "p95_ms": p95("reco_ms")},
             "search": {"p95_ms": p95("search_ms")},
             "assistant": {"p95_ms": p95("assistant_ms")},
+            "cache_fill": fill_stats(),
+            "cache_tiers": tier_stats(),
+            "cache_invalidations": invalidations.stats(),
+            "versions": versions.stats(),
+            "indexes": [products_index.index_stats(), neighbors.index_stats(), dense_index.index_stats(), assistant_index.index_stats()],
         }
         return Response(data, status=200)
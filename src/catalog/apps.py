@@ -6,4 +6,4 @@ class CatalogConfig(AppConfig):
     name = "catalog"
 
     def ready(self):
-        pass
+        from . import signals  # noqa: F401
@@ -0,0 +1,170 @@
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from ml import dense, neighbors, products_index
+from ml.inverted import ENGINES
+from ml.storage import PRECISIONS
+from ml.streaming import peak_rss_bytes
+from ml.utils import artifacts_dir, read_manifest, write_json_atomic
+
+# catalogue synthétique: catégorie → (types de produits, caractéristiques propres)
+CATALOG = {
+    "Audio": (["casque", "enceinte", "barre de son", "ecouteurs", "platine vinyle", "micro"], ["bluetooth", "reduction de bruit", "basses renforcees", "filaire", "hi-res", "autonomie 30h"]),
+    "Informatique": (["clavier", "souris", "ecran", "ordinateur portable", "disque ssd", "webcam"], ["usb-c", "sans fil", "retroeclairage", "16 go ram", "4k", "ergonomique"]),
+    "Maison": (["lampe", "aspirateur", "chaise", "bureau", "etagere", "coussin"], ["connectee", "design scandinave", "reglable", "led", "pliable", "velours"]),
+    "Cuisine": (["mixeur", "blender", "poele", "cafetiere", "bouilloire", "robot patissier"], ["inox", "antiadhesive", "induction", "programmable", "sans bpa", "1500w"]),
+    "Sport": (["velo", "chaussures running", "montre gps", "tapis de yoga", "halteres", "sac de sport"], ["amorti", "etanche", "cardio", "leger", "antiderapant", "respirant"]),
+    "Livres": (["roman", "guide pratique", "bande dessinee", "livre de cuisine", "manuel", "essai"], ["illustre", "poche", "edition collector", "grand format", "francais", "debutant"]),
+}
+COLORS = ["noir", "blanc", "gris", "bleu", "rouge", "vert", "beige", "rose", "jaune", "argent"]
+MATERIALS = ["bois", "metal", "plastique recycle", "coton", "aluminium", "verre", "cuir", "bambou"]
+QUALIFIERS = ["premium", "compact", "professionnel", "eco", "edition limitee", "nouvelle generation", "classique", "ultra"]
+BRANDS = [f"{a}{b}" for a in ("Nova", "Alto", "Zen", "Kora", "Lumo", "Vega", "Orsa", "Tika") for b in ("tek", "lia", "mo", "ra", "line", "sonic")]
+
+
+def synthetic_catalog(n: int, seed: int = 42) -> tuple[list[int], list[str], list[tuple[bool, int]]]:
+    """Corpus (ids, documents, colonnes) de ``n`` produits, au format de l'index produits."""
+    rng = np.random.default_rng(seed)
+    cats = list(CATALOG)
+    cat = rng.integers(0, len(cats), n)
+    # répartition de Zipf des marques: quelques marques très présentes, une longue traîne
+    brand = (rng.zipf(1.5, n) - 1) % len(BRANDS)
+    kind, feat, feat2 = rng.integers(0, 6, n), rng.integers(0, 6, n), rng.integers(0, 6, n)
+    color, material, qualifier = rng.integers(0, len(COLORS), n), rng.integers(0, len(MATERIALS), n), rng.integers(0, len(QUALIFIERS), n)
+    model = rng.integers(1, 5000, n)
+    available = rng.random(n) > 0.1
+    docs = []
+    for i in range(n):
+        category = cats[cat[i]]
+        kinds, feats = CATALOG[category]
+        name = f"{kinds[kind[i]]} {BRANDS[brand[i]]} {QUALIFIERS[qualifier[i]]} m{model[i]}"
+        description = f"{kinds[kind[i]]} {feats[feat[i]]} {feats[feat2[i]]}, coloris {COLORS[color[i]]}, finition {MATERIALS[material[i]]}."
+        docs.append(products_index._doc_text(name, description, category))
+    return list(range(1, n + 1)), docs, [(bool(a), int(c)) for a, c in zip(available, cat, strict=True)]
+
+
+def synthetic_queries(count: int, seed: int = 7) -> list[str]:
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(count):
+        kinds, feats = CATALOG[list(CATALOG)[rng.integers(0, len(CATALOG))]]
+        words = [kinds[rng.integers(0, 6)], feats[rng.integers(0, 6)], COLORS[rng.integers(0, len(COLORS))], BRANDS[rng.integers(0, len(BRANDS))]]
+        out.append(" ".join(words[: rng.integers(1, 4)]))
+    return out
+
+
+def _latency(fn, args) -> dict[str, float]:
+    samples = []
+    for a in args:
+        t0 = time.perf_counter()
+        fn(a)
+        samples.append((time.perf_counter() - t0) * 1000)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if samples else (0.0, 0.0, 0.0)
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "count": len(samples)}
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmark de l'index produits sur des catalogues synthétiques (build, mémoire, taille, chargement, latences p50/p95/p99)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=str, default="10000,100000,1000000", help="Tailles de catalogue, par ordre croissant (le pic RSS est celui du processus)")
+        parser.add_argument("--k", type=str, default="10,50", help="Valeurs de k mesurées")
+        parser.add_argument("--queries", type=int, default=200, help="Requêtes (et produits sources) mesurés par k")
+        parser.add_argument("--engine", choices=ENGINES, default=None, help="Moteur de recherche (défaut: ML_PRODUCT_SEARCH_ENGINE)")
+        parser.add_argument("--shards", type=int, default=None, help="Shards de lignes (défaut: ML_PRODUCT_INDEX_SHARDS)")
+        parser.add_argument("--precision", choices=PRECISIONS, default=None, help="Précision des valeurs (défaut: ML_INDEX_PRECISION)")
+        parser.add_argument("--query-cache", dest="query_cache", action="store_true", help="Garde le LRU des vecteurs requêtes (désactivé par défaut: coût de vectorisation inclus)")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--keep-artifacts", dest="keep", action="store_true", help="Conserve les index construits (sous ML_ARTIFACTS_DIR/bench/)")
+
+    def handle(self, *args, **opts):
+        engine = opts["engine"] or settings.ML_PRODUCT_SEARCH_ENGINE
+        shards = opts["shards"] or settings.ML_PRODUCT_INDEX_SHARDS
+        precision = opts["precision"] or settings.ML_INDEX_PRECISION
+        ks = [int(x) for x in opts["k"].split(",") if x]
+        out_dir = artifacts_dir()
+        ts = int(time.time())
+        report = {"timestamp": ts, "commit": _commit(), "engine": engine, "shards": shards, "precision": precision, "query_cache": opts["query_cache"], "k": ks, "sizes": []}
+        queries = synthetic_queries(opts["queries"], opts["seed"])
+        self.stdout.write(f"{'n':>9} {'build':>9} {'peak rss':>10} {'size':>10} {'load':>8} {'search p95':>11} {'reco p95':>9} {'mmr p95':>8}")
+        for n in [int(x) for x in opts["sizes"].split(",") if x]:
+            # index construit dans un répertoire d'artefacts à part: l'index publié n'est jamais touché
+            bench_dir = out_dir / "bench" / f"{ts}-{n}"
+            overrides = {"ML_ARTIFACTS_DIR": bench_dir}
+            if not opts["query_cache"]:
+                overrides["ML_QUERY_VECTOR_CACHE"] = 0
+            with override_settings(**overrides):
+                try:
+                    row = self._run(n, engine, shards, precision, ks, queries, opts["seed"])
+                finally:
+                    for holder in (products_index._holder, neighbors._holder, dense._holder):
+                        holder.clear()
+            if not opts["keep"]:
+                shutil.rmtree(bench_dir, ignore_errors=True)
+            report["sizes"].append(row)
+            lat = row["latency"]
+            k0 = str(ks[0])
+            self.stdout.write(
+                f"{n:>9} {row['build_ms'] / 1000:>8.1f}s {row['peak_rss_bytes'] / 2**20:>8.0f}Mo {row['artifact_bytes'] / 2**20:>8.1f}Mo {row['load_ms']:>6}ms "
+                f"{lat['search'][k0]['p95_ms']:>9.2f}ms {lat['recommend'][k0]['p95_ms']:>7.2f}ms {lat['recommend_mmr'][k0]['p95_ms']:>6.2f}ms"
+            )
+
+        write_json_atomic(out_dir / f"bench_index_{ts}.json", report)
+        write_json_atomic(out_dir / "bench_index_latest.json", report)
+        self.stdout.write(self.style.SUCCESS(f"Rapport: {out_dir / f'bench_index_{ts}.json'}"))
+
+    def _run(self, n, engine, shards, precision, ks, queries, seed):
+        t0 = time.perf_counter()
+        ids, docs, cols = synthetic_catalog(n, seed)
+        generate_ms = int((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        idx, quality = products_index.index_from_corpus(ids, docs, cols, version=f"bench-{n}", engine=engine, shards=shards, precision=precision)
+        build_ms = int((time.perf_counter() - t0) * 1000)
+        peak = peak_rss_bytes()
+        del docs
+        products_index.save_index(idx, build={"mode": "bench", "peak_rss_bytes": peak}, precision=quality)
+        manifest = read_manifest(products_index.INDEX_NAME)
+        del idx
+        products_index._holder.clear()
+        t0 = time.perf_counter()
+        products_index.get_index()
+        load_ms = int((time.perf_counter() - t0) * 1000)
+        sources = np.random.default_rng(seed).choice(np.arange(1, n + 1), min(len(queries), n), replace=False).tolist()
+        # échauffement: pages des memmaps, pool de threads des shards
+        for q in queries[:10]:
+            products_index.search(q, k=ks[0])
+        latency = {"search": {}, "recommend": {}, "recommend_mmr": {}}
+        for k in ks:
+            latency["search"][str(k)] = _latency(lambda q, k=k: products_index.search(q, k=k), queries)
+            latency["recommend"][str(k)] = _latency(lambda pid, k=k: products_index.recommend(pid, k=k), sources)
+            latency["recommend_mmr"][str(k)] = _latency(lambda pid, k=k: products_index.recommend_mmr(pid, k=k), sources)
+        return {
+            "n": n,
+            "dim": int(manifest["dim"]),
+            "generate_ms": generate_ms,
+            "build_ms": build_ms,
+            "peak_rss_bytes": peak,
+            "artifact_bytes": _dir_bytes(artifacts_dir() / manifest["dir"]),
+            "load_ms": load_ms,
+            "resident_bytes": products_index.index_stats()["resident_bytes"],
+            "precision": quality,
+            "latency": latency,
+        }
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from scipy.sparse import csr_matrix
+from sklearn.metrics.pairwise import cosine_similarity
+
+from ml.scoring import l2_rows, postings, rank, score_row
+
+
+def _synthetic(n: int, dim: int, nnz: int, rng: np.random.Generator) -> csr_matrix:
+    # distribution de Zipf: quelques termes très fréquents, une longue traîne de termes rares
+    cols = (rng.zipf(1.3, n * nnz) - 1) % dim
+    indptr = np.arange(0, n * nnz + 1, nnz)
+    X = csr_matrix((rng.random(n * nnz), cols, indptr), shape=(n, dim))
+    X.sum_duplicates()
+    return l2_rows(X)
+
+
+def _queries(count: int, dim: int, rng: np.random.Generator) -> list[csr_matrix]:
+    out = []
+    for _ in range(count):
+        terms = np.unique((rng.zipf(1.3, rng.integers(1, 5)) - 1) % dim)
+        w = rng.random(terms.size)
+        out.append(csr_matrix((w / np.linalg.norm(w), terms, [0, terms.size]), shape=(1, dim)))
+    return out
+
+
+def _percentiles(samples: list[float]) -> tuple[float, float]:
+    if not samples:
+        return 0.0, 0.0
+    arr = np.array(samples) * 1000
+    return float(np.percentile(arr, 50)), float(np.percentile(arr, 95))
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark du noyau de scoring top-k (postings + argpartition) contre cosine_similarity + argsort."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=str, default="10000,100000,1000000")
+        parser.add_argument("--dim", type=int, default=50000)
+        parser.add_argument("--nnz", type=int, default=24, help="Termes par produit")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--baseline-queries", dest="baseline_queries", type=int, default=10, help="0 pour ignorer la référence")
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **opts):
+        rng = np.random.default_rng(opts["seed"])
+        k = opts["k"]
+        self.stdout.write(f"{'n':>9} {'kernel p50':>11} {'kernel p95':>11} {'baseline p50':>13} {'baseline p95':>13}")
+        for n in [int(x) for x in opts["sizes"].split(",") if x]:
+            X = _synthetic(n, opts["dim"], opts["nnz"], rng)
+            Xt = postings(X)
+            queries = _queries(opts["queries"], opts["dim"], rng)
+            kernel = []
+            for qv in queries:
+                t0 = time.perf_counter()
+                rank(*score_row(qv, Xt), k, n)
+                kernel.append(time.perf_counter() - t0)
+            baseline = []
+            for qv in queries[: opts["baseline_queries"]]:
+                t0 = time.perf_counter()
+                sims = cosine_similarity(qv, X).ravel()
+                np.argsort(-sims)[:k]
+                baseline.append(time.perf_counter() - t0)
+            kp50, kp95 = _percentiles(kernel)
+            bp50, bp95 = _percentiles(baseline)
+            self.stdout.write(f"{n:>9} {kp50:>9.3f}ms {kp95:>9.3f}ms {bp50:>11.3f}ms {bp95:>11.3f}ms")
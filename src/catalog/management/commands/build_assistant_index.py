@@ -1,6 +1,9 @@
+import time
+
 from django.core.management.base import BaseCommand
 
-from ml.assistant_index import build_index
+from ml.assistant_index import build_index, pending_changes
+from ml.storage import PRECISIONS
 
 
 class Command(BaseCommand):
@@ -8,7 +11,23 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--idx-version", dest="idx_version", type=str, default=None)
+        parser.add_argument("--full", action="store_true", help="Redécoupe tous les fichiers au lieu de reprendre ceux dont le contenu n'a pas changé")
+        parser.add_argument("--precision", choices=PRECISIONS, default=None, help="Précision des valeurs de l'index (défaut: ML_INDEX_PRECISION)")
+        parser.add_argument("--watch", action="store_true", help="Surveille le corpus et applique les changements au fil de l'eau (Ctrl-C pour arrêter)")
+        parser.add_argument("--interval", type=float, default=2.0, help="Secondes entre deux inspections du corpus en mode --watch")
 
     def handle(self, *args, **opts):
-        idx = build_index(version=opts.get("idx_version"))
+        idx = build_index(version=opts.get("idx_version"), incremental=not opts.get("full"), precision=opts.get("precision"))
         self.stdout.write(self.style.SUCCESS(f"Assistant index built: version={idx.version}, dim={idx.X.shape[1]}, n={len(idx.ids)}"))
+        if not opts.get("watch"):
+            return
+        self.stdout.write(f"Watching corpus every {opts['interval']}s...")
+        try:
+            while True:
+                time.sleep(opts["interval"])
+                if pending_changes(idx):
+                    # version par défaut: nombre de chunks (une version fixée en option vaudrait pour chaque mise à jour)
+                    idx = build_index(precision=opts.get("precision"))
+                    self.stdout.write(self.style.SUCCESS(f"Assistant index updated: version={idx.version}, n={len(idx.ids)}"))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
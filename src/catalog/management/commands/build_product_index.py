@@ -1,6 +1,9 @@
 from django.core.management.base import BaseCommand
 
+from ml.inverted import ENGINES
 from ml.products_index import build_index
+from ml.storage import PRECISIONS
+from ml.utils import read_manifest
 
 
 class Command(BaseCommand):
@@ -8,7 +11,20 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--idx-version", dest="idx_version", type=str, default=None)
+        parser.add_argument("--engine", choices=ENGINES, default=None, help="Moteur de recherche de l'index (défaut: ML_PRODUCT_SEARCH_ENGINE)")
+        parser.add_argument("--streaming", action="store_true", default=None, help="Construction hors mémoire par blocs (défaut: ML_INDEX_BUILD_STREAMING)")
+        parser.add_argument("--chunk", type=int, default=None, help="Produits par bloc en mode streaming (défaut: ML_INDEX_BUILD_CHUNK)")
+        parser.add_argument("--shards", type=int, default=None, help="Nombre de shards de lignes (défaut: ML_PRODUCT_INDEX_SHARDS)")
+        parser.add_argument("--precision", choices=PRECISIONS, default=None, help="Précision des valeurs de l'index (défaut: ML_INDEX_PRECISION)")
 
     def handle(self, *args, **opts):
-        idx = build_index(version=opts.get("idx_version"))
-        self.stdout.write(self.style.SUCCESS(f"Product index built: version={idx.version}, dim={idx.X.shape[1]}, n={idx.ids.size}"))
+        idx = build_index(
+            version=opts.get("idx_version"), engine=opts.get("engine"), streaming=opts.get("streaming"), chunk=opts.get("chunk"), shards=opts.get("shards"), precision=opts.get("precision")
+        )
+        quality = read_manifest("product_index").get("precision", {})
+        agreement = f", top_k_agreement={quality['top_k_agreement']}" if "top_k_agreement" in quality else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Product index built: version={idx.version}, dim={idx.X.shape[1]}, n={idx.ids.size}, engine={idx.engine}, shards={len(idx.shards)}, precision={idx.precision}{agreement}"
+            )
+        )
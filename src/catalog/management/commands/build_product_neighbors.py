@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ml.neighbors import build_neighbors, refresh_neighbors
+from ml.products_index import get_index
+
+
+class Command(BaseCommand):
+    help = "Précalcule la table des voisins produits (recommandations) à partir de l'index courant."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--width", type=int, default=None, help="Voisins par produit (défaut: ML_RECO_NEIGHBORS)")
+        parser.add_argument("--workers", type=int, default=None, help="Threads de calcul (défaut: ML_RECO_NEIGHBORS_WORKERS, 0 = tous les CPU)")
+        parser.add_argument("--chunk", type=int, default=None, help="Lignes par bloc (défaut: ML_RECO_NEIGHBORS_CHUNK)")
+        parser.add_argument("--products", type=str, default="", help="Ids séparés par des virgules: ne recalcule que les lignes touchées par ces produits")
+
+    def handle(self, *args, **opts):
+        idx = get_index()
+        if opts["products"]:
+            ids = [int(x) for x in opts["products"].split(",") if x.strip()]
+            table = refresh_neighbors(idx, ids)
+            if table is None:
+                raise CommandError("Neighbor table missing or stale for the current index: run a full build first")
+        else:
+            table = build_neighbors(idx, width=opts["width"], workers=opts["workers"], chunk=opts["chunk"])
+        self.stdout.write(self.style.SUCCESS(f"Product neighbors built: version={table.version}, n={table.ids.size}, width={table.width}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ml.products_index import compact_index
+
+
+class Command(BaseCommand):
+    help = "Fusionne les mises à jour incrémentales dans l'index produits (réapprend l'idf si la dérive dépasse le seuil); à planifier hors des processus web."
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--refit", dest="refit", action="store_const", const=True, default=None, help="Force la reconstruction complète (idf réappris)")
+        group.add_argument("--merge-only", dest="refit", action="store_const", const=False, help="Fusionne sans réapprendre l'idf")
+
+    def handle(self, *args, **opts):
+        action = compact_index(refit=opts["refit"])
+        self.stdout.write(self.style.SUCCESS(f"Product index compaction: {action}"))
@@ -1,13 +1,21 @@
 import json
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
 from catalog.models import Product
-from ml.products_index import load_or_build, read_manifest
-from ml.products_index import search as search_products
-from ml.utils import artifacts_dir
+from ml.inverted import ENGINES
+from ml.products_index import get_index, load_release, search_in
+from ml.utils import artifacts_dir, write_json_atomic
+
+METRICS = ("P@K", "recall@K", "MRR", "nDCG@K")
+# requêtes d'échauffement hors mesure: pages des memmaps, pool de threads des shards
+WARMUP_QUERIES = 5
 
 
 def _p_at_k(found_ids, expected_ids, k):
@@ -17,60 +25,173 @@ def _p_at_k(found_ids, expected_ids, k):
     return hits / float(k)
 
 
+def _recall_at_k(found_ids, expected_ids, k):
+    if not expected_ids:
+        return 0.0
+    return len(set(found_ids[:k]) & set(expected_ids)) / float(len(set(expected_ids)))
+
+
+def _reciprocal_rank(found_ids, expected_ids, k):
+    for i, pid in enumerate(found_ids[:k]):
+        if pid in expected_ids:
+            return 1.0 / (i + 1)
+    return 0.0
+
+
+def _ndcg_at_k(found_ids, expected_ids, k):
+    # pertinence binaire: gain 1 par produit attendu, escompté par log2(rang + 1)
+    dcg = sum(1.0 / math.log2(i + 2) for i, pid in enumerate(found_ids[:k]) if pid in expected_ids)
+    ideal = sum(1.0 / math.log2(i + 2) for i in range(min(len(set(expected_ids)), k)))
+    return dcg / ideal if ideal else 0.0
+
+
+def _latency_summary(samples_ms):
+    if not samples_ms:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(max(samples_ms)), 3)}
+
+
+def evaluate(idx, queries, slug_map, k, engine=None, workers=1):
+    """Évalue ``queries`` sur ``idx`` dans un pool de threads: (résultats par requête, métriques macro, latences)."""
+
+    def run(q):
+        expected_ids = [slug_map[s] for s in q.get("expected_slugs", []) if s in slug_map]
+        t0 = time.perf_counter()
+        hits = search_in(idx, q["q"], k=k, engine=engine)
+        latency_ms = (time.perf_counter() - t0) * 1000
+        found_ids = [h["product_id"] for h in hits]
+        return {
+            "q": q["q"],
+            "expected_slugs": q.get("expected_slugs", []),
+            "found_ids": found_ids,
+            "p_at_k": round(_p_at_k(found_ids, expected_ids, k), 4),
+            "recall_at_k": round(_recall_at_k(found_ids, expected_ids, k), 4),
+            "rr": round(_reciprocal_rank(found_ids, expected_ids, k), 4),
+            "ndcg_at_k": round(_ndcg_at_k(found_ids, expected_ids, k), 4),
+            "latency_ms": round(latency_ms, 3),
+        }
+
+    for q in queries[:WARMUP_QUERIES]:
+        search_in(idx, q["q"], k=k, engine=engine)
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="eval-search") as pool:
+        results = list(pool.map(run, queries))
+    n = max(len(results), 1)
+    metrics = {name: round(sum(r[key] for r in results) / n, 4) for name, key in zip(METRICS, ("p_at_k", "recall_at_k", "rr", "ndcg_at_k"), strict=True)}
+    return results, metrics, _latency_summary([r["latency_ms"] for r in results])
+
+
+def regressions(current, baseline, max_quality_drop, max_p95_increase, p95_slack_ms):
+    """Régressions de ``current`` par rapport à ``baseline`` (sections {"metrics", "latency"} d'un rapport; latency None: non comparée)."""
+    out = []
+    for name in METRICS:
+        before, after = baseline["metrics"].get(name), current["metrics"][name]
+        if before is not None and before - after > max_quality_drop:
+            out.append(f"{name} {before} -> {after} (drop > {max_quality_drop})")
+    if baseline["latency"] is None:
+        return out
+    before, after = baseline["latency"]["p95_ms"], current["latency"]["p95_ms"]
+    if after > before * (1 + max_p95_increase) + p95_slack_ms:
+        out.append(f"p95 {before}ms -> {after}ms (> +{int(max_p95_increase * 100)}% + {p95_slack_ms}ms)")
+    return out
+
+
 class Command(BaseCommand):
-    help = "Évalue la recherche produits (P@K) à partir d'un fichier JSON de paires requête→slugs attendus."
+    help = (
+        "Évalue la recherche produits (P@K, recall@K, MRR, nDCG@K, latences par requête) à partir d'un fichier JSON de paires requête→slugs attendus; "
+        "compare à une release conservée ou au rapport précédent et échoue en cas de régression."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("--file", type=str, default="src/ml/eval/queries_demo.json")
         parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--engine", choices=ENGINES, default=None, help="Force le moteur de recherche (défaut: celui de l'index)")
+        parser.add_argument("--workers", type=int, default=None, help="Threads d'évaluation (défaut: ML_EVAL_WORKERS)")
+        parser.add_argument("--baseline-release", dest="baseline_release", type=str, default=None, help="Release conservée évaluée côte à côte (identifiant ou 'previous')")
+        parser.add_argument("--baseline-report", dest="baseline_report", type=str, default=None, help="Rapport de référence (défaut: search_eval_latest.json s'il existe)")
+        parser.add_argument("--no-baseline", dest="no_baseline", action="store_true", help="N'applique aucune comparaison")
+        parser.add_argument("--max-quality-drop", dest="max_quality_drop", type=float, default=None, help="Baisse absolue tolérée par métrique (défaut: ML_EVAL_MAX_QUALITY_DROP)")
+        parser.add_argument("--max-p95-increase", dest="max_p95_increase", type=float, default=None, help="Hausse relative tolérée du p95 (défaut: ML_EVAL_MAX_P95_INCREASE)")
+        parser.add_argument("--p95-slack-ms", dest="p95_slack_ms", type=float, default=None, help="Marge absolue sur le p95, contre le bruit (défaut: ML_EVAL_P95_SLACK_MS)")
 
     def handle(self, *args, **opts):
         path = Path(opts["file"])
         k = int(opts["k"])
         if not path.exists():
-            self.stderr.write(self.style.ERROR(f"Fichier introuvable: {path}"))
-            return 1
+            raise CommandError(f"Fichier introuvable: {path}")
+        workers = opts["workers"] or settings.ML_EVAL_WORKERS
+        max_quality_drop = settings.ML_EVAL_MAX_QUALITY_DROP if opts["max_quality_drop"] is None else opts["max_quality_drop"]
+        max_p95_increase = settings.ML_EVAL_MAX_P95_INCREASE if opts["max_p95_increase"] is None else opts["max_p95_increase"]
+        p95_slack_ms = settings.ML_EVAL_P95_SLACK_MS if opts["p95_slack_ms"] is None else opts["p95_slack_ms"]
 
         queries = json.loads(path.read_text(encoding="utf-8"))
-        load_or_build()
-        manifest = read_manifest("product_index") or {"version": "0"}
+        idx = get_index()
 
         # Résoudre slugs -> ids
         needed_slugs = {s for q in queries for s in q.get("expected_slugs", [])}
         slug_map = {p.slug: p.id for p in Product.objects.filter(slug__in=list(needed_slugs)).only("id", "slug")}
 
-        results = []
-        scores = []
-        for q in queries:
-            text = q["q"]
-            expected_ids = [slug_map[s] for s in q.get("expected_slugs", []) if s in slug_map]
-            hits = search_products(text, k=k)
-            found_ids = [h["product_id"] for h in hits]
-            p_at_k = _p_at_k(found_ids, expected_ids, k)
-            scores.append(p_at_k)
-            results.append(
-                {
-                    "q": text,
-                    "expected_slugs": q.get("expected_slugs", []),
-                    "found_ids": found_ids,
-                    "p_at_k": round(p_at_k, 4),
-                }
-            )
-
-        macro = round(sum(scores) / len(scores), 4) if scores else 0.0
+        results, metrics, latency = evaluate(idx, queries, slug_map, k, opts.get("engine"), workers)
         report = {
-            "index_version": manifest.get("version", "0"),
+            # version de l'index évalué, pas du manifest relu (une publication a pu intervenir entre-temps)
+            "index_version": idx.version,
+            "built_at": idx.built_at,
+            "engine": opts.get("engine") or idx.engine,
             "k": k,
             "count": len(queries),
-            "macro_P@K": macro,
+            "workers": workers,
+            "warmup": min(WARMUP_QUERIES, len(queries)),
+            "macro_P@K": metrics["P@K"],
+            "metrics": metrics,
+            "latency": latency,
             "results": results,
             "timestamp": int(time.time()),
         }
 
         out_dir = artifacts_dir()
-        ts = int(time.time())
-        (out_dir / f"search_eval_{ts}.json").write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
-        (out_dir / "search_eval_latest.json").write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        baseline = None
+        if opts["baseline_release"] and not opts["no_baseline"]:
+            try:
+                base_idx = load_release(opts["baseline_release"])
+            except ValueError as exc:
+                raise CommandError(str(exc)) from exc
+            # les deux versions sont évaluées dans le même processus, sur les mêmes requêtes
+            base_results, base_metrics, base_latency = evaluate(base_idx, queries, slug_map, k, opts.get("engine"), workers)
+            baseline = {"source": "release", "index_version": base_idx.version, "built_at": base_idx.built_at, "metrics": base_metrics, "latency": base_latency, "results": base_results}
+        elif not opts["no_baseline"]:
+            previous = Path(opts["baseline_report"]) if opts["baseline_report"] else out_dir / "search_eval_latest.json"
+            if previous.exists():
+                prev = json.loads(previous.read_text(encoding="utf-8"))
+                # rapports antérieurs aux métriques détaillées: seule la P@K est comparable
+                if prev.get("k") == k and "latency" in prev:
+                    baseline = {"source": str(previous), "index_version": prev.get("index_version"), "metrics": prev["metrics"], "latency": prev["latency"]}
+                    # latences mesurées dans d'autres conditions: seules les métriques de pertinence sont comparées
+                    if (prev.get("workers"), prev.get("warmup")) != (workers, report["warmup"]):
+                        baseline["latency"] = None
+                        self.stdout.write(self.style.WARNING(f"Latences non comparées (threads ou échauffement différents): {previous}"))
+                else:
+                    self.stdout.write(self.style.WARNING(f"Rapport de référence ignoré (k ou format différent): {previous}"))
+            elif opts["baseline_report"]:
+                raise CommandError(f"Rapport de référence introuvable: {previous}")
+        failed = []
+        if baseline is not None:
+            failed = regressions(report, baseline, max_quality_drop, max_p95_increase, p95_slack_ms)
+            report["baseline"] = baseline
+            report["regressions"] = failed
+
+        ts = report["timestamp"]
+        write_json_atomic(out_dir / f"search_eval_{ts}.json", report)
+        if not failed:
+            # un rapport en régression ne devient pas la référence des évaluations suivantes
+            write_json_atomic(out_dir / "search_eval_latest.json", report)
 
-        self.stdout.write(self.style.SUCCESS(f"P@{k} macro={macro} sur {len(queries)} requêtes (version={report['index_version']})."))
-        self.stdout.write(self.style.SUCCESS(f"Rapport: {out_dir / 'search_eval_latest.json'}"))
+        summary = " ".join(f"{name}={value}" for name, value in metrics.items())
+        self.stdout.write(f"{summary} p50={latency['p50_ms']}ms p95={latency['p95_ms']}ms sur {len(queries)} requêtes (version={report['index_version']}, {workers} threads).")
+        if baseline is not None:
+            base_summary = " ".join(f"{name}={value}" for name, value in baseline["metrics"].items())
+            base_p95 = f" p95={baseline['latency']['p95_ms']}ms" if baseline["latency"] is not None else ""
+            self.stdout.write(f"Référence ({baseline['source']}, version={baseline['index_version']}): {base_summary}{base_p95}")
+        self.stdout.write(f"Rapport: {out_dir / f'search_eval_{ts}.json'}")
+        if failed:
+            raise CommandError("Régression de la recherche: " + "; ".join(failed))
+        self.stdout.write(self.style.SUCCESS(f"P@{k} macro={metrics['P@K']}: aucune régression."))
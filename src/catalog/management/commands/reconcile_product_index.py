@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ml.products_index import reconcile_index
+
+
+class Command(BaseCommand):
+    help = "Réconcilie l'index produits avec la base (présence, disponibilité, catégorie); à lancer périodiquement."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=2000, help="Produits lus (et corrigés) par lot")
+
+    def handle(self, *args, **opts):
+        drifted = reconcile_index(batch=opts["batch"])
+        self.stdout.write(self.style.SUCCESS(f"Product index reconciled: {drifted} product(s) corrected"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ml import assistant_index, products_index, releases
+from ml.utils import read_manifest
+
+INDEXES = {"products": products_index.INDEX_NAME, "assistant": assistant_index.INDEX_NAME}
+
+
+class Command(BaseCommand):
+    help = "Republie une version conservée d'un index (par défaut la précédente), ou liste les versions conservées."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index", choices=sorted(INDEXES), default="products")
+        parser.add_argument("--release", type=str, default=None, help="Release à republier (identifiant ou chemin relatif; défaut: la précédente)")
+        parser.add_argument("--list", action="store_true", help="Liste les releases conservées sans rien republier")
+
+    def handle(self, *args, **opts):
+        name = INDEXES[opts["index"]]
+        if opts["list"]:
+            current = (read_manifest(name) or {}).get("dir")
+            for rel in releases.releases(name):
+                self.stdout.write(f"{'*' if rel == current else ' '} {rel}")
+            return
+        try:
+            if opts["index"] == "products":
+                manifest = products_index.rollback_index(opts["release"])
+            else:
+                manifest = releases.rollback(name, opts["release"])
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(f"{name} rolled back: version={manifest['version']}, dir={manifest['dir']}"))
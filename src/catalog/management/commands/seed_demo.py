@@ -3,6 +3,7 @@ from decimal import Decimal
 from django.core.management.base import BaseCommand
 
 from catalog.models import Category, Product
+from catalog.signals import catalog_changes
 
 
 class Command(BaseCommand):
@@ -39,12 +40,14 @@ class Command(BaseCommand):
             ("Montre sport GPS", cat_sport, "Cardio, GPS, etanche 5 ATM, autonomy longue.", Decimal("129.00")),
         ]
 
-        for name, cat, desc, price in items:
-            Product.objects.get_or_create(
-                name=name,
-                category=cat,
-                slug=name.lower().replace(" ", "-"),
-                defaults={"description": desc, "price": price, "stock": 10},
-            )
+        # une seule mise à jour de l'index et une seule invalidation pour tout l'import
+        with catalog_changes():
+            for name, cat, desc, price in items:
+                Product.objects.get_or_create(
+                    name=name,
+                    category=cat,
+                    slug=name.lower().replace(" ", "-"),
+                    defaults={"description": desc, "price": price, "stock": 10},
+                )
 
         self.stdout.write(self.style.SUCCESS("Données de démo créées"))
@@ -0,0 +1,65 @@
+"""Réponses JSON pré-rendues: corps (et version gzip) mis en cache avec leur ETag, 304 sur If-None-Match."""
+
+import gzip
+import json
+import re
+from hashlib import blake2b
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+# même détection que django.middleware.gzip.GZipMiddleware
+_accepts_gzip = re.compile(r"\bgzip\b")
+
+
+def prerender(data):
+    """Entrée de cache de ``data``: corps JSON (rendu comme par la vue), ETag, corps gzip au-delà de ML_RESPONSE_GZIP_MIN_BYTES."""
+    body = JSONRenderer().render(data)
+    compressed = None
+    if settings.ML_RESPONSE_GZIP and len(body) >= settings.ML_RESPONSE_GZIP_MIN_BYTES:
+        # mtime fixe: mêmes octets pour le même corps
+        compressed = gzip.compress(body, compresslevel=6, mtime=0)
+    return {"body": body, "etag": blake2b(body, digest_size=16).hexdigest(), "gzip": compressed}
+
+
+def rendered_data(entry):
+    """Données d'une entrée pré-rendue (ou d'une entrée dict écrite avant le pré-rendu)."""
+    return json.loads(entry["body"]) if "body" in entry else entry
+
+
+def _matches(header, etag):
+    for token in header.split(","):
+        token = token.strip()
+        if token == "*":
+            return True
+        # comparaison faible (RFC 9110): le corps gzip porte le même condensat
+        token = token.removeprefix("W/").strip('"').removesuffix("-gzip")
+        if token == etag:
+            return True
+    return False
+
+
+def rendered_response(request, entry):
+    """Réponse HTTP d'une entrée de ``prerender``: 304 si l'ETag correspond, corps gzip si le client l'accepte."""
+    if "body" not in entry:
+        entry = prerender(entry)
+    if request.accepted_renderer.format != "json":
+        # API navigable: rendu habituel de DRF
+        return Response(rendered_data(entry), status=200)
+    gzipped = entry["gzip"] is not None and _accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    etag = f"{entry['etag']}-gzip" if gzipped else entry["etag"]
+    if _matches(request.META.get("HTTP_IF_NONE_MATCH", ""), entry["etag"]):
+        resp = HttpResponseNotModified()
+    elif gzipped:
+        resp = HttpResponse(entry["gzip"], content_type="application/json")
+        resp["Content-Encoding"] = "gzip"
+    else:
+        resp = HttpResponse(entry["body"], content_type="application/json")
+    resp["ETag"] = f'"{etag}"'
+    # pas de cache partagé (l'invalidation par étiquettes ne l'atteint pas); le client revalide à chaque fois par l'ETag
+    resp["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(resp, ("Accept", "Accept-Encoding"))
+    return resp
@@ -1,16 +1,125 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from ml.cache import bump_buster
+from ml import products_index
+from ml.cache import category_tag, invalidations, product_tag
+
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """Changements d'une transaction: un seul callback on_commit, qui réindexe puis invalide."""
+
+    def __init__(self, conn=None):
+        self.product_ids = set()
+        self.tags = set()
+        self.conn = conn
+        # file on_commit de la transaction: Django la remplace au commit et aux rollbacks (transaction ou savepoint)
+        self.queue = conn.run_on_commit if conn is not None else None
+        self.done = False
+
+    def add(self, product_ids, tags):
+        self.product_ids.update(product_ids)
+        self.tags.update(tags)
+
+    def open_in(self, conn):
+        # après le rollback d'un savepoint, un nouveau lot: celui-ci peut encore être appliqué (au pire en trop)
+        return not self.done and self.queue is conn.run_on_commit
+
+    def __call__(self):
+        self.done = True
+        if self.conn is not None and _state.open.get(self.conn.alias) is self:
+            del _state.open[self.conn.alias]
+        product_ids, tags = sorted(self.product_ids), set(self.tags)
+        if product_ids:
+            _refresh_index(product_ids)
+        # après la mise à jour de l'index: une réponse recalculée entre-temps serait encore l'ancienne.
+        # Écriture regroupée avec celles des commits voisins (ML_CACHE_INVALIDATION_DEBOUNCE)
+        try:
+            invalidations.add(tags)
+        except Exception:
+            logger.exception("CACHE_TAG_INVALIDATION_FAILED tags=%s", len(tags))
+
+
+class _State(threading.local):
+    def __init__(self):
+        # lot en attente de commit, par connexion
+        self.open = {}
+        # lot d'un bloc catalog_changes()
+        self.collecting = None
 
-from .models import Product
+
+_state = _State()
+
+
+def schedule_changes(product_ids=(), tags=()):
+    """Réindexe et invalide au commit de la transaction courante (au lot du bloc ``catalog_changes()`` s'il y en a un)."""
+    if _state.collecting is not None:
+        _state.collecting.add(product_ids, tags)
+        return
+    conn = transaction.get_connection()
+    if not conn.in_atomic_block:
+        batch = _Batch()
+        batch.add(product_ids, tags)
+        transaction.on_commit(batch)
+        return
+    batch = _state.open.get(conn.alias)
+    if batch is None or not batch.open_in(conn):
+        batch = _state.open[conn.alias] = _Batch(conn)
+        transaction.on_commit(batch)
+    batch.add(product_ids, tags)
+
+
+@contextmanager
+def catalog_changes():
+    """Regroupe les changements du bloc (imbriqué: rejoint le bloc englobant) en une mise à jour au commit."""
+    if _state.collecting is not None:
+        yield _state.collecting
+        return
+    batch = _state.collecting = _Batch()
+    try:
+        yield batch
+    finally:
+        _state.collecting = None
+        schedule_changes(batch.product_ids, batch.tags)
+
+
+def report_product_changes(product_ids, category_ids=()):
+    """Signale des produits modifiés sans ``save()``; ``category_ids``: catégories qui peuvent gagner des produits."""
+    product_ids = list(product_ids)
+    schedule_changes(product_ids, [product_tag(pk) for pk in product_ids] + [category_tag(pk) for pk in set(category_ids)])
+
+
+def _refresh_index(product_ids):
+    try:
+        products_index.apply_product_changes(product_ids)
+    except Exception:
+        # l'index sera rattrapé par la prochaine compaction/reconstruction: ne jamais faire échouer l'écriture
+        logger.exception("PRODUCT_INDEX_DELTA_FAILED product_ids=%s", product_ids)
 
 
 @receiver(post_save, sender=Product)
-def _on_product_save(sender, instance, **kwargs):
-    bump_buster()
+def _on_product_save(sender, instance, created, **kwargs):
+    tags = [product_tag(instance.pk)]
+    if created:
+        # un nouveau produit peut entrer dans des résultats qui ne le mentionnent pas encore: ceux de sa catégorie
+        tags.append(category_tag(instance.category_id))
+    schedule_changes([instance.pk], tags)
 
 
 @receiver(post_delete, sender=Product)
 def _on_product_delete(sender, instance, **kwargs):
-    bump_buster()
+    schedule_changes([instance.pk], [product_tag(instance.pk)])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def _on_category_change(sender, instance, **kwargs):
+    schedule_changes(tags=[category_tag(instance.pk)])
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+import pytest
+
+from catalog.models import Category, Product
+from ml import assistant_index, dense, neighbors, products_index
+
+WORDS = ["casque", "enceinte", "micro", "clavier", "souris", "ecran", "lampe", "montre", "chaise", "bureau"]
+
+
+def _describe(i, words):
+    return f"{words[i % 8]} {words[(i + 1) % 8]} {words[(i + 3) % 8]} modele {i % 7}"
+
+
+@pytest.fixture(autouse=True)
+def artifacts(settings, tmp_path):
+    """Artefacts d'index du test dans ``tmp_path``, index résidents vidés avant et après."""
+    settings.ML_ARTIFACTS_DIR = tmp_path / "artifacts"
+    holders = (products_index._holder, assistant_index._holder, dense._holder, neighbors._holder)
+    for holder in holders:
+        holder.clear()
+    yield settings.ML_ARTIFACTS_DIR
+    for holder in holders:
+        holder.clear()
+
+
+@pytest.fixture
+def make_catalog(db):
+    """Crée ``n`` produits ``p-i`` d'une catégorie, sans signaux."""
+
+    def make(n, describe=_describe, category="audio"):
+        cat = Category.objects.bulk_create([Category(name=category.title(), slug=category)])[0]
+        products = [Product(category=cat, name=f"Produit {i}", slug=f"p-{i}", price=Decimal("10.00"), description=describe(i, WORDS), stock=5) for i in range(n)]
+        return Product.objects.bulk_create(products)
+
+    return make
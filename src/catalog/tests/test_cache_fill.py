@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.core.cache import cache
+
+from ml import cache as ml_cache
+from ml.cache import fill, invalidate_tags
+
+
+@pytest.fixture(autouse=True)
+def _clear(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(ml_cache, "CLOCK_SKEW", 0)
+
+
+def _slow(calls, value, delay=0.2, tags=("product:1",)):
+    def compute():
+        calls.append(threading.current_thread().name)
+        time.sleep(delay)
+        return value, tags
+
+    return compute
+
+
+def test_concurrent_misses_compute_once():
+    calls = []
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: fill("k", _slow(calls, {"v": 1}), timeout=60), range(8)))
+    assert len(calls) == 1 and results == [{"v": 1}] * 8
+    assert ml_cache.fill_stats()["in_flight"] == 0
+
+
+def test_stale_value_served_while_one_worker_refreshes():
+    # expirée (durée de fraîcheur nulle) mais encore dans le cache partagé
+    fill("k", lambda: ({"v": 1}, ["product:1"]), timeout=0)
+    calls = []
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        leader = pool.submit(fill, "k", _slow(calls, {"v": 2}), 60)
+        time.sleep(0.05)
+        others = [pool.submit(fill, "k", _slow(calls, {"v": 3}), 60) for _ in range(5)]
+        assert [f.result() for f in others] == [{"v": 1}] * 5
+        assert leader.result() == {"v": 2}
+    assert len(calls) == 1 and fill("k", _slow(calls, {"v": 4}), 60) == {"v": 2}
+
+
+def test_invalidated_value_is_never_served():
+    fill("k", lambda: ({"v": 1}, ["product:1"]), timeout=60)
+    time.sleep(0.01)
+    invalidate_tags(["product:1"])
+    stale, calls = ml_cache.fill_stats()["stale"], []
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda _: fill("k", _slow(calls, {"v": 2}), 60), range(6)))
+    assert results == [{"v": 2}] * 6 and len(calls) == 1
+    assert ml_cache.fill_stats()["stale"] == stale
+
+
+def test_other_process_holding_the_lock(settings):
+    settings.ML_CACHE_FILL_WAIT = 0.3
+    cache.add("lock:k", 1, timeout=10)
+    publisher = threading.Timer(0.05, lambda: ml_cache.set_tagged("k", "theirs", [], time.time(), 60))
+    publisher.start()
+    calls = []
+    assert fill("k", _slow(calls, "mine", delay=0), 60) == "theirs" and calls == []
+    # verrou jamais libéré ni valeur publiée: calcul local après l'attente
+    cache.delete("k")
+    assert fill("k", _slow(calls, "mine", delay=0), 60) == "mine" and len(calls) == 1
+
+
+def test_uncacheable_and_lock_fallback(monkeypatch):
+    calls = []
+    assert fill("k", _slow(calls, [], delay=0, tags=None), 60) == [] and cache.get("k") is None
+
+    def down(*args, **kwargs):
+        raise ConnectionError
+
+    monkeypatch.setattr(cache, "add", down)
+    assert fill("k", _slow(calls, "v", delay=0), 60) == "v" and len(calls) == 2
+    assert ml_cache.fill_stats()["lock_errors"] >= 1
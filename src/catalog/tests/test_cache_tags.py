@@ -0,0 +1,84 @@
+import time
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+
+from catalog.models import Category, Product
+from ml import cache as ml_cache
+from ml import products_index
+from ml.cache import get_tagged, invalidate_tags, set_tagged
+
+
+@pytest.fixture
+def catalog(settings, monkeypatch, django_capture_on_commit_callbacks):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    settings.ML_CACHE_INVALIDATION_DEBOUNCE = 0
+    # sans marge d'horloge: les entrées calculées dans la seconde qui suit la création du catalogue restent valides
+    monkeypatch.setattr(ml_cache, "CLOCK_SKEW", 0)
+    cache.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        audio = Category.objects.create(name="Audio", slug="audio")
+        maison = Category.objects.create(name="Maison", slug="maison")
+        items = [(audio, "Casque HiFi", "casque audio"), (audio, "Casque gaming", "casque micro"), (maison, "Lampe", "lampe bureau"), (maison, "Chaise", "chaise bureau")]
+        prods = [Product.objects.create(category=c, name=n, slug=f"p{i}", price=Decimal("10.00"), description=d, stock=3) for i, (c, n, d) in enumerate(items)]
+    products_index.build_index()
+    return prods
+
+
+def test_tagged_entry_is_dropped_only_by_its_tags():
+    cache.clear()
+    set_tagged("k1", {"a": 1}, ["product:1", "category:2"], since=0, timeout=60)
+    set_tagged("k2", {"b": 2}, ["product:3"], since=0, timeout=60)
+    assert invalidate_tags(["product:1"]) == 1
+    assert get_tagged("k1") is None and get_tagged("k2") == {"b": 2}
+    # calculée après l'invalidation: valide
+    set_tagged("k1", {"a": 1}, ["product:1"], since=time.time() + 2, timeout=60)
+    assert get_tagged("k1") == {"a": 1}
+
+
+@pytest.mark.django_db
+def test_product_save_invalidates_only_entries_that_mention_it(client, catalog, monkeypatch, django_capture_on_commit_callbacks):
+    casque, _, lampe, _ = catalog
+    first = {q: client.get("/api/v1/search/", {"q": q, "k": 2}).json() for q in ("casque", "bureau")}
+    calls = []
+    search = products_index.search
+    monkeypatch.setattr(products_index, "search", lambda **kw: calls.append(kw["q"]) or search(**kw))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        lampe.name = "Lampe LED"
+        lampe.save()
+    assert client.get("/api/v1/search/", {"q": "casque", "k": 2}).json() == first["casque"]
+    bureau = client.get("/api/v1/search/", {"q": "bureau", "k": 2}).json()
+    assert calls == ["bureau"] and "Lampe LED" in [r["name"] for r in bureau["results"]]
+
+
+@pytest.mark.django_db
+def test_invalidations_are_batched_at_commit(catalog, monkeypatch, django_capture_on_commit_callbacks):
+    batches = []
+    monkeypatch.setattr(products_index, "apply_product_changes", lambda ids: batches.append(("index", ids)))
+    monkeypatch.setattr(ml_cache.invalidations, "add", lambda tags: batches.append(("tags", sorted(tags))))
+    casque, gaming, _, _ = catalog
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with transaction.atomic():
+            for p in (casque, gaming, casque):
+                p.stock += 1
+                p.save()
+            new = Product.objects.create(category=casque.category, name="Micro", slug="micro", price=Decimal("5.00"), stock=1)
+    # un seul callback pour la transaction, une seule mise à jour de l'index et un seul set_many des étiquettes
+    assert len(callbacks) == 1
+    ids = sorted([casque.id, gaming.id, new.id])
+    assert batches == [("index", ids), ("tags", sorted([f"product:{i}" for i in ids] + [f"category:{casque.category_id}"]))]
+
+    # lot annulé avec sa transaction: rien n'est appliqué
+    batches.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        try:
+            with transaction.atomic():
+                gaming.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        casque.save()
+    assert batches == [("index", [casque.id]), ("tags", [f"product:{casque.id}"])]
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+from django.core.cache import cache
+
+from ml import cache as ml_cache
+from ml.cache import LocalTier, get_many_tagged, get_tagged, invalidate_tags, set_tagged, tier_stats
+
+
+@pytest.fixture
+def local(settings, monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(ml_cache, "CLOCK_SKEW", 0)
+    settings.ML_CACHE_LOCAL_ENTRIES = 8
+    settings.ML_CACHE_LOCAL_TTL = 60
+    return settings
+
+
+def _count_shared(monkeypatch):
+    calls = []
+    get_many = cache.get_many
+    monkeypatch.setattr(cache, "get_many", lambda keys: calls.append(list(keys)) or get_many(keys))
+    monkeypatch.setattr(cache, "get", lambda *a, **kw: calls.append(a) or None)
+    return calls
+
+
+def test_local_hits_skip_the_shared_cache(local, monkeypatch):
+    set_tagged("a", {"v": 1}, ["product:1"], time.time(), 60)
+    cache.set("b", {"value": {"v": 2}, "tags": [], "at": time.time(), "fresh_until": time.time() + 60}, 60)
+    before = tier_stats()
+    assert get_many_tagged(["a", "b", "c"]) == {"a": {"v": 1}, "b": {"v": 2}}
+    calls = _count_shared(monkeypatch)
+    assert get_tagged("a") == {"v": 1} and get_tagged("b") == {"v": 2} and calls == []
+    after = tier_stats()
+    assert after["local"]["hits"] - before["local"]["hits"] == 3
+    assert after["shared"]["hits"] - before["shared"]["hits"] == 1 and after["shared"]["misses"] - before["shared"]["misses"] == 1
+
+
+def test_local_invalidation_is_immediate_remote_after_ttl(local):
+    set_tagged("a", "v", ["product:1"], time.time(), 60)
+    set_tagged("b", "w", ["product:2"], time.time(), 60)
+    invalidate_tags(["product:1"])
+    assert get_tagged("a") is None and get_tagged("b") == "w"
+
+    # invalidation écrite par un autre processus: vue à la prochaine relecture du cache partagé
+    local.ML_CACHE_LOCAL_TTL = 0.05
+    set_tagged("b", "w", ["product:2"], time.time() - 1, 60)
+    cache.set("tag:product:2", time.time(), 60)
+    assert get_tagged("b") == "w"
+    time.sleep(0.06)
+    assert get_tagged("b") is None
+
+
+def test_lru_bounded_by_entries_and_bytes():
+    tier = LocalTier(entries=3, max_bytes=2000, ttl=60)
+    for i in range(4):
+        tier.put(f"k{i}", {"value": i, "tags": []})
+    assert tier.get("k0") is None and tier.get("k1") is not None and tier.stats()["size"] == 3
+    tier.put("big", {"value": {"body": b"x" * 1000, "gzip": None}, "tags": []})
+    assert tier.nbytes <= 2000 and tier.get("big") is not None and tier.get("k2") is None
+    tier.put("huge", {"value": {"body": b"x" * 5000, "gzip": None}, "tags": []})
+    assert tier.get("huge") is None and tier.get("big") is not None
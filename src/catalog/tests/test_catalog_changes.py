@@ -0,0 +1,75 @@
+import time
+from decimal import Decimal
+
+import pytest
+
+from catalog.models import Category, Product
+from catalog.signals import catalog_changes
+from ml import cache as ml_cache
+from ml import products_index
+from ml.cache import InvalidationQueue
+
+
+@pytest.fixture
+def flushes(settings, monkeypatch):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    settings.ML_CACHE_INVALIDATION_DEBOUNCE = 0
+    out = []
+    monkeypatch.setattr(products_index, "apply_product_changes", lambda ids: out.append(("index", ids)))
+    monkeypatch.setattr(ml_cache.invalidations, "add", lambda tags: out.append(("tags", sorted(tags))))
+    return out
+
+
+@pytest.mark.django_db
+def test_bulk_block_flushes_once(flushes, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        cat = Category.objects.create(name="Audio", slug="audio")
+    flushes.clear()
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with catalog_changes():
+            prods = [Product.objects.create(category=cat, name=f"P{i}", slug=f"p{i}", price=Decimal("1.00")) for i in range(3)]
+            # bloc imbriqué: rejoint le bloc englobant
+            with catalog_changes():
+                prods[0].save()
+    ids = sorted(p.id for p in prods)
+    assert len(callbacks) == 1
+    assert flushes == [("index", ids), ("tags", sorted([f"product:{i}" for i in ids] + [f"category:{cat.id}"]))]
+
+
+@pytest.mark.django_db
+def test_admin_bulk_actions_report_changes(admin_client, flushes, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        cat = Category.objects.create(name="Audio", slug="audio")
+        prods = [Product.objects.create(category=cat, name=f"P{i}", slug=f"p{i}", price=Decimal("1.00"), is_active=False) for i in range(2)]
+    ids = sorted(p.id for p in prods)
+    flushes.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        admin_client.post("/admin/catalog/product/", {"action": "activate", "_selected_action": ids})
+    assert Product.objects.filter(is_active=True).count() == 2
+    assert flushes == [("index", ids), ("tags", sorted([f"product:{i}" for i in ids] + [f"category:{cat.id}"]))]
+
+    flushes.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        admin_client.post("/admin/catalog/product/", {"action": "deactivate", "_selected_action": ids[:1]})
+    assert flushes == [("index", ids[:1]), ("tags", [f"product:{ids[0]}"])]
+
+
+def test_invalidation_queue_coalesces(settings, monkeypatch):
+    settings.ML_CACHE_INVALIDATION_DEBOUNCE = 0.05
+    settings.ML_CACHE_INVALIDATION_MAX_DELAY = 5
+    written = []
+    monkeypatch.setattr(ml_cache, "invalidate_tags", lambda tags: written.append(sorted(tags)) or len(tags))
+    queue = InvalidationQueue()
+    for tag in ("product:1", "product:2", "product:1", "category:3"):
+        queue.add([tag])
+    assert written == [] and queue.pending() == 3
+    deadline = time.monotonic() + 2
+    while not written and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert written == [["category:3", "product:1", "product:2"]]
+    assert queue.stats()["flushes"] == 1 and queue.pending() == 0
+
+    # sans délai: écriture immédiate
+    settings.ML_CACHE_INVALIDATION_DEBOUNCE = 0
+    queue.add(["product:4"])
+    assert written[-1] == ["product:4"]
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ml import assistant_index, releases
+from ml.text import normalize
+from ml.utils import read_manifest
+
+
+def _write(root, rel, text, age=60):
+    p = root / rel
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text, encoding="utf-8")
+    # date dans le passé: hors de la fenêtre où une modification peut passer inaperçue
+    t = time.time() - age
+    os.utime(p, (t, t))
+
+
+def _corpus(settings, tmp_path):
+    settings.ML_ASSISTANT_CORPUS_DIR = tmp_path / "corpus"
+    settings.ML_ARTIFACTS_DIR = tmp_path / "artifacts"
+    root = settings.ML_ASSISTANT_CORPUS_DIR
+    _write(root, "retours.md", "Politique de retour\n\nRetour gratuit sous 30 jours.")
+    _write(root, "faq/livraison.txt", "Livraison en 48h.\r\n\r\nSuivi du colis par email.")
+    _write(root, "garantie.md", "Garantie deux ans sur les produits.")
+    return root
+
+
+def test_incremental_rebuild_rechunks_only_changed_files(settings, tmp_path, monkeypatch):
+    root = _corpus(settings, tmp_path)
+    first = assistant_index.build_index()
+    assert read_manifest("assistant_index")["build"] == {"incremental": False, "added": 3, "changed": 0, "removed": 0, "reused": 0}
+    assert first.files["faq/livraison.txt"]["chunks"] == [0, 2]
+    assert first.chunks[1] == normalize("Suivi du colis par email.")
+
+    _write(root, "garantie.md", "Garantie trois ans sur les produits.")
+    _write(root, "paiement.md", "Paiement par carte.\n\nPaiement en trois fois.")
+    (root / "retours.md").unlink()
+    rechunked = []
+    chunk_text = assistant_index._chunk_text
+    monkeypatch.setattr(assistant_index, "_chunk_text", lambda data: rechunked.append(data) or chunk_text(data))
+    updated = assistant_index.build_index()
+    assert len(rechunked) == 2
+    assert read_manifest("assistant_index")["build"] == {"incremental": True, "added": 1, "changed": 1, "removed": 1, "reused": 1}
+
+    full = assistant_index.build_index(incremental=False)
+    assert updated.ids == full.ids and updated.chunks == full.chunks and updated.meta == full.meta
+    assert abs(updated.X - full.X).max() == 0 and np.array_equal(updated.vectorizer.idf_, full.vectorizer.idf_)
+    assert assistant_index.retrieve("paiement en trois fois", k=1)[0]["chunk_id"] == "paiement.md:1"
+
+
+def test_unchanged_corpus_is_not_reindexed(settings, tmp_path, monkeypatch):
+    root = _corpus(settings, tmp_path)
+    idx = assistant_index.build_index()
+    stamp, release = read_manifest("assistant_index")["timestamp"], read_manifest("assistant_index")["dir"]
+    assert not assistant_index.pending_changes(idx)
+    monkeypatch.setattr(assistant_index, "save_index", lambda *a, **k: (_ for _ in ()).throw(AssertionError("rebuilt")))
+    assert assistant_index.build_index().ids == idx.ids
+    assert read_manifest("assistant_index")["timestamp"] == stamp
+
+    # date modifiée, contenu identique: relu et haché, mais rien n'est redécoupé ni réécrit hormis le manifest
+    _write(root, "garantie.md", "Garantie deux ans sur les produits.", age=30)
+    assert assistant_index.pending_changes(idx)
+    again = assistant_index.build_index(version="v2")
+    assert again.ids == idx.ids and read_manifest("assistant_index")["version"] == "v2"
+    # republié comme une release: même répertoire, copie du manifest à jour
+    manifest = read_manifest("assistant_index")
+    assert manifest["dir"] == release and json.loads((Path(settings.ML_ARTIFACTS_DIR) / release / releases.RELEASE_MANIFEST).read_text(encoding="utf-8")) == manifest
+    assert not assistant_index.pending_changes(again)
@@ -0,0 +1,23 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+
+from ml import products_index
+from ml.utils import read_manifest
+
+
+def test_bench_index_writes_report_without_touching_published_index(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    call_command("bench_index", sizes="300,600", k="5,20", queries=15, stdout=StringIO())
+    report = json.loads((tmp_path / "bench_index_latest.json").read_text(encoding="utf-8"))
+    assert [row["n"] for row in report["sizes"]] == [300, 600]
+    row = report["sizes"][1]
+    assert row["build_ms"] >= 0 and row["peak_rss_bytes"] > 0 and row["artifact_bytes"] > 0 and row["dim"] > 0
+    for fn in ("search", "recommend", "recommend_mmr"):
+        assert set(row["latency"][fn]) == {"5", "20"}
+        lat = row["latency"][fn]["20"]
+        assert lat["count"] == 15 and lat["p50_ms"] <= lat["p95_ms"] <= lat["p99_ms"]
+    # index de bench construits à part, puis supprimés
+    assert read_manifest(products_index.INDEX_NAME) is None
+    assert not any((tmp_path / "bench").iterdir())
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from django.test import Client
+
+from catalog.models import Product
+from ml import dense, products_index
+from ml.utils import read_manifest
+
+
+def _describe(i, words):
+    return f"{words[i % 10]} {words[(i * 3 + 1) % 10]} {words[(i * 7 + 2) % 10]} serie {i % 6}"
+
+
+@pytest.mark.django_db
+def test_dense_build_records_recall_and_serves_search_and_reco(make_catalog):
+    make_catalog(80, _describe, "maison")
+    idx = products_index.build_index()
+    table = dense.build_dense(idx, dims=8, nlist=6, nprobe=2, sample=30)
+    assert table.embeddings.dtype == np.float32 and table.embeddings.shape == (80, 8)
+    assert sorted(table.list_rows.tolist()) == list(range(80))
+    quality = read_manifest(dense.DENSE_NAME)["quality"]
+    assert quality["recall_sample"] == 30 and 0 < quality["recall_vs_exact"] <= 1 and 0 < quality["recall_vs_dense"] <= 1
+
+    hits = products_index.search("casque micro", k=5, dense=True)
+    assert len(hits) == 5 and hits[0]["score"] > 0
+    pid = Product.objects.order_by("id").first().id
+    recs = products_index.recommend(pid, k=5, dense=True)
+    assert len(recs) == 5 and pid not in {r["product_id"] for r in recs}
+    assert len(products_index.recommend_mmr(pid, k=5, dense=True)) == 5
+
+    # toutes les listes sondées: recherche dense exhaustive
+    q = dense.row_vector(idx, table, 3)
+    exhaustive = np.argsort(-(table.embeddings @ q), kind="stable")
+    pos, sc = dense.search_vectors(idx, table, q, 5, nprobe=table.nlist)
+    assert pos.tolist() == [p for p in exhaustive.tolist() if table.embeddings[p] @ q > 0][:5]
+    assert np.all(np.diff(sc) <= 0)
+
+
+@pytest.mark.django_db
+def test_dense_follows_delta_and_falls_back_when_stale(make_catalog, settings):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(80, _describe, "maison")
+    idx = products_index.build_index()
+    dense.build_dense(idx, dims=8, nlist=4, sample=10)
+    p, gone = Product.objects.order_by("id")[5], Product.objects.order_by("id")[6].id
+    p.description = "bureau bureau chaise"
+    p.save()
+    Product.objects.filter(id=gone).delete()
+    products_index.apply_product_changes([p.id, gone])
+    hits = products_index.search("bureau chaise", k=80, dense=True, nprobe=4)
+    ids = [h["product_id"] for h in hits]
+    assert p.id in ids[:10] and gone not in ids
+
+    # fusion du delta: la table suit la nouvelle base, mêmes résultats
+    assert products_index.compact_index(refit=False) == "merge"
+    assert dense.get_table().current_for(products_index.get_index())
+    # (à position près pour les égalités: les lignes du delta passent en fin de base)
+    assert {h["product_id"]: round(h["score"], 5) for h in products_index.search("bureau chaise", k=80, dense=True, nprobe=4)} == {h["product_id"]: round(h["score"], 5) for h in hits}
+
+    # nouvelle base: la table n'est plus à jour, la recherche exacte prend le relais
+    products_index.build_index()
+    assert not dense.get_table().current_for(products_index.get_index())
+    assert products_index.search("bureau chaise", k=5, dense=True) == products_index.search("bureau chaise", k=5)
+
+
+@pytest.mark.django_db
+def test_search_view_mode_param(make_catalog):
+    make_catalog(20, _describe, "maison")
+    dense.build_dense(products_index.build_index(), dims=4, sample=5)
+    client = Client()
+    assert client.get("/api/v1/search/", {"q": "casque", "mode": "dense", "nprobe": 2}).status_code == 200
+    assert client.get("/api/v1/search/", {"q": "casque", "mode": "nope"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_delta_rows_are_projected_once_per_published_segment(make_catalog, settings, monkeypatch):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(40, _describe, "maison")
+    dense.build_dense(products_index.build_index(), dims=8, nlist=4, sample=10)
+    p = Product.objects.order_by("id")[5]
+    p.description = "bureau bureau chaise"
+    p.save()
+    products_index.apply_product_changes([p.id])
+    calls = []
+    project = dense.project
+    monkeypatch.setattr(dense, "project", lambda X, components: calls.append(X.shape[0]) or project(X, components))
+    for _ in range(3):
+        assert products_index.search("bureau chaise", k=5, dense=True, nprobe=4)[0]["product_id"] == p.id
+        products_index.recommend(p.id, k=3, dense=True)
+    # seules les requêtes sont projetées (une ligne chacune), jamais le delta
+    assert set(calls) == {1} and len(calls) == 3
@@ -0,0 +1,74 @@
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from catalog.management.commands.eval_search import regressions
+from catalog.models import Product
+from ml import products_index
+from ml.utils import artifacts_dir
+
+
+def _queries(tmp_path, products):
+    # une requête par produit: son seul mot distinctif
+    path = tmp_path / "queries.json"
+    path.write_text(json.dumps([{"q": p.description.split()[0], "expected_slugs": [p.slug]} for p in products]), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.django_db
+def test_eval_search_metrics_and_release_regression(make_catalog, tmp_path):
+    products = make_catalog(10, lambda i, words: f"{words[i]} modele {i}")
+    products_index.build_index()
+    queries = _queries(tmp_path, products)
+    call_command("eval_search", file=queries, k=3, workers=3, stdout=StringIO())
+    report = json.loads((artifacts_dir() / "search_eval_latest.json").read_text(encoding="utf-8"))
+    assert report["metrics"] == {"P@K": round(1 / 3, 4), "recall@K": 1.0, "MRR": 1.0, "nDCG@K": 1.0}
+    idx = products_index.get_index()
+    assert (report["index_version"], report["built_at"], report["engine"]) == (idx.version, idx.built_at, idx.engine)
+    assert report["count"] == 10 and all(r["latency_ms"] >= 0 for r in report["results"])
+    assert report["latency"]["p50_ms"] <= report["latency"]["p95_ms"] <= report["latency"]["p99_ms"]
+
+    # nouvelle release dégradée: la moitié des produits ne contient plus son mot
+    for p in Product.objects.filter(slug__in=[p.slug for p in products[:5]]):
+        p.description = "article generique"
+        p.name = "Article"
+        p.save()
+    products_index.build_index()
+    with pytest.raises(CommandError, match="recall@K"):
+        call_command("eval_search", file=queries, k=3, baseline_release="previous", max_p95_increase=100, stdout=StringIO())
+    # la release précédente a été évaluée côte à côte; le rapport en régression ne remplace pas la référence
+    latest = json.loads((artifacts_dir() / "search_eval_latest.json").read_text(encoding="utf-8"))
+    assert latest["timestamp"] == report["timestamp"]
+
+
+@pytest.mark.django_db
+def test_latency_is_compared_only_under_the_same_conditions(make_catalog, tmp_path):
+    products = make_catalog(10, lambda i, words: f"{words[i]} modele {i}")
+    products_index.build_index()
+    queries = _queries(tmp_path, products)
+    call_command("eval_search", file=queries, k=3, workers=2, stdout=StringIO())
+    # marge négative: toute comparaison de latence échoue
+    with pytest.raises(CommandError, match="p95"):
+        call_command("eval_search", file=queries, k=3, workers=2, p95_slack_ms=-1000, stdout=StringIO())
+    out = StringIO()
+    call_command("eval_search", file=queries, k=3, workers=1, p95_slack_ms=-1000, stdout=out)
+    assert "Latences non comparées" in out.getvalue()
+    report = json.loads((artifacts_dir() / "search_eval_latest.json").read_text(encoding="utf-8"))
+    assert report["workers"] == 1 and report["warmup"] == 5 and report["baseline"]["latency"] is None
+
+
+def test_regressions_thresholds():
+    base = {"metrics": {"P@K": 0.5, "MRR": 0.8}, "latency": {"p95_ms": 10.0}}
+    ok = {"metrics": {"P@K": 0.49, "recall@K": 0.1, "MRR": 0.8, "nDCG@K": 0.1}, "latency": {"p95_ms": 12.5}}
+    assert regressions(ok, base, 0.02, 0.2, 1.0) == []
+    slow = {"metrics": {"P@K": 0.4, "recall@K": 0.1, "MRR": 0.8, "nDCG@K": 0.1}, "latency": {"p95_ms": 13.5}}
+    assert [r.split()[0] for r in regressions(slow, base, 0.02, 0.2, 1.0)] == ["P@K", "p95"]
+
+
+@pytest.mark.django_db
+def test_eval_search_missing_file():
+    with pytest.raises(CommandError):
+        call_command("eval_search", file="/nonexistent.json", stdout=StringIO())
@@ -0,0 +1,258 @@
+import json
+import mmap
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from django.core.management import call_command
+
+from catalog.models import Category, Product
+from ml import products_index
+from ml.holder import IndexHolder
+from ml.scoring import postings
+from ml.utils import write_manifest
+
+
+def _seed():
+    c = Category.objects.create(name="Audio", slug="audio")
+    a = Product.objects.create(category=c, name="Casque Bluetooth", slug="casque-bt", price=Decimal("79.00"), description="Casque sans fil bluetooth", stock=5)
+    b = Product.objects.create(category=c, name="Enceinte portable", slug="enceinte", price=Decimal("59.00"), description="Enceinte bluetooth etanche", stock=5)
+    return a, b
+
+
+def test_holder_loads_once_and_reloads_on_manifest_change(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    calls = []
+
+    def loader(previous):
+        calls.append(previous)
+        return f"v{len(calls)}"
+
+    write_manifest("dummy_index", {"version": "1"})
+    holder = IndexHolder("dummy_index", loader, len)
+    assert holder.get() == "v1"
+    assert holder.get() == "v1"
+    assert len(calls) == 1
+    write_manifest("dummy_index", {"version": "2"})
+    assert holder.get() == "v2"
+    assert calls == [None, "v1"]
+    assert holder.stats()["loads"] == 2 and holder.stats()["resident_bytes"] == 2
+
+
+def test_holder_first_load_can_build_and_publish(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    holder = IndexHolder("dummy_index", lambda _previous: None, len)
+
+    def build(_previous):
+        write_manifest("dummy_index", {"version": "built"})
+        holder.publish("built")
+        return "built"
+
+    holder._loader = build
+    assert holder.get() == "built"
+
+
+def test_background_reload_keeps_serving_without_blocking(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    release = threading.Event()
+
+    def loader(previous):
+        if previous is not None:
+            release.wait(5)
+        return "v2" if previous else "v1"
+
+    write_manifest("dummy_index", {"version": "1"})
+    holder = IndexHolder("dummy_index", loader, len, background=True)
+    assert holder.get() == "v1"
+    write_manifest("dummy_index", {"version": "2"})
+    # rechargement en cours: les lectures servent l'ancien index sans attendre, publish() n'est pas bloqué non plus
+    t0 = time.monotonic()
+    assert holder.get() == "v1" and holder.get() == "v1" and holder.stats()["reloading"]
+    holder.publish("v3")
+    assert time.monotonic() - t0 < 1 and holder.get() == "v3"
+    # le chargement dépassé par publish() n'est pas installé
+    release.set()
+    deadline = time.monotonic() + 5
+    while holder.stats()["reloading"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert holder.get() == "v3"
+
+
+@pytest.mark.django_db
+def test_search_uses_resident_index(monkeypatch):
+    a, _ = _seed()
+    products_index.build_index(version="resident-v")
+
+    def _fail(_previous):
+        raise AssertionError("l'index ne doit pas être rechargé à chaque requête")
+
+    monkeypatch.setattr(products_index._holder, "_loader", _fail)
+    hits = products_index.search("casque", k=2)
+    assert hits[0]["product_id"] == a.id
+    stats = products_index.index_stats()
+    assert stats["version"] == "resident-v" and stats["resident_bytes"] > 0
+
+
+@pytest.mark.django_db
+def test_index_roundtrip_is_pickle_free_and_memory_mapped(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    a, b = _seed()
+    built = products_index.build_index(version="npy-v")
+    assert not list(tmp_path.rglob("*.pkl"))
+    manifest = products_index.read_manifest("product_index")
+    assert manifest["arrays"]["X_data"]["dtype"] and manifest["arrays"]["ids"]["sha256"]
+    loaded = products_index.load_index(verify=True)
+    base = loaded.X.data
+    while getattr(base, "base", None) is not None:
+        base = base.base
+    assert isinstance(base, mmap.mmap) and not loaded.X.data.flags.writeable
+    assert loaded.ids.tolist() == built.ids.tolist()
+    q = ["casque bluetooth etanche"]
+    assert abs(loaded.vectorizer.transform(q) - built.vectorizer.transform(q)).max() == 0
+
+
+@pytest.mark.django_db
+def test_maxscore_engine_matches_exact_on_eval_queries():
+    call_command("seed_demo")
+    products_index.build_index(version="engine-v", engine="maxscore")
+    assert products_index.read_manifest("product_index")["engine"] == "maxscore"
+    queries = json.loads((Path(__file__).resolve().parents[2] / "ml" / "eval" / "queries_demo.json").read_text(encoding="utf-8"))
+    for q in [x["q"] for x in queries] + ["casque bluetooth", "ecran 27 pouces ips"]:
+        assert products_index.search(q, k=5) == products_index.search(q, k=5, engine="exact")
+
+
+@pytest.mark.django_db
+def test_incremental_updates_make_new_products_searchable(settings, django_capture_on_commit_callbacks):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    with django_capture_on_commit_callbacks(execute=True):
+        a, b = _seed()
+    products_index.build_index(version="delta-v")
+    c = Category.objects.get(slug="audio")
+    with django_capture_on_commit_callbacks(execute=True):
+        new = Product.objects.create(category=c, name="Enceinte etanche", slug="enceinte-2", price=Decimal("99.00"), description="Enceinte portable etanche", stock=3)
+    # vectorisé avec le vocabulaire existant: visible sans reconstruction
+    assert new.id in [h["product_id"] for h in products_index.search("enceinte portable etanche", k=2)]
+    assert products_index.recommend(new.id, k=1)[0]["product_id"] == b.id
+
+    with django_capture_on_commit_callbacks(execute=True):
+        a.is_active = False
+        a.save()
+    assert a.id not in [h["product_id"] for h in products_index.search("casque", k=5)]
+    assert products_index.get_index().delta.tombstones.tolist() == [a.id]
+
+    assert products_index.compact_index(refit=False) == "merge"
+    idx = products_index.get_index()
+    assert idx.version == "delta-v+2" and idx.dead.size == 0
+    assert sorted(idx.all_ids.tolist()) == sorted([b.id, new.id])
+    assert new.id in [h["product_id"] for h in products_index.search("enceinte portable etanche", k=2)]
+
+
+@pytest.mark.django_db
+def test_recommend_filters_with_index_columns_and_reconciles(settings, django_capture_on_commit_callbacks, django_assert_num_queries):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    with django_capture_on_commit_callbacks(execute=True):
+        a, b = _seed()
+        c = Category.objects.get(slug="audio")
+        other = Product.objects.create(category=c, name="Casque filaire", slug="casque-fil", price=Decimal("29.00"), description="Casque filaire bluetooth", stock=0)
+    products_index.build_index(version="cols-v")
+    products_index.get_index()
+    with django_assert_num_queries(0):
+        recs = [r["product_id"] for r in products_index.recommend(a.id, k=5)]
+    assert other.id not in recs and b.id in recs
+
+    with django_capture_on_commit_callbacks(execute=True):
+        other.stock = 4
+        other.save()
+    idx = products_index.get_index()
+    assert idx.delta.ids.size == 0 and idx.delta.col_ids.tolist() == [other.id]
+    assert other.id in [r["product_id"] for r in products_index.recommend(a.id, k=5)]
+
+    # écriture hors signaux: rattrapée par la réconciliation
+    Product.objects.filter(id=b.id).update(stock=0)
+    assert b.id in [r["product_id"] for r in products_index.recommend(a.id, k=5)]
+    assert products_index.reconcile_index() == 1
+    assert b.id not in [r["product_id"] for r in products_index.recommend(a.id, k=5)]
+    assert products_index.reconcile_index() == 0
+
+
+@pytest.mark.django_db
+def test_batched_save_keeps_column_overrides_of_unchanged_columns(settings):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    a, b = _seed()
+    products_index.build_index(version="keep-v")
+    Product.objects.filter(id=a.id).update(stock=0)
+    products_index.apply_product_changes([a.id])
+    # a modifié sans toucher à ses colonnes, dans le même lot que b
+    Product.objects.filter(id=a.id).update(price=Decimal("69.00"))
+    Product.objects.filter(id=b.id).update(description="Enceinte bluetooth etanche compacte")
+    products_index.apply_product_changes([a.id, b.id])
+    idx = products_index.get_index()
+    assert not idx.available[idx.position(a.id)]
+    assert a.id not in [r["product_id"] for r in products_index.recommend(b.id, k=5)]
+
+
+@pytest.mark.django_db
+def test_refit_replays_writes_made_during_the_build(settings, monkeypatch):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    a, b = _seed()
+    products_index.build_index(version="refit-v")
+    Product.objects.filter(id=a.id).update(description="Casque sans fil bluetooth pliable")
+    products_index.apply_product_changes([a.id])
+    corpus = products_index._build_corpus
+
+    def concurrent_write():
+        out = corpus()
+        # écriture concurrente, appliquée à l'ancienne base pendant la construction
+        Product.objects.filter(id=b.id).update(stock=0)
+        products_index.apply_product_changes([b.id])
+        return out
+
+    monkeypatch.setattr(products_index, "_build_corpus", concurrent_write)
+    assert products_index.compact_index(refit=True) == "refit"
+    idx = products_index.get_index()
+    assert idx.delta.col_ids.tolist() == [b.id] and not idx.available[idx.position(b.id)]
+    assert idx.delta.ids.size == 0 and "pliable" in idx.terms
+
+
+def test_top_terms_is_sparse_native_and_matches_dense_ordering():
+    rng = np.random.default_rng(0)
+    terms = np.array([f"t{i}" for i in range(500)], dtype=object)
+    for _ in range(20):
+        cols = rng.choice(500, 12, replace=False)
+        # poids arrondis: force des égalités
+        row = sp.csr_matrix((np.round(rng.random(12), 1) + 0.1, cols, [0, 12]), shape=(1, 500))
+        arr = row.toarray().ravel()
+        expected = [terms[i] for _, i in sorted(((arr[i], i) for i in arr.nonzero()[0]), reverse=True)[:5]]
+        assert products_index._top_terms(row, terms) == expected
+    assert products_index._top_terms(sp.csr_matrix((1, 500)), terms) == []
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("max_terms", [10**6, 40])
+def test_streaming_build_matches_in_memory_build(settings, max_terms):
+    settings.ML_INDEX_BUILD_MAX_TERMS = max_terms
+    call_command("seed_demo")
+    mem = products_index.build_index(version="mem", streaming=False)
+    streamed = products_index.build_index(version="stream", streaming=True, chunk=4)
+    manifest = json.loads((Path(settings.ML_ARTIFACTS_DIR) / "product_index_manifest.json").read_text())
+    assert manifest["build"]["mode"] == "streaming" and manifest["build"]["blocks"] > 1 and manifest["build"]["peak_rss_bytes"] > 0
+    assert (manifest["build"]["pruned_terms"] > 0) == (max_terms < 100)
+    if max_terms < 100:
+        # vocabulaire élagué: seuls les termes fréquents survivent
+        assert 0 < streamed.X.shape[1] < mem.X.shape[1]
+        return
+    assert streamed.terms.tolist() == mem.terms.tolist()
+    assert np.array_equal(streamed.vectorizer.idf_, mem.vectorizer.idf_)
+    order = np.argsort(mem.ids)
+    assert streamed.ids.tolist() == mem.ids[order].tolist()
+    # à l'arrondi près: la norme L2 est sommée dans l'ordre des colonnes, que fit_transform ne trie pas
+    assert abs(streamed.X - mem.X[order]).max() < 1e-12
+    assert (streamed.shards[0].Xt != postings(streamed.X)).nnz == 0
+    assert np.allclose(streamed.upper, mem.upper, rtol=0, atol=1e-12)
+    assert streamed.available.tolist() == mem.available[order].tolist()
+    for q in ("casque bluetooth", "clavier mecanique", "blender"):
+        assert products_index.search(q, k=5)
@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import cosine_similarity
+
+from catalog.models import Category, Product
+from ml import products_index
+from ml.diversity import mmr_select, similarity_block
+from ml.scoring import l2_rows
+
+
+def _reference_mmr(relevance, R, k, lam):
+    """Boucle MMR naïve (une similarité sparse par candidat et par étape)."""
+    candidates, selected = list(range(relevance.size)), []
+    while len(selected) < k and candidates:
+        best, best_score = None, -np.inf
+        for i in candidates:
+            redundancy = float(cosine_similarity(R[i], R[selected]).max()) if selected else 0.0
+            score = lam * relevance[i] - (1 - lam) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+        candidates.remove(best)
+    return selected
+
+
+def test_mmr_select_matches_reference_loop():
+    R = l2_rows(sp.random(40, 30, density=0.2, format="csr", random_state=1))
+    relevance = np.sort(np.random.default_rng(1).random(40))[::-1]
+    for lam in (0.3, 0.7, 1.0):
+        picks = mmr_select(relevance, similarity_block(R), 10, lam)
+        assert picks.tolist() == _reference_mmr(relevance, R, 10, lam)
+
+
+def test_category_weight_spreads_categories():
+    R = sp.identity(6, format="csr")
+    relevance = np.array([0.9, 0.8, 0.7, 0.6, 0.5, 0.4])
+    categories = np.array([1, 1, 1, 2, 2, 3])
+    assert mmr_select(relevance, similarity_block(R), 3, 0.7).tolist() == [0, 1, 2]
+    picks = mmr_select(relevance, similarity_block(R, categories, category_weight=1.0), 3, 0.7)
+    assert categories[picks].tolist() == [1, 2, 3]
+
+
+@pytest.mark.django_db
+def test_recommendations_api_returns_mmr_by_default(client):
+    c = Category.objects.create(name="Audio", slug="audio")
+    a = Product.objects.create(category=c, name="Casque HiFi", slug="hifi", price=Decimal("99.00"), description="casque audio filaire", stock=10)
+    Product.objects.create(category=c, name="Casque BT", slug="bt", price=Decimal("79.00"), description="casque audio sans fil", stock=10)
+    products_index.build_index()
+    mmr = client.get(f"/api/v1/products/{a.id}/recommendations/?k=3").json()["results"]
+    assert mmr and all("MMR" in r["reason"] for r in mmr)
+    plain = client.get(f"/api/v1/products/{a.id}/recommendations/?k=3&diversify=none").json()["results"]
+    assert plain and not any("MMR" in r["reason"] for r in plain)
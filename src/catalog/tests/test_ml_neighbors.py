@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from catalog.models import Category, Product
+from ml import neighbors, products_index
+from ml.scoring import rank
+
+
+def _expected(idx, width):
+    out = {}
+    for pos in neighbors.live_positions(idx):
+        p, sc = rank(*idx.candidates(idx.row(int(pos)), idx.size), width, idx.size, exclude=int(pos), skip=idx.dead)
+        keep = (sc > 0) & (p != pos)
+        out[int(idx.all_ids[pos])] = (idx.all_ids[p[keep]].tolist(), sc[keep])
+    return out
+
+
+def _assert_table_matches(table, idx):
+    expected = _expected(idx, table.width)
+    assert sorted(expected) == table.ids.tolist()
+    for pid, (ids, scores) in expected.items():
+        got_ids, got_scores = table.lookup(pid)
+        assert got_ids.tolist() == ids
+        assert np.allclose(got_scores, scores, atol=neighbors.FLOAT16_TOL)
+
+
+@pytest.mark.django_db
+def test_neighbor_table_matches_exact_ranking_across_workers(make_catalog):
+    make_catalog(60)
+    idx = products_index.build_index(version="nb")
+    serial = neighbors.build_neighbors(idx, width=8, workers=1, chunk=7)
+    _assert_table_matches(serial, idx)
+    parallel = neighbors.build_neighbors(idx, width=8, workers=2, chunk=7)
+    assert np.array_equal(parallel.neighbors, serial.neighbors) and np.array_equal(parallel.scores, serial.scores)
+    table = neighbors.get_table()
+    assert table.current_for(idx) and table.neighbors.dtype == np.int32 and table.scores.dtype == np.float16
+
+
+@pytest.mark.django_db
+def test_recommend_reads_table_and_matches_live_path(make_catalog, monkeypatch):
+    make_catalog(60)
+    idx = products_index.build_index(version="nb")
+    pid = int(idx.ids[3])
+    live = products_index.recommend(pid, k=5)
+    neighbors.build_neighbors(idx, workers=1)
+    monkeypatch.setattr(products_index.ProductIndex, "candidates", lambda *a, **kw: pytest.fail("table not used"))
+    from_table = products_index.recommend(pid, k=5)
+    assert [r["product_id"] for r in from_table] == [r["product_id"] for r in live]
+    assert np.allclose([r["score"] for r in from_table], [r["score"] for r in live], atol=neighbors.FLOAT16_TOL)
+
+
+@pytest.mark.django_db
+def test_partial_refresh_follows_incremental_updates(make_catalog, settings, django_capture_on_commit_callbacks):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(30)
+    idx = products_index.build_index(version="nb")
+    neighbors.build_neighbors(idx, width=6, workers=1)
+    c = Category.objects.get(slug="audio")
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.create(category=c, name="Produit neuf", slug="neuf", price=Decimal("10.00"), description="casque micro casque micro", stock=1)
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(slug="p-4").get().delete()
+    idx = products_index.get_index()
+    table = neighbors.get_table()
+    assert table.current_for(idx) and table.delta_seq == 2
+    _assert_table_matches(table, idx)
+
+    assert products_index.compact_index(refit=False) == "merge"
+    assert neighbors.get_table().current_for(products_index.get_index())
+
+
+@pytest.mark.django_db
+def test_table_is_stale_after_a_rebuild_with_the_same_version(make_catalog):
+    make_catalog(20)
+    idx = products_index.build_index()
+    neighbors.build_neighbors(idx, width=4, workers=1)
+    assert neighbors.get_table().current_for(products_index.get_index())
+    # même nombre de produits (version par défaut identique), autres ids
+    Product.objects.filter(slug="p-0").delete()
+    Product.objects.create(category=Category.objects.get(slug="audio"), name="Autre", slug="autre", price=Decimal("10.00"), description="casque lampe", stock=1)
+    rebuilt = products_index.build_index()
+    assert rebuilt.version == idx.version
+    assert not neighbors.get_table().current_for(rebuilt)
+    hits = products_index.recommend_mmr(int(rebuilt.ids[3]), k=5)
+    assert hits and {h["product_id"] for h in hits} <= set(rebuilt.ids.tolist())
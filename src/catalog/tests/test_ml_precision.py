@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from catalog.models import Product
+from ml import assistant_index, products_index
+from ml.utils import read_manifest
+
+QUERIES = ["casque micro", "clavier souris ecran", "lampe", "bureau chaise serie 2", "inconnu"]
+
+
+def _describe(i, words):
+    return f"{words[i % 10]} {words[(i * 3 + 1) % 10]} {words[(i * 7 + 2) % 10]} serie {i % 6} reference r{i}"
+
+
+def _ranked():
+    return [[h["product_id"] for h in products_index.search(q, k=10)] for q in QUERIES]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("precision,stored", [("float32", "<f4"), ("float16", "<f2")])
+def test_compact_precision_round_trips_and_records_agreement(make_catalog, precision, stored):
+    make_catalog(60, _describe, "maison")
+    products_index.build_index(precision="float64")
+    baseline = _ranked()
+
+    idx = products_index.build_index(precision=precision)
+    assert idx.X.dtype == np.float32 and idx.X.indices.dtype == np.int32 and idx.shards[0].Xt.indptr.dtype == np.int32
+    manifest = read_manifest(products_index.INDEX_NAME)
+    assert manifest["arrays"]["X_data"]["dtype"] == stored and manifest["arrays"]["Xt_indices"]["dtype"] == "<i4"
+    quality = manifest["precision"]
+    assert quality["dtype"] == precision and quality["agreement_sample"] == 60
+    assert 0.9 <= quality["top_k_agreement"] <= 1 and quality["max_score_error"] < 1e-2
+    in_memory = _ranked()
+    maxscore = [[h["product_id"] for h in products_index.search(q, k=10, engine="maxscore")] for q in QUERIES]
+
+    # rechargé depuis le disque: mêmes valeurs (float16 décodé en float32), mêmes résultats
+    products_index._holder.clear()
+    loaded = products_index.get_index()
+    assert loaded.precision == precision and loaded.X.dtype == np.float32
+    assert (loaded.X != idx.X).nnz == 0
+    assert _ranked() == in_memory == maxscore
+    # seules les égalités au seuil du top-k peuvent basculer
+    assert sum(len(set(a) & set(b)) for a, b in zip(in_memory, baseline, strict=True)) >= 0.9 * sum(map(len, baseline))
+
+
+@pytest.mark.django_db
+def test_precision_is_kept_by_delta_merge_and_streaming(make_catalog, settings):
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(60, _describe, "maison")
+    idx = products_index.build_index(precision="float16")
+    streamed = products_index.build_index(precision="float16", streaming=True, chunk=16)
+    assert "top_k_agreement" in read_manifest(products_index.INDEX_NAME)["precision"]
+    # mêmes lignes (l'ordre des produits peut différer entre les deux modes de construction)
+    assert (streamed.X[streamed.positions_of(idx.ids)] != idx.X).nnz == 0
+
+    p = Product.objects.order_by("id")[3]
+    p.description = "lampe lampe bureau"
+    p.save()
+    delta = products_index.apply_product_changes([p.id])
+    assert delta.X.dtype == np.float32
+    assert products_index.search("lampe bureau", k=1)[0]["product_id"] == p.id
+    assert products_index.compact_index(refit=False) == "merge"
+    merged = products_index.get_index()
+    assert merged.precision == "float16" and merged.X.dtype == np.float32
+    assert read_manifest(products_index.INDEX_NAME)["precision"]["dtype"] == "float16"
+
+
+def test_assistant_index_precision(settings, tmp_path):
+    settings.ML_ASSISTANT_CORPUS_DIR = tmp_path / "corpus"
+    settings.ML_ARTIFACTS_DIR = tmp_path / "artifacts"
+    settings.ML_ASSISTANT_CORPUS_DIR.mkdir()
+    (settings.ML_ASSISTANT_CORPUS_DIR / "faq.md").write_text("Retour gratuit sous 30 jours.\n\nLivraison en 48h.\n\nGarantie deux ans.", encoding="utf-8")
+    assistant_index.build_index()
+    expected = assistant_index.retrieve("livraison", k=2)
+    idx = assistant_index.build_index(precision="float32")
+    assert idx.X.dtype == np.float32 and read_manifest(assistant_index.INDEX_NAME)["precision"]["top_k_agreement"] == 1.0
+    assert [r["chunk_id"] for r in assistant_index.retrieve("livraison", k=2)] == [r["chunk_id"] for r in expected]
@@ -0,0 +1,44 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from ml.query import QueryEncoder
+from ml.storage import vectorizer_from
+from ml.text import normalize
+
+DOCS = [
+    "Casque audio sans fil, réduction de bruit",
+    "casque filaire pour enfant",
+    "Chaise de bureau ergonomique réglable",
+    "Lampe LED de bureau 5W",
+    "câble usb_c 2m tressé",
+]
+QUERIES = ["casque", "Casque Audio", "casque casque bureau", "bureau ergonomique chaise", "usb_c 2m", "lampe de bureau led", "a b c", "", "   ", "inconnu total", "câble tressé !!", "5w"]
+
+
+def _same(a, b):
+    assert a.shape == b.shape
+    assert np.array_equal(a.indptr, b.indptr) and np.array_equal(a.indices, b.indices)
+    # égalité au bit près, pas seulement à epsilon près
+    assert a.data.dtype == b.data.dtype and a.data.tobytes() == b.data.tobytes()
+
+
+def test_encoder_matches_vectorizer_transform_exactly():
+    vec = TfidfVectorizer(ngram_range=(1, 2), max_df=0.9).fit([normalize(d) for d in DOCS])
+    rebuilt = vectorizer_from(vec.get_feature_names_out().tolist(), vec.idf_)
+    enc = QueryEncoder(rebuilt, cache_size=4)
+    texts = [normalize(q) for q in QUERIES]
+    for text in texts:
+        _same(enc.transform(text), vec.transform([text]))
+    _same(enc.transform_many(texts), vec.transform(texts))
+
+
+def test_encoder_lru_is_bounded():
+    vec = TfidfVectorizer(ngram_range=(1, 2)).fit(DOCS)
+    enc = QueryEncoder(vec, cache_size=2)
+    first = enc.transform("casque")
+    assert enc.transform("casque") is first
+    enc.transform("bureau")
+    enc.transform("lampe")
+    assert enc.transform("casque") is not first
+    stats = enc.stats()
+    assert stats["size"] == 2 and stats["hits"] == 1 and stats["misses"] == 4
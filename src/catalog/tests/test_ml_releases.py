@@ -0,0 +1,128 @@
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+
+from catalog.models import Category, Product
+from ml import delta, products_index, releases
+from ml.utils import artifact_lock, read_manifest
+
+
+@pytest.mark.django_db
+def test_each_build_is_a_release_and_old_ones_are_pruned(make_catalog, settings):
+    settings.ML_INDEX_KEEP_RELEASES = 2
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(5)
+    dirs = []
+    for v in ("v1", "v2", "v3"):
+        products_index.build_index(version=v)
+        dirs.append(read_manifest("product_index")["dir"])
+    assert len(set(dirs)) == 3
+    assert releases.releases("product_index") == dirs[1:]
+    assert not (Path(settings.ML_ARTIFACTS_DIR) / dirs[0]).exists()
+    # chaque release garde une copie de son manifest
+    assert (Path(settings.ML_ARTIFACTS_DIR) / dirs[2] / releases.RELEASE_MANIFEST).exists()
+
+    Product.objects.create(category=Category.objects.first(), name="Enceinte", slug="enceinte", price=Decimal("5.00"), description="enceinte", stock=1)
+    products_index.apply_product_changes(Product.objects.values_list("id", flat=True))
+    assert products_index.get_index().delta.ids.size == 1
+
+    manifest = products_index.rollback_index()
+    assert manifest["dir"] == dirs[1] and manifest["version"] == "v2"
+    idx = products_index.get_index()
+    assert idx.version == "v2" and (idx.delta is None or idx.delta.changes == 0)
+    # la release quittée reste disponible: retour en avant possible
+    assert products_index.rollback_index(dirs[2].rsplit("/", 1)[1])["version"] == "v3"
+    assert products_index.get_index().version == "v3"
+    with pytest.raises(ValueError):
+        releases.rollback("product_index", "inconnue")
+
+
+@pytest.mark.django_db
+def test_running_process_swaps_in_new_version_off_the_request_path(make_catalog, settings):
+    make_catalog(5)
+    old = products_index.build_index(version="old")
+    # une autre construction (autre processus): rien n'est publié dans ce processus
+    products_index.save_index(products_index.ProductIndex(version="new", ids=old.ids, X=old.X, vectorizer=old.vectorizer))
+    holder = products_index._holder
+    holder._background = True
+    try:
+        assert products_index.get_index() is old
+        deadline = time.monotonic() + 10
+        while products_index.get_index().version != "new" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert products_index.get_index().version == "new"
+        assert not holder.stats()["reloading"]
+    finally:
+        holder._background = False
+
+
+@pytest.mark.django_db
+def test_responses_during_a_swap_are_keyed_by_the_serving_index(make_catalog, client):
+    make_catalog(5)
+    products_index.build_index(version="old")
+    cache.clear()
+    new = Product.objects.create(category=Category.objects.first(), name="Casque neuf", slug="casque-neuf", price=Decimal("5.00"), description="casque", stock=1)
+    # construit par un autre processus
+    idx, _ = products_index.index_from_corpus(*products_index._build_corpus(), version="new")
+    products_index.save_index(idx)
+    holder = products_index._holder
+    holder._background = True
+    try:
+        during = client.get("/api/v1/search/", {"q": "casque", "k": 10}).json()
+        assert during["version"] == "old" and new.id not in [r["id"] for r in during["results"]]
+        deadline = time.monotonic() + 10
+        while products_index.get_index().version != "new" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        after = client.get("/api/v1/search/", {"q": "casque", "k": 10}).json()
+        assert after["version"] == "new" and new.id in [r["id"] for r in after["results"]]
+    finally:
+        holder._background = False
+
+
+@pytest.mark.django_db
+def test_readers_never_see_a_torn_index_during_builds(make_catalog):
+    make_catalog(20)
+    products_index.build_index()
+    errors, done = [], threading.Event()
+
+    def reader():
+        while not done.is_set():
+            try:
+                idx = products_index.load_index(verify=True)
+                assert idx is not None and idx.X.shape[0] == idx.ids.size
+            except Exception as exc:  # pragma: no cover - échec du test
+                errors.append(exc)
+
+    t = threading.Thread(target=reader)
+    t.start()
+    try:
+        for _ in range(5):
+            products_index.build_index()
+    finally:
+        done.set()
+        t.join()
+    assert errors == []
+
+
+def test_artifact_lock_is_reentrant_in_a_thread(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    with artifact_lock("x"), artifact_lock("x"):
+        pass
+    with artifact_lock("x"):
+        pass
+
+
+@pytest.mark.django_db
+def test_rollback_command_lists_and_restores(make_catalog, settings):
+    make_catalog(5)
+    products_index.build_index(version="a")
+    products_index.build_index(version="b")
+    call_command("rollback_index", "--list")
+    call_command("rollback_index")
+    assert read_manifest("product_index")["version"] == "a"
+    assert read_manifest(delta.DELTA_NAME)["base_version"] == "a"
@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import cosine_similarity
+
+from ml.inverted import PruningStats, maxscore, term_upper_bounds
+from ml.scoring import l2_rows, postings, rank, score_row, top_k
+
+
+def _matrix(n=300, dim=80, seed=0):
+    X = sp.random(n, dim, density=0.05, format="csr", random_state=seed)
+    return l2_rows(X)
+
+
+def test_kernel_matches_cosine_ranking():
+    X = _matrix()
+    Xt = postings(X)
+    for row in range(0, 300, 37):
+        qv = X[row]
+        sims = cosine_similarity(qv, X).ravel()
+        pos, scores = rank(*score_row(qv, Xt), 10, X.shape[0])
+        expected = sorted(range(X.shape[0]), key=lambda i: (-round(sims[i], 12), i))[:10]
+        assert pos.tolist() == expected
+        assert np.allclose(scores, sims[pos])
+
+
+def test_top_k_breaks_ties_by_position():
+    pos = np.array([7, 3, 5, 1, 9])
+    scores = np.array([0.5, 0.9, 0.5, 0.5, 0.1])
+    out, _ = top_k(pos, scores, 3)
+    assert out.tolist() == [3, 1, 5]
+
+
+def test_rank_pads_with_zero_scores_and_puts_excluded_last():
+    pos, scores = rank(np.array([2]), np.array([0.8]), 4, 4, exclude=0)
+    assert pos.tolist() == [2, 1, 3, 0]
+    assert scores.tolist() == [0.8, 0.0, 0.0, -1.0]
+
+
+def test_maxscore_matches_exact_ranking_and_prunes():
+    rng = np.random.default_rng(3)
+    n, dim = 5000, 400
+    cols = (rng.zipf(1.4, n * 12) - 1) % dim
+    X = sp.csr_matrix((rng.random(n * 12), cols, np.arange(0, n * 12 + 1, 12)), shape=(n, dim))
+    X.sum_duplicates()
+    X = l2_rows(X)
+    Xt = postings(X)
+    upper = term_upper_bounds(Xt)
+    stats = PruningStats()
+    for _ in range(50):
+        terms = np.unique(rng.integers(0, dim, rng.integers(1, 5)))
+        qv = sp.csr_matrix((rng.random(terms.size), terms, [0, terms.size]), shape=(1, dim))
+        for k in (1, 10):
+            exact = rank(*score_row(qv, Xt), k, n)
+            pruned = rank(*maxscore(qv.indices, qv.data, Xt, upper, k, stats), k, n)
+            assert exact[0].tolist() == pruned[0].tolist()
+            assert exact[1].tolist() == pruned[1].tolist()
+    assert stats.postings_scanned < stats.postings_total
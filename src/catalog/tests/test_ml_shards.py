@@ -0,0 +1,70 @@
+from dataclasses import replace
+
+import pytest
+
+from catalog.models import Product
+from ml import products_index
+from ml.shards import build_shards, shard_bounds
+
+QUERIES = ["casque micro", "clavier souris", "ecran lampe montre", "modele 3", "enceinte", "inconnu"]
+
+
+def _describe(i, words):
+    # descriptions répétées: nombreuses égalités de score, départagées par position
+    return f"{words[i % 8]} {words[(i + 2) % 8]} modele {i % 5}"
+
+
+def _results(engine):
+    return [products_index.search(q, k=k, engine=engine) for q in QUERIES for k in (1, 5, 60)]
+
+
+def test_shard_bounds_cover_rows_contiguously():
+    assert shard_bounds(10, 3) == [(0, 3), (3, 7), (7, 10)]
+    assert shard_bounds(2, 5) == [(0, 1), (1, 2)]
+    assert shard_bounds(0, 4) == [(0, 0)]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("streaming", [False, True])
+def test_sharded_index_returns_identical_results(make_catalog, settings, streaming):
+    settings.ML_SEARCH_SHARD_WORKERS = 3
+    make_catalog(50, _describe)
+    products_index.build_index(version="one", shards=1, streaming=streaming, chunk=8)
+    expected = {engine: _results(engine) for engine in ("exact", "maxscore")}
+    expected_batch = products_index.search_many([(q, 5) for q in QUERIES])
+    expected_reco = products_index.recommend(Product.objects.first().id, k=5)
+
+    idx = products_index.build_index(version="sharded", shards=3, streaming=streaming, chunk=8)
+    assert len(idx.shards) == 3 and idx.shards[-1].stop == idx.size
+    # rechargé depuis le disque: les bornes et les postings de chaque shard sont dans le manifest
+    products_index._holder.clear()
+    assert [(s.start, s.stop) for s in products_index.get_index().shards] == [(s.start, s.stop) for s in idx.shards]
+    for engine in ("exact", "maxscore"):
+        assert _results(engine) == expected[engine]
+    assert products_index.search_many([(q, 5) for q in QUERIES]) == expected_batch
+    assert products_index.recommend(Product.objects.first().id, k=5) == expected_reco
+
+
+@pytest.mark.django_db
+def test_sharded_index_with_delta_and_compaction(make_catalog, settings):
+    settings.ML_SEARCH_SHARD_WORKERS = 2
+    settings.ML_INDEX_BACKGROUND_COMPACTION = False
+    make_catalog(50, _describe)
+    products_index.build_index(shards=4)
+    p, gone = Product.objects.order_by("id")[7], Product.objects.order_by("id")[20].id
+    p.description = "casque casque micro"
+    p.save()
+    Product.objects.filter(id=gone).delete()
+    products_index.apply_product_changes([p.id, gone])
+    sharded = products_index.get_index()
+    assert sharded.delta.ids.tolist() == [p.id] and sharded.dead.size == 2
+    results = _results("exact")
+    assert results[1][0]["product_id"] == p.id
+
+    # même base et même delta, postings non partitionnées
+    products_index._holder.publish(replace(sharded, shards=build_shards(sharded.X, 1)))
+    assert _results("exact") == results
+    products_index._holder.clear()
+    assert products_index.compact_index(refit=False) == "merge"
+    assert len(products_index.get_index().shards) == 4
+    assert _results("exact") == results
@@ -0,0 +1,55 @@
+import gzip
+import json
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from catalog.models import Category, Product
+from ml import products_index
+
+
+@pytest.fixture
+def catalog():
+    cache.clear()
+    c = Category.objects.create(name="Audio", slug="audio")
+    for i, (name, desc) in enumerate([("Casque HiFi", "casque audio sans fil"), ("Enceinte", "enceinte audio bluetooth"), ("Casque gaming", "casque micro")]):
+        Product.objects.create(category=c, name=name, slug=f"p{i}", price=Decimal("10.00"), description=desc, stock=3)
+    products_index.build_index()
+    return c
+
+
+@pytest.mark.django_db
+def test_cache_hit_serves_prerendered_bytes_with_etag(client, catalog, monkeypatch):
+    first = client.get("/api/v1/search/", {"q": "casque", "k": 2})
+    assert first.status_code == 200 and first["Content-Type"] == "application/json"
+    assert first["Cache-Control"] == "private, no-cache" and "Accept-Encoding" in first["Vary"]
+    etag = first["ETag"]
+
+    renders = []
+    render = JSONRenderer.render
+    monkeypatch.setattr(JSONRenderer, "render", lambda self, *a, **kw: renders.append(1) or render(self, *a, **kw))
+    again = client.get("/api/v1/search/", {"q": "casque", "k": 2})
+    assert again.content == first.content and again["ETag"] == etag and renders == []
+    assert {r["name"] for r in again.json()["results"]} == {"Casque HiFi", "Casque gaming"}
+
+    not_modified = client.get("/api/v1/search/", {"q": "casque", "k": 2}, HTTP_IF_NONE_MATCH=f'W/{etag}, "other"')
+    assert not_modified.status_code == 304 and not_modified.content == b"" and not_modified["ETag"] == etag
+    assert not_modified["Cache-Control"] == "private, no-cache"
+
+    # le lot relit l'entrée pré-rendue de /search/
+    batch = client.post("/api/v1/search/batch/", {"queries": [{"q": "casque", "k": 2}]}, content_type="application/json").json()
+    assert batch["results"][0]["results"] == json.loads(first.content)["results"]
+
+
+@pytest.mark.django_db
+def test_gzip_body_when_accepted(client, catalog, settings):
+    settings.ML_RESPONSE_GZIP_MIN_BYTES = 0
+    pid = Product.objects.order_by("id").first().id
+    plain = client.get(f"/api/v1/products/{pid}/recommendations/?k=2")
+    zipped = client.get(f"/api/v1/products/{pid}/recommendations/?k=2", HTTP_ACCEPT_ENCODING="gzip, br")
+    assert "Content-Encoding" not in plain and zipped["Content-Encoding"] == "gzip"
+    assert gzip.decompress(zipped.content) == plain.content
+    assert zipped["ETag"] == plain["ETag"][:-1] + '-gzip"'
+    assert client.get(f"/api/v1/products/{pid}/recommendations/?k=2", HTTP_IF_NONE_MATCH=zipped["ETag"]).status_code == 304
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+
+from catalog.models import Category, Product
+from ml import products_index
+from ml.products_index import build_index, search, search_many
+
+
+@pytest.fixture
+def catalog():
+    cache.clear()
+    c = Category.objects.create(name="Audio", slug="audio")
+    for i, (name, desc) in enumerate([("Casque HiFi", "casque audio sans fil"), ("Enceinte", "enceinte audio bluetooth"), ("Micro", "micro studio"), ("Casque gaming", "casque micro")]):
+        Product.objects.create(category=c, name=name, slug=f"p{i}", price=Decimal("10.00"), description=desc, stock=3)
+    build_index()
+
+
+@pytest.mark.django_db
+def test_search_many_matches_individual_searches(catalog):
+    queries = [("casque", 3), ("audio bluetooth", 2), ("micro", 10), ("inconnu", 5)]
+    assert search_many(queries) == [search(q, k) for q, k in queries]
+
+
+@pytest.mark.django_db
+def test_batch_endpoint_results_in_order_and_cached(client, catalog, monkeypatch):
+    body = {"queries": [{"q": "casque", "k": 2}, {"q": "micro"}, {"q": "casque", "k": 2}]}
+    resp = client.post("/api/v1/search/batch/", body, content_type="application/json")
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [(r["q"], r["k"]) for r in results] == [("casque", 2), ("micro", 10), ("casque", 2)]
+    single = client.get("/api/v1/search/", {"q": "micro", "k": 10}).json()
+    assert results[1]["results"] == single["results"]
+    assert results[0] == results[2]
+
+    calls = []
+    monkeypatch.setattr(products_index, "search_many", lambda queries, idx=None: calls.append(queries) or [[] for _ in queries])
+    again = client.post("/api/v1/search/batch/", body, content_type="application/json").json()
+    assert calls == [] and again["results"] == results
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("body", [{}, {"queries": []}, {"queries": [{"k": 3}]}, {"queries": [{"q": "casque", "k": "x"}]}, {"queries": [{"q": "a"}] * 51}])
+def test_batch_endpoint_validation(client, body):
+    resp = client.post("/api/v1/search/batch/", body, content_type="application/json")
+    assert resp.status_code == 400
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from django.core.cache import cache
+
+from ml import holder, versions
+from ml.cache import bump_buster, buster_key
+from ml.holder import IndexHolder
+from ml.utils import manifest_path, manifest_signature, write_json_atomic, write_manifest
+from ml.versions import VersionContext
+
+
+@pytest.fixture
+def ctx(settings, tmp_path):
+    settings.ML_ARTIFACTS_DIR = tmp_path
+    settings.ML_VERSION_REFRESH_INTERVAL = 60
+    cache.clear()
+    return VersionContext()
+
+
+def test_signatures_are_read_from_memory(ctx, monkeypatch):
+    write_manifest("product_index", {"version": "1"})
+    expected = (manifest_signature("product_index"),)
+    assert ctx.signatures(("product_index",)) == expected
+    calls = []
+    monkeypatch.setattr(versions, "manifest_signature", lambda name: calls.append(name))
+    monkeypatch.setattr(cache, "get", lambda *a, **kw: calls.append(a))
+    for _ in range(100):
+        assert ctx.signatures(("product_index",)) == expected and ctx.buster() == "0"
+    assert calls == []
+
+
+def test_own_writes_are_immediate_other_processes_after_refresh(ctx):
+    assert ctx.signatures(("product_index",)) == (None,)
+    write_manifest("product_index", {"version": "2"})
+    own = ctx.signatures(("product_index",))
+    assert own == (manifest_signature("product_index"),) != (None,)
+    # écrit par un autre processus: vu au prochain rafraîchissement
+    time.sleep(0.01)
+    write_json_atomic(manifest_path("product_index"), {"version": "3"})
+    cache.set(versions.BUSTER_KEY, 7, None)
+    assert ctx.signatures(("product_index",)) == own and ctx.buster() == "0"
+    ctx.refresh()
+    assert ctx.signatures(("product_index",)) == (manifest_signature("product_index"),) != own and ctx.buster() == "7"
+
+
+def test_background_refresh(ctx, settings):
+    settings.ML_VERSION_REFRESH_INTERVAL = 0.02
+    assert ctx.buster() == "0"
+    cache.set(versions.BUSTER_KEY, 9, None)
+    time.sleep(0.2)
+    assert ctx.buster() == "9" and ctx.stats()["refreshes"] >= 2
+
+
+def test_bump_buster_is_seen_at_once(ctx):
+    before = buster_key()
+    bump_buster()
+    assert buster_key() != before and buster_key() == str(cache.get(versions.BUSTER_KEY))
+
+
+def test_resident_holder_does_no_io_per_request(ctx, monkeypatch):
+    monkeypatch.setattr(versions, "context", ctx)
+    write_manifest("dummy_index", {"version": "1"})
+    h = IndexHolder("dummy_index", lambda _previous: "v1")
+    assert h.get() == "v1" and h.get() == "v1"
+    calls = []
+    monkeypatch.setattr(holder, "manifest_signature", lambda name: calls.append(name))
+    monkeypatch.setattr(versions, "manifest_signature", lambda name: calls.append(name))
+    for _ in range(100):
+        assert h.get() == "v1"
+    assert calls == []
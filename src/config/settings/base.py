@@ -153,3 +153,102 @@ AUTH_PASSWORD_VALIDATORS = [
 
 ML_ARTIFACTS_DIR = Path(environ.get("ML_ARTIFACTS_DIR", BASE_DIR / "src" / "ml" / "artifacts"))
 ML_ASSISTANT_CORPUS_DIR = Path(environ.get("ML_ASSISTANT_CORPUS_DIR", BASE_DIR / "src" / "ml" / "corpus"))
+
+# Moteur de recherche produits par défaut pour les nouveaux index: "exact" (postings complètes) ou "maxscore" (élagage)
+ML_PRODUCT_SEARCH_ENGINE = environ.get("ML_PRODUCT_SEARCH_ENGINE", "exact")
+
+# Mises à jour incrémentales de l'index produits: fusion du delta au-delà de N lignes (en arrière-plan dans le
+# processus web), réapprentissage de l'idf au-delà d'une dérive (lignes delta + retraits) / taille de la base,
+# cumulée depuis le dernier réapprentissage (hors processus web: commande compact_product_index)
+ML_INDEX_DELTA_MERGE_ROWS = int(environ.get("ML_INDEX_DELTA_MERGE_ROWS", "1000"))
+ML_INDEX_REFIT_DRIFT = float(environ.get("ML_INDEX_REFIT_DRIFT", "0.1"))
+ML_INDEX_BACKGROUND_COMPACTION = bool(int(environ.get("ML_INDEX_BACKGROUND_COMPACTION", "1")))
+
+# Nombre maximal de requêtes acceptées par POST /api/v1/search/batch/
+ML_SEARCH_BATCH_MAX = int(environ.get("ML_SEARCH_BATCH_MAX", "50"))
+
+# Table de voisins précalculée (recommandations): N voisins par produit, taille des blocs de lignes et nombre
+# de threads du calcul hors ligne (0 = tous les CPU)
+ML_RECO_NEIGHBORS = int(environ.get("ML_RECO_NEIGHBORS", "64"))
+ML_RECO_NEIGHBORS_CHUNK = int(environ.get("ML_RECO_NEIGHBORS_CHUNK", "256"))
+ML_RECO_NEIGHBORS_WORKERS = int(environ.get("ML_RECO_NEIGHBORS_WORKERS", "0"))
+
+# Diversification des recommandations: "mmr" par défaut (?diversify=none pour la désactiver), taille du pool
+# de candidats, compromis pertinence/diversité et poids de redondance entre produits de même catégorie
+ML_RECO_DIVERSIFY = environ.get("ML_RECO_DIVERSIFY", "mmr")
+ML_RECO_MMR_POOL = int(environ.get("ML_RECO_MMR_POOL", "50"))
+ML_RECO_MMR_LAMBDA = float(environ.get("ML_RECO_MMR_LAMBDA", "0.7"))
+ML_RECO_MMR_CATEGORY_WEIGHT = float(environ.get("ML_RECO_MMR_CATEGORY_WEIGHT", "0.5"))
+
+# Construction de l'index produits hors mémoire (catalogues de plusieurs millions de produits): activée par
+# défaut ou non, produits par bloc, taille maximale du dictionnaire de comptage des termes (passe 1)
+ML_INDEX_BUILD_STREAMING = bool(int(environ.get("ML_INDEX_BUILD_STREAMING", "0")))
+ML_INDEX_BUILD_CHUNK = int(environ.get("ML_INDEX_BUILD_CHUNK", "5000"))
+ML_INDEX_BUILD_MAX_TERMS = int(environ.get("ML_INDEX_BUILD_MAX_TERMS", "2000000"))
+
+# Index produits partitionné: nombre de shards de lignes (vocabulaire et idf partagés), threads pour
+# construire leurs postings (0: un par shard), threads de recherche scatter-gather par processus
+ML_PRODUCT_INDEX_SHARDS = int(environ.get("ML_PRODUCT_INDEX_SHARDS", "1"))
+ML_INDEX_SHARD_BUILD_WORKERS = int(environ.get("ML_INDEX_SHARD_BUILD_WORKERS", "0"))
+ML_SEARCH_SHARD_WORKERS = int(environ.get("ML_SEARCH_SHARD_WORKERS", "4"))
+
+# Publication des index: chaque build dans sa propre release, publiée par renommage atomique du manifest;
+# releases conservées pour un retour arrière, rechargement des nouvelles versions hors du chemin des requêtes
+ML_INDEX_KEEP_RELEASES = int(environ.get("ML_INDEX_KEEP_RELEASES", "3"))
+ML_INDEX_BACKGROUND_RELOAD = bool(int(environ.get("ML_INDEX_BACKGROUND_RELOAD", "1")))
+
+# Représentation dense LSA + index ANN (IVF) de l'index produits: dimensions, listes (0: racine du nombre de
+# produits), listes sondées par requête, échantillon de mesure du rappel; activation par défaut pour la
+# recherche et les recommandations (?mode=dense|sparse par requête)
+ML_DENSE_DIMS = int(environ.get("ML_DENSE_DIMS", "256"))
+ML_DENSE_NLIST = int(environ.get("ML_DENSE_NLIST", "0"))
+ML_DENSE_NPROBE = int(environ.get("ML_DENSE_NPROBE", "8"))
+ML_DENSE_RECALL_SAMPLE = int(environ.get("ML_DENSE_RECALL_SAMPLE", "200"))
+ML_SEARCH_DENSE = bool(int(environ.get("ML_SEARCH_DENSE", "0")))
+ML_RECO_DENSE = bool(int(environ.get("ML_RECO_DENSE", "0")))
+
+# Précision des matrices d'index (produits et assistant): float64, float32 ou float16 (encodage disque, décodé
+# en float32); indices int32 hors float64. Lignes requêtes échantillonnées pour mesurer l'accord des top-k
+ML_INDEX_PRECISION = environ.get("ML_INDEX_PRECISION", "float64")
+ML_INDEX_PRECISION_SAMPLE = int(environ.get("ML_INDEX_PRECISION_SAMPLE", "200"))
+
+# Vecteurs des requêtes normalisées gardés en mémoire (LRU par index et par processus; 0 = désactivé)
+ML_QUERY_VECTOR_CACHE = int(environ.get("ML_QUERY_VECTOR_CACHE", "4096"))
+
+# Évaluation de la recherche (eval_search): threads, seuils de régression par rapport à la référence
+# (baisse absolue par métrique, hausse relative du p95 au-delà d'une marge absolue en ms)
+ML_EVAL_WORKERS = int(environ.get("ML_EVAL_WORKERS", "4"))
+ML_EVAL_MAX_QUALITY_DROP = float(environ.get("ML_EVAL_MAX_QUALITY_DROP", "0.02"))
+ML_EVAL_MAX_P95_INCREASE = float(environ.get("ML_EVAL_MAX_P95_INCREASE", "0.2"))
+ML_EVAL_P95_SLACK_MS = float(environ.get("ML_EVAL_P95_SLACK_MS", "1.0"))
+
+# Invalidation du cache des réponses par étiquettes (produits, catégories): durée de vie des marques
+# d'invalidation, à garder supérieure à celle des réponses en cache
+ML_CACHE_TAG_TTL = int(environ.get("ML_CACHE_TAG_TTL", "86400"))
+
+# Remplissage du cache des réponses: durée pendant laquelle une réponse expirée (pas invalidée) reste servie pendant son recalcul,
+# expiration du verrou par clé (calcul le plus long), attente maximale de la publication d'un calcul en cours
+ML_CACHE_STALE_TTL = int(environ.get("ML_CACHE_STALE_TTL", "300"))
+ML_CACHE_LOCK_TIMEOUT = int(environ.get("ML_CACHE_LOCK_TIMEOUT", "10"))
+ML_CACHE_FILL_WAIT = float(environ.get("ML_CACHE_FILL_WAIT", "2.0"))
+
+# Niveau local du cache des réponses (LRU par processus devant Redis; inutile devant LocMemCache): entrées,
+# octets (corps pré-rendus, plus un forfait par entrée), durée pendant laquelle une copie locale est servie sans relire Redis
+ML_CACHE_LOCAL_ENTRIES = int(environ.get("ML_CACHE_LOCAL_ENTRIES", "1024" if REDIS_URL else "0"))
+ML_CACHE_LOCAL_BYTES = int(environ.get("ML_CACHE_LOCAL_BYTES", str(32 * 2**20)))
+ML_CACHE_LOCAL_TTL = float(environ.get("ML_CACHE_LOCAL_TTL", "2.0"))
+
+# Invalidations par étiquettes regroupées par processus: écrites après ML_CACHE_INVALIDATION_DEBOUNCE s sans
+# nouvelle modification du catalogue, au plus ML_CACHE_INVALIDATION_MAX_DELAY s après la première (0: immédiates)
+ML_CACHE_INVALIDATION_DEBOUNCE = float(environ.get("ML_CACHE_INVALIDATION_DEBOUNCE", "0.2"))
+ML_CACHE_INVALIDATION_MAX_DELAY = float(environ.get("ML_CACHE_INVALIDATION_MAX_DELAY", "1.0"))
+
+# Contexte de versions (signatures des manifests d'index, buster) gardé en mémoire par processus: les index
+# résidents ne vérifient leur manifest qu'après un sondage qui l'a vu changer; intervalle de sondage des
+# manifests et du cache partagé par le thread de rafraîchissement (0: relecture à chaque accès)
+ML_VERSION_REFRESH_INTERVAL = float(environ.get("ML_VERSION_REFRESH_INTERVAL", "1.0"))
+
+# Réponses de recherche et de recommandation mises en cache déjà rendues: version gzip au-delà d'une taille
+# minimale (octets)
+ML_RESPONSE_GZIP = bool(int(environ.get("ML_RESPONSE_GZIP", "1")))
+ML_RESPONSE_GZIP_MIN_BYTES = int(environ.get("ML_RESPONSE_GZIP_MIN_BYTES", "1024"))
@@ -36,6 +36,7 @@ from catalog.api import (
     ProductRecommendationsView,
     ProductViewSet,
     RecommendationClickView,
+    SearchBatchView,
     SearchView,
 )
 
@@ -51,6 +52,7 @@ urlpatterns = [
     path("api/v1/", include(router.urls)),
     path("api/v1/products/<int:pk>/recommendations/", ProductRecommendationsView.as_view(), name="api-product-recommendation"),
     path("api/v1/search/", SearchView.as_view(), name="api-search"),
+    path("api/v1/search/batch/", SearchBatchView.as_view(), name="api-search-batch"),
     path("api/v1/assistant/ask/", AssistantAskView.as_view(), name="api-assistant-ask"),
     path("api/v1/recommendations/clicks/", RecommendationClickView.as_view(), name="api-reco-click"),
     path("api/v1/metrics/", MetricsView.as_view(), name="api-metrics"),
@@ -5,17 +5,17 @@ import time
 import uuid
 from typing import Any
 
-from .assistant_index import retrieve
-from .utils import read_manifest
+from .assistant_index import AssistantIndex, get_index, retrieve
 
 logger = logging.getLogger(__name__)
 
 
-def answer(q: str, k: int = 5, threshold: float = 0.1) -> dict[str, Any]:
+def answer(q: str, k: int = 5, threshold: float = 0.1, idx: AssistantIndex | None = None) -> dict[str, Any]:
     t0 = time.monotonic()
     trace_id = str(uuid.uuid4())
-    version = (read_manifest("assistant_index") or {}).get("version", "0")
-    hits = retrieve(q, k=k)
+    idx = idx or get_index()
+    version = idx.version
+    hits = retrieve(q, k=k, idx=idx)
     if not hits or (hits and hits[0]["score"] < threshold):
         msg = "Je n'ai pas trouvé d'information fiable dans la base documentaire pour répondre à cette question."
         dt_ms = int((time.monotonic() - t0) * 1000)
@@ -1,23 +1,34 @@
+"""Index RAG de l'assistant: TF-IDF sur les paragraphes du corpus, reconstruit fichier par fichier."""
+
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
-import pickle
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 from typing import Any
 
-import numpy as np
 from django.conf import settings
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
+from .holder import IndexHolder, sparse_nbytes, touch_pages
+from .query import QueryEncoder
+from .releases import new_release, publish
+from .scoring import l2_rows, postings, precision_agreement, rank, score_row
+from .storage import FORMAT, check_precision, compact_csr, csr_arrays, csr_from_arrays, file_sha256, load_arrays, load_vocabulary, save_arrays, save_vocabulary, vectorizer_from
 from .text import normalize
-from .utils import artifacts_dir, read_manifest, write_manifest
+from .utils import artifact_lock, artifacts_dir, read_manifest, vocabulary_nbytes
 
 logger = logging.getLogger(__name__)
 
 INDEX_NAME = "assistant_index"
-PICKLE_FILE = "assistant_index.pkl"
+INDEX_DIR = "assistant_index"
+CHUNKS_FILE = "chunks.json"
+CORPUS_SUFFIXES = {".md", ".txt"}
+# un fichier modifié moins de 2 s avant sa dernière lecture peut changer sans que sa date bouge: on le relit
+RACY_NS = 2_000_000_000
 
 
 @dataclass
@@ -28,60 +39,165 @@ class AssistantIndex:
     X: Any
     vectorizer: TfidfVectorizer
     meta: dict[str, dict[str, Any]]
+    Xt: Any = field(default=None, repr=False)
+    # chemin relatif → {"sha256", "size", "mtime_ns", "read_ns", "chunks": [début, fin)}
+    files: dict[str, dict[str, Any]] = field(default_factory=dict, repr=False)
+    precision: str = "float64"  # valeurs de X et des postings (storage.PRECISIONS)
+    encoder: QueryEncoder | None = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.Xt is None:
+            self.Xt = postings(self.X)
+        if self.encoder is None:
+            self.encoder = QueryEncoder(self.vectorizer)
+
 
+def _chunk_text(data: bytes) -> list[str]:
+    # sauts de ligne universels, comme Path.read_text
+    text = data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    # chunking simple par paragraphes
+    return [normalize(x) for x in text.split("\n\n") if x.strip()]
 
-def _load_corpus() -> tuple[list[str], list[str], dict[str, dict[str, Any]]]:
+
+def scan_corpus() -> dict[str, tuple[int, int]]:
+    """(taille, mtime_ns) de chaque fichier du corpus, par chemin relatif trié."""
     src_dir = Path(settings.ML_ASSISTANT_CORPUS_DIR)
-    ids, chunks, meta = [], [], {}
     if not src_dir.exists():
         src_dir.mkdir(parents=True, exist_ok=True)
-        return ids, chunks, meta
+        return {}
+    out = {}
     for p in src_dir.rglob("*"):
-        if p.suffix.lower() not in {".md", ".txt"}:
-            continue
-        text = p.read_text(encoding="utf-8", errors="ignore")
-        # chunking simple par paragraphes
-        parts = [normalize(x) for x in text.split("\n\n") if x.strip()]
+        if p.suffix.lower() in CORPUS_SUFFIXES and p.is_file():
+            st = p.stat()
+            out[p.relative_to(src_dir).as_posix()] = (st.st_size, st.st_mtime_ns)
+    return dict(sorted(out.items()))
+
+
+def _unchanged(entry: dict[str, Any], size: int, mtime_ns: int) -> bool:
+    return entry["size"] == size and entry["mtime_ns"] == mtime_ns and mtime_ns + RACY_NS < entry["read_ns"]
+
+
+def _load_corpus(previous: AssistantIndex | None = None) -> tuple[list[str], list[str], dict[str, dict[str, Any]], dict[str, dict[str, Any]], dict[str, int]]:
+    """Chunks du corpus; ceux des fichiers inchangés depuis ``previous`` sont repris sans redécoupage."""
+    src_dir = Path(settings.ML_ASSISTANT_CORPUS_DIR)
+    old = previous.files if previous is not None else {}
+    ids, chunks, meta, files = [], [], {}, {}
+    report = {"added": 0, "changed": 0, "removed": 0, "reused": 0}
+    for rel, (size, mtime_ns) in scan_corpus().items():
+        p = src_dir / rel
+        entry = old.get(rel)
+        if entry is not None and _unchanged(entry, size, mtime_ns):
+            # même taille, même date: contenu supposé inchangé, le fichier n'est pas relu
+            digest, read_ns, data = entry["sha256"], entry["read_ns"], None
+        else:
+            read_ns = time.time_ns()
+            data = p.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry["sha256"] == digest:
+            start, stop = entry["chunks"]
+            parts = previous.chunks[start:stop]
+            report["reused"] += 1
+        else:
+            parts = _chunk_text(data)
+            report["changed" if entry is not None else "added"] += 1
+        start = len(ids)
         for i, ch in enumerate(parts):
             cid = f"{p.name}:{i}"
             ids.append(cid)
             chunks.append(ch)
             meta[cid] = {"path": str(p), "doc": p.name, "chunk": i}
-    return ids, chunks, meta
-
-
-def build_index(version: str | None = None) -> AssistantIndex:
-    ids, chunks, meta = _load_corpus()
+        files[rel] = {"sha256": digest, "size": size, "mtime_ns": mtime_ns, "read_ns": read_ns, "chunks": [start, len(ids)]}
+    report["removed"] = len(old.keys() - files.keys())
+    return ids, chunks, meta, files, report
+
+
+def build_index(version: str | None = None, incremental: bool = True, precision: str | None = None) -> AssistantIndex:
+    """Construit l'index assistant; ``incremental`` reprend les chunks des fichiers inchangés."""
+    precision = check_precision(precision or settings.ML_INDEX_PRECISION)
+    previous = load_index() if incremental else None
+    ids, chunks, meta, files, report = _load_corpus(previous)
+    unchanged = not (report["added"] or report["changed"] or report["removed"])
+    if previous is not None and unchanged and previous.precision == precision:
+        idx = replace(previous, version=version or previous.version, files=files)
+        if idx.version != previous.version or files != previous.files:
+            with artifact_lock(INDEX_NAME):
+                manifest = read_manifest(INDEX_NAME) or {}
+                if manifest.get("version") != previous.version or manifest.get("files") != previous.files:
+                    # une autre construction a publié entre-temps: c'est elle qui est servie
+                    return _holder.get(fresh=True)
+                # même release (tableaux inchangés), manifest republié
+                publish(INDEX_NAME, {**manifest, "version": idx.version, "files": files})
+        _holder.publish(idx)
+        return idx
     n_docs = max(len(chunks), 1)
     vec = TfidfVectorizer(ngram_range=(1, 2), max_df=(1.0 if n_docs < 2 else 0.9), min_df=1, stop_words=None)
-    X = vec.fit_transform(chunks) if chunks else vec.fit_transform(["vide"])
-    idx = AssistantIndex(version=version or str(len(ids)), ids=ids, chunks=chunks, X=X, vectorizer=vec, meta=meta)
-    save_index(idx)
+    X = l2_rows(vec.fit_transform(chunks) if chunks else vec.fit_transform(["vide"]))
+    compact = compact_csr(X, precision)
+    quality = {"dtype": precision}
+    if precision != "float64":
+        quality.update(precision_agreement(X, compact, settings.ML_INDEX_PRECISION_SAMPLE, k=5))
+    idx = AssistantIndex(version=version or str(len(ids)), ids=ids, chunks=chunks, X=compact, vectorizer=vec, meta=meta, files=files, precision=precision)
+    save_index(idx, build={"incremental": previous is not None, **report}, precision=quality)
+    _holder.publish(idx)
+    logger.info("ASSISTANT_INDEX_BUILT version=%s chunks=%s files=%s %s", idx.version, len(ids), len(files), " ".join(f"{k}={v}" for k, v in report.items()))
     return idx
 
 
-def save_index(idx: AssistantIndex) -> None:
-    artifacts = artifacts_dir()
-    blob = {"version": idx.version, "ids": idx.ids, "chunks": idx.chunks, "X": idx.X, "vectorizer": idx.vectorizer, "meta": idx.meta}
-    with (artifacts / PICKLE_FILE).open("wb") as f:
-        pickle.dump(blob, f)
-    write_manifest(INDEX_NAME, {"version": idx.version, "count": len(idx.ids), "dim": int(idx.X.shape[1]), "file": PICKLE_FILE})
+def pending_changes(idx: AssistantIndex | None = None) -> bool:
+    """Vrai si un fichier du corpus a été ajouté, retiré, ou a changé de taille ou de date depuis ``idx``."""
+    idx = idx if idx is not None else load_index()
+    if idx is None:
+        return True
+    return scan_corpus() != {rel: (f["size"], f["mtime_ns"]) for rel, f in idx.files.items()}
+
+
+def save_index(idx: AssistantIndex, build: dict[str, Any] | None = None, precision: dict[str, Any] | None = None) -> None:
+    release, path = new_release(INDEX_DIR)
+    arrays = save_arrays(path, {**csr_arrays(idx.X, precision=idx.precision), **csr_arrays(idx.Xt, prefix="Xt", precision=idx.precision), "idf": idx.vectorizer.idf_})
+    vocab = save_vocabulary(path, idx.vectorizer)
+    # les textes restent en JSON: seuls les tableaux numériques sont mappés en mémoire
+    chunks = path / CHUNKS_FILE
+    chunks.write_text(json.dumps({"ids": idx.ids, "chunks": idx.chunks, "meta": idx.meta}, ensure_ascii=False), encoding="utf-8")
+    publish(
+        INDEX_NAME,
+        {
+            "version": idx.version,
+            "count": len(idx.ids),
+            "dim": int(idx.X.shape[1]),
+            "format": FORMAT,
+            "dir": release,
+            "arrays": arrays,
+            "vocabulary": vocab,
+            "chunks": {"file": chunks.name, "sha256": file_sha256(chunks)},
+            "files": idx.files,
+            "precision": precision or {"dtype": idx.precision},
+            **({"build": build} if build else {}),
+        },
+    )
 
 
-def load_index() -> AssistantIndex | None:
-    artifacts = artifacts_dir()
-    p = artifacts / PICKLE_FILE
-    if not p.exists():
+def load_index(verify: bool = False) -> AssistantIndex | None:
+    manifest = read_manifest(INDEX_NAME)
+    if not manifest or manifest.get("format") != FORMAT:
+        return None
+    path = artifacts_dir() / manifest["dir"]
+    if not path.exists():
         return None
-    with p.open("rb") as f:
-        blob = pickle.load(f)
+    arrays = load_arrays(path, manifest["arrays"], verify=verify)
+    terms = load_vocabulary(path, manifest["vocabulary"])
+    blob = json.loads((path / manifest["chunks"]["file"]).read_text(encoding="utf-8"))
+    X = csr_from_arrays(arrays, manifest["dim"])
     return AssistantIndex(
-        version=read_manifest(INDEX_NAME)["version"] if read_manifest(INDEX_NAME) else "0",
+        version=manifest["version"],
         ids=blob["ids"],
         chunks=blob["chunks"],
-        X=blob["X"],
-        vectorizer=blob["vectorizer"],
+        X=X,
+        vectorizer=vectorizer_from(terms, arrays["idf"]),
         meta=blob["meta"],
+        Xt=csr_from_arrays(arrays, X.shape[0], prefix="Xt"),
+        # index antérieurs au suivi par fichier: tout fichier sera vu comme ajouté à la prochaine reconstruction
+        files=manifest.get("files", {}),
+        precision=manifest.get("precision", {}).get("dtype", "float64"),
     )
 
 
@@ -92,13 +208,32 @@ def load_or_build() -> AssistantIndex:
     return idx
 
 
-def retrieve(q: str, k: int = 5) -> list[dict[str, Any]]:
-    idx = load_or_build()
-    qv = idx.vectorizer.transform([normalize(q)])
-    sims = cosine_similarity(qv, idx.X).ravel()
-    order = np.argsort(-sims)[: max(k, 1)]
+def _resident_bytes(idx: AssistantIndex) -> int:
+    return sparse_nbytes(idx.X) + sparse_nbytes(idx.Xt) + sum(len(c.encode("utf-8")) for c in idx.chunks) + vocabulary_nbytes(idx.vectorizer.vocabulary_)
+
+
+def _prewarm(idx: AssistantIndex) -> None:
+    touch_pages(idx.X.data, idx.X.indices, idx.X.indptr, idx.Xt.data, idx.Xt.indices, idx.Xt.indptr)
+
+
+_holder: IndexHolder[AssistantIndex] = IndexHolder(INDEX_NAME, lambda _previous: load_or_build(), _resident_bytes, background=settings.ML_INDEX_BACKGROUND_RELOAD, prewarm=_prewarm)
+
+
+def get_index() -> AssistantIndex:
+    return _holder.get()
+
+
+def index_stats() -> dict[str, Any]:
+    idx = _holder.current
+    return {**_holder.stats(), "query_vectors": idx.encoder.stats() if idx is not None else None}
+
+
+def retrieve(q: str, k: int = 5, idx: AssistantIndex | None = None) -> list[dict[str, Any]]:
+    idx = idx or get_index()
+    qv = idx.encoder.transform(normalize(q))
+    order, sims = rank(*score_row(qv, idx.Xt), max(k, 1), idx.X.shape[0])
     out = []
-    for i in order:
+    for i, sc in zip(order, sims, strict=False):
         cid = idx.ids[i] if i < len(idx.ids) else "N/A"
-        out.append({"chunk_id": cid, "score": float(sims[i]), "text": idx.chunks[i] if i < len(idx.chunks) else "", "meta": idx.meta.get(cid, {})})
+        out.append({"chunk_id": cid, "score": float(sc), "text": idx.chunks[i] if i < len(idx.chunks) else "", "meta": idx.meta.get(cid, {})})
     return out
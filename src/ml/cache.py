@@ -1,16 +1,42 @@
+"""Clés de cache des réponses ML, invalidation par étiquettes et remplissage à calcul unique."""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
 import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
 from hashlib import sha1
+from typing import Any
 
+from django.conf import settings
 from django.core.cache import cache
 
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+# marge sur les horloges des processus web (une entrée calculée juste avant l'invalidation est perdue)
+CLOCK_SKEW = 1.0
+# forfait par entrée du niveau local (structure, étiquettes, valeur non pré-rendue), en octets
+ENTRY_NBYTES = 512
+
 
 def buster_key() -> str:
-    v = cache.get("catalog:buster")
-    return str(v or "0")
+    """Valeur globale d'invalidation, tenue en mémoire par le contexte de versions (pas d'aller-retour au cache)."""
+    return versions.context.buster()
 
 
 def bump_buster() -> None:
-    cache.set("catalog:buster", int(time.time()), timeout=None)
+    """Invalide toutes les réponses en cache d'un coup (à réserver aux changements globaux)."""
+    v = int(time.time())
+    cache.set(versions.BUSTER_KEY, v, timeout=None)
+    versions.context.set_buster(v)
+    local = _local()
+    if local is not None:
+        local.clear()
 
 
 def make_key(prefix: str, *parts: object) -> str:
@@ -23,3 +49,368 @@ def make_key(prefix: str, *parts: object) -> str:
         s = s.replace(":", "_")
         tokens.append(s)
     return f"{prefix}:" + ":".join(tokens)
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def category_tag(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+def product_tags(products: Iterable[Any]) -> set[str]:
+    """Étiquettes (produit et catégorie) d'instances ``Product``."""
+    tags = set()
+    for p in products:
+        tags.add(product_tag(p.id))
+        tags.add(category_tag(p.category_id))
+    return tags
+
+
+def _tag_key(tag: str) -> str:
+    return f"tag:{tag}"
+
+
+def _entry_nbytes(entry: dict[str, Any]) -> int:
+    """Taille estimée sans sérialiser: corps pré-rendus (et gzip) plus le forfait par entrée."""
+    value = entry["value"]
+    size = ENTRY_NBYTES
+    if isinstance(value, dict):
+        size += sum(len(value[k]) for k in ("body", "gzip") if isinstance(value.get(k), bytes))
+    return size
+
+
+class LocalTier:
+    """LRU du processus devant le cache partagé, relu après ``ttl`` s; valeurs partagées, à ne pas modifier."""
+
+    def __init__(self, entries: int, max_bytes: int, ttl: float) -> None:
+        self.entries, self.max_bytes, self.ttl = entries, max_bytes, ttl
+        self.nbytes = 0
+        self._data: OrderedDict[str, tuple[dict[str, Any], int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[2] >= self.ttl:
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, entry: dict[str, Any]) -> None:
+        size = _entry_nbytes(entry)
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = (entry, size, time.monotonic())
+            self.nbytes += size
+            while len(self._data) > self.entries or self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def drop_tags(self, tags: set[str]) -> int:
+        with self._lock:
+            keys = [k for k, (e, _, _) in self._data.items() if not tags.isdisjoint(e["tags"])]
+            for k in keys:
+                self._pop(k)
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def stats(self) -> dict[str, Any]:
+        return {"size": len(self._data), "capacity": self.entries, "bytes": self.nbytes, "max_bytes": self.max_bytes, "ttl_s": self.ttl}
+
+
+_tier: dict[str, Any] = {"conf": None, "local": None}
+_tier_stats = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+_tier_lock = threading.Lock()
+
+
+def _local() -> LocalTier | None:
+    """Niveau local (None si ML_CACHE_LOCAL_ENTRIES vaut 0), recréé si ses réglages changent."""
+    conf = (settings.ML_CACHE_LOCAL_ENTRIES, settings.ML_CACHE_LOCAL_BYTES, settings.ML_CACHE_LOCAL_TTL)
+    if _tier["conf"] != conf:
+        with _tier_lock:
+            if _tier["conf"] != conf:
+                _tier["local"] = LocalTier(*conf) if conf[0] > 0 and conf[2] > 0 else None
+                _tier["conf"] = conf
+    return _tier["local"]
+
+
+def _lookup(keys: list[str]) -> dict[str, tuple[bool, Any]]:
+    """{clé: (fraîche, valeur)} des entrées présentes, niveau local d'abord."""
+    local = _local()
+    now = time.time()
+    out = {}
+    if local is not None:
+        for k in keys:
+            e = local.get(k)
+            if e is not None:
+                # étiquettes vérifiées à la copie dans le niveau local
+                out[k] = (now < e["fresh_until"], e["value"])
+    rest = [k for k in keys if k not in out]
+    entries = {k: e for k, e in cache.get_many(rest).items() if isinstance(e, dict) and "tags" in e} if rest else {}
+    tags = {t for e in entries.values() for t in e["tags"]}
+    stamps = cache.get_many([_tag_key(t) for t in tags]) if tags else {}
+    shared = 0
+    for k, e in entries.items():
+        # invalidée par une étiquette: absente, jamais servie périmée
+        if any(stamps.get(_tag_key(t), float("-inf")) >= e["at"] - CLOCK_SKEW for t in e["tags"]):
+            continue
+        out[k] = (now < e["fresh_until"], e["value"])
+        shared += 1
+        if local is not None:
+            local.put(k, e)
+    with _tier_lock:
+        _tier_stats["local_hits"] += len(keys) - len(rest)
+        _tier_stats["shared_hits"] += shared
+        _tier_stats["misses"] += len(rest) - shared
+    return out
+
+
+def _entry(value: Any, tags: Iterable[str], since: float, timeout: int) -> dict[str, Any]:
+    return {"value": value, "tags": sorted(set(tags)), "at": since, "fresh_until": time.time() + timeout}
+
+
+def get_tagged(key: str) -> Any | None:
+    """Valeur fraîche en cache sous ``key``, ou None si absente, expirée ou invalidée par l'une de ses étiquettes."""
+    fresh, value = _lookup([key]).get(key, (False, None))
+    return value if fresh else None
+
+
+def get_many_tagged(keys: Iterable[str]) -> dict[str, Any]:
+    return {k: v for k, (fresh, v) in _lookup(list(keys)).items() if fresh}
+
+
+def set_tagged(key: str, value: Any, tags: Iterable[str], since: float, timeout: int) -> None:
+    """Met ``value`` en cache; ``since``: instant où son calcul a commencé."""
+    set_many_tagged({key: (value, tags)}, since, timeout)
+
+
+def set_many_tagged(values: dict[str, tuple[Any, Iterable[str]]], since: float, timeout: int) -> None:
+    entries = {k: _entry(v, tags, since, timeout) for k, (v, tags) in values.items()}
+    cache.set_many(entries, timeout=timeout + settings.ML_CACHE_STALE_TTL)
+    local = _local()
+    if local is not None:
+        for k, e in entries.items():
+            local.put(k, e)
+
+
+def invalidate_tags(tags: Iterable[str]) -> int:
+    """Invalide d'un seul ``set_many`` les entrées portant l'une des ``tags``. Retourne le nombre d'étiquettes."""
+    tags = set(tags)
+    if tags:
+        now = time.time()
+        # conservées plus longtemps que la plus longue entrée étiquetée
+        cache.set_many({_tag_key(t): now for t in tags}, timeout=settings.ML_CACHE_TAG_TTL)
+        local = _local()
+        if local is not None:
+            local.drop_tags(tags)
+    return len(tags)
+
+
+class InvalidationQueue:
+    """Invalidations regroupées et écrites en un ``set_many`` après un délai sans nouvel ajout."""
+
+    def __init__(self) -> None:
+        self._tags: set[str] = set()
+        self._first = self._last = 0.0
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self.flushes = self.queued = 0
+
+    def add(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        if not tags:
+            return
+        if settings.ML_CACHE_INVALIDATION_DEBOUNCE <= 0:
+            self._write(tags)
+            return
+        with self._cond:
+            now = time.monotonic()
+            if not self._tags:
+                self._first = now
+            self._tags |= tags
+            self._last = now
+            self.queued += len(tags)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self) -> int:
+        """Écrit immédiatement les étiquettes en attente; retourne leur nombre."""
+        with self._cond:
+            tags, self._tags = self._tags, set()
+        return self._write(tags)
+
+    def pending(self) -> int:
+        return len(self._tags)
+
+    def _write(self, tags: set[str]) -> int:
+        if not tags:
+            return 0
+        self.flushes += 1
+        return invalidate_tags(tags)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._tags:
+                    self._cond.wait()
+                deadline = min(self._last + settings.ML_CACHE_INVALIDATION_DEBOUNCE, self._first + settings.ML_CACHE_INVALIDATION_MAX_DELAY)
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("CACHE_TAG_INVALIDATION_FAILED pending=%s", self.pending())
+
+    def stats(self) -> dict[str, Any]:
+        return {"pending": self.pending(), "queued": self.queued, "flushes": self.flushes, "debounce_s": settings.ML_CACHE_INVALIDATION_DEBOUNCE}
+
+
+invalidations = InvalidationQueue()
+atexit.register(invalidations.flush)
+
+
+def tier_stats() -> dict[str, Any]:
+    """Taux de succès par niveau: local (sur toutes les lectures), partagé (sur les lectures manquées en local)."""
+    with _tier_lock:
+        stats = dict(_tier_stats)
+    lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+    shared = stats["shared_hits"] + stats["misses"]
+    local = _local()
+    return {
+        "local": {**(local.stats() if local is not None else {"size": 0, "capacity": 0}), "hits": stats["local_hits"], "hit_ratio": round(stats["local_hits"] / lookups, 4) if lookups else 0.0},
+        "shared": {"hits": stats["shared_hits"], "misses": stats["misses"], "hit_ratio": round(stats["shared_hits"] / shared, 4) if shared else 0.0},
+    }
+
+
+# Remplissage du cache: un seul calcul par clé à la fois (single-flight), valeur périmée servie pendant le recalcul.
+# Verrou par clé dans le cache partagé (``cache.add``: SET NX sous Redis), doublé d'un vol local par processus:
+# les threads du processus attendent l'événement du calcul en cours, les autres processus sondent le cache.
+_flights: dict[str, threading.Event] = {}
+_flights_lock = threading.Lock()
+_fill_stats = {"fresh": 0, "stale": 0, "computed": 0, "waited": 0, "lock_errors": 0}
+
+# intervalle de sondage du cache par un processus qui attend le calcul d'un autre
+POLL_INTERVAL = 0.01
+
+
+def _lock_key(key: str) -> str:
+    return f"lock:{key}"
+
+
+def _count(name: str) -> None:
+    with _flights_lock:
+        _fill_stats[name] += 1
+
+
+def _lead(key: str) -> threading.Event | None:
+    """Prend le vol local de ``key``: l'événement à signaler, ou None si un autre thread du processus calcule déjà."""
+    with _flights_lock:
+        if key in _flights:
+            return None
+        ev = _flights[key] = threading.Event()
+        return ev
+
+
+def _land(key: str, ev: threading.Event) -> None:
+    with _flights_lock:
+        _flights.pop(key, None)
+    ev.set()
+
+
+def _lock(key: str) -> bool:
+    """Verrou partagé de ``key``; sans cache partagé joignable, le vol local suffit."""
+    try:
+        return bool(cache.add(_lock_key(key), 1, timeout=settings.ML_CACHE_LOCK_TIMEOUT))
+    except Exception:
+        _count("lock_errors")
+        return True
+
+
+def _unlock(key: str) -> None:
+    try:
+        cache.delete(_lock_key(key))
+    except Exception:
+        _count("lock_errors")
+
+
+def _read(key: str) -> tuple[bool, Any] | None:
+    return _lookup([key]).get(key)
+
+
+def fill(key: str, compute: Callable[[], tuple[Any, Iterable[str] | None]], timeout: int) -> Any:
+    """Valeur sous ``key``, calculée par un seul worker; une entrée expirée (pas invalidée) est servie pendant son recalcul."""
+    state = _read(key)
+    if state is not None and state[0]:
+        _count("fresh")
+        return state[1]
+    ev = _lead(key)
+    if ev is None:
+        if state is not None:
+            _count("stale")
+            return state[1]
+        # un thread du processus calcule: attendre sa publication
+        with _flights_lock:
+            running = _flights.get(key)
+        if running is not None:
+            running.wait(settings.ML_CACHE_FILL_WAIT)
+        state = _read(key)
+        if state is not None:
+            _count("waited")
+            return state[1]
+        return _compute(key, compute, timeout)
+    try:
+        if not _lock(key):
+            if state is not None:
+                _count("stale")
+                return state[1]
+            # un autre processus calcule: sonder le cache jusqu'à sa publication
+            deadline = time.monotonic() + settings.ML_CACHE_FILL_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                state = _read(key)
+                if state is not None:
+                    _count("waited")
+                    return state[1]
+            return _compute(key, compute, timeout)
+        try:
+            return _compute(key, compute, timeout)
+        finally:
+            _unlock(key)
+    finally:
+        _land(key, ev)
+
+
+def _compute(key: str, compute: Callable[[], tuple[Any, Iterable[str] | None]], timeout: int) -> Any:
+    since = time.time()
+    value, tags = compute()
+    _count("computed")
+    if tags is not None:
+        set_tagged(key, value, tags, since, timeout)
+    return value
+
+
+def fill_stats() -> dict[str, Any]:
+    with _flights_lock:
+        stats = dict(_fill_stats, in_flight=len(_flights))
+    served = stats["fresh"] + stats["stale"] + stats["waited"] + stats["computed"]
+    stats["hit_ratio"] = round((stats["fresh"] + stats["stale"] + stats["waited"]) / served, 4) if served else 0.0
+    return stats
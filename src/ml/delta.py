@@ -0,0 +1,101 @@
+"""Segment delta de l'index produits: lignes ajoutées, tombstones et surcharges de colonnes depuis la base."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .releases import new_release, publish
+from .scoring import postings
+from .storage import FORMAT, csr_arrays, csr_from_arrays, load_arrays, save_arrays
+from .utils import artifacts_dir, read_manifest
+
+DELTA_NAME = "product_index_delta"
+DELTA_DIR = "product_index_delta"
+COLUMN_ARRAYS = ("col_ids", "col_available", "col_category")
+
+
+@dataclass
+class DeltaSegment:
+    base_version: str
+    seq: int
+    ids: np.ndarray
+    X: Any
+    tombstones: np.ndarray  # ids retirés de la base
+    Xt: Any = field(default=None, repr=False)
+    # surcharges de colonnes par produit: id, disponible (actif et en stock), code catégorie
+    col_ids: np.ndarray = field(default_factory=lambda: np.array([], dtype=np.int64), repr=False)
+    col_available: np.ndarray = field(default_factory=lambda: np.array([], dtype=bool), repr=False)
+    col_category: np.ndarray = field(default_factory=lambda: np.array([], dtype=np.int32), repr=False)
+
+    def __post_init__(self) -> None:
+        if self.Xt is None:
+            self.Xt = postings(self.X)
+
+    @classmethod
+    def empty(cls, base_version: str, dim: int) -> DeltaSegment:
+        return cls(base_version=base_version, seq=0, ids=np.array([], dtype=np.int64), X=csr_matrix((0, dim)), tombstones=np.array([], dtype=np.int64))
+
+    @property
+    def row_changes(self) -> int:
+        """Lignes ajoutées ou retirées (ce qui fait dériver l'idf)."""
+        return int(self.ids.size + self.tombstones.size)
+
+    @property
+    def changes(self) -> int:
+        return self.row_changes + int(self.col_ids.size)
+
+
+def save_delta(delta: DeltaSegment) -> None:
+    release, path = new_release(DELTA_DIR)
+    arrays = save_arrays(
+        path,
+        {
+            **csr_arrays(delta.X),
+            "ids": delta.ids.astype(np.int64),
+            "tombstones": delta.tombstones.astype(np.int64),
+            "col_ids": delta.col_ids.astype(np.int64),
+            "col_available": delta.col_available.astype(bool),
+            "col_category": delta.col_category.astype(np.int32),
+        },
+    )
+    publish(
+        DELTA_NAME,
+        {
+            "base_version": delta.base_version,
+            "seq": delta.seq,
+            "rows": int(delta.ids.size),
+            "tombstones": int(delta.tombstones.size),
+            "columns": int(delta.col_ids.size),
+            "format": FORMAT,
+            "dir": release,
+            "arrays": arrays,
+        },
+    )
+
+
+def load_delta(base_version: str, dim: int) -> DeltaSegment | None:
+    """Segment courant, ou None s'il est absent ou construit contre une autre base."""
+    manifest = read_manifest(DELTA_NAME)
+    if not manifest or manifest.get("base_version") != base_version or manifest.get("format") != FORMAT:
+        return None
+    path = artifacts_dir() / manifest["dir"]
+    if not path.exists():
+        return None
+    arrays = load_arrays(path, manifest["arrays"], mmap=False)
+    return DeltaSegment(
+        base_version=base_version,
+        seq=manifest["seq"],
+        ids=arrays["ids"],
+        X=csr_from_arrays(arrays, dim),
+        tombstones=arrays["tombstones"],
+        # segments écrits avant l'ajout des colonnes: pas de surcharges
+        **{name: arrays[name] for name in COLUMN_ARRAYS if name in arrays},
+    )
+
+
+def clear_delta(base_version: str, dim: int) -> None:
+    save_delta(DeltaSegment.empty(base_version, dim))
@@ -0,0 +1,289 @@
+"""Représentation dense (LSA) de l'index produits, servie par un index ANN de type IVF."""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from django.conf import settings
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+
+from .holder import IndexHolder
+from .releases import new_release, publish
+from .scoring import EMPTY_POS, EMPTY_SCORES, rank, top_k
+from .storage import FORMAT, load_arrays, save_arrays
+from .utils import artifact_lock, artifacts_dir, read_manifest
+
+if TYPE_CHECKING:
+    from .delta import DeltaSegment
+    from .products_index import ProductIndex
+
+logger = logging.getLogger(__name__)
+
+DENSE_NAME = "product_dense"
+DENSE_DIR = "product_dense"
+# lignes par bloc pour les produits denses (affectation k-means, projection): borne la mémoire temporaire
+BLOCK_ROWS = 65536
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 100_000
+
+
+@dataclass
+class DenseIndex:
+    index_built_at: str  # horodatage du manifest de la base décrite
+    components: np.ndarray  # (d, dim) float32: projection TF-IDF → LSA
+    embeddings: np.ndarray  # (n, d) float32, positions de la base, normalisées L2
+    centroids: np.ndarray  # (nlist, d) float32
+    list_offsets: np.ndarray  # (nlist + 1,) début de chaque liste dans list_rows
+    list_rows: np.ndarray  # positions de la base, groupées par liste
+    nprobe: int = 8
+    built_at: str = ""  # horodatage du manifest de la table
+    # (segment, lignes projetées): le delta publié n'est projeté qu'une fois
+    _delta: tuple[DeltaSegment, np.ndarray] | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def empty(cls) -> DenseIndex:
+        z = np.zeros((0, 0), dtype=np.float32)
+        return cls("", z, z, z, np.zeros(1, dtype=np.int64), np.array([], dtype=np.int32))
+
+    @property
+    def version(self) -> str:
+        return self.index_built_at
+
+    @property
+    def dims(self) -> int:
+        return int(self.components.shape[0])
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def current_for(self, idx: ProductIndex) -> bool:
+        return bool(self.index_built_at) and self.index_built_at == idx.built_at
+
+    def project(self, X: Any) -> np.ndarray:
+        return project(X, self.components)
+
+    def delta_embeddings(self, delta: DeltaSegment) -> np.ndarray:
+        cached = self._delta
+        if cached is None or cached[0] is not delta:
+            cached = self._delta = (delta, self.project(delta.X))
+        return cached[1]
+
+    def probe(self, q: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        """Positions des listes les plus proches de ``q`` (toutes si ``nprobe`` >= nlist)."""
+        nprobe = min(max(nprobe or self.nprobe, 1), self.nlist)
+        if nprobe >= self.nlist:
+            return np.asarray(self.list_rows, dtype=np.int64)
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_rows[self.list_offsets[j] : self.list_offsets[j + 1]] for j in lists]).astype(np.int64)
+
+
+def _normalize(E: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    return np.divide(E, norms, out=np.zeros_like(E), where=norms > 0)
+
+
+def project(X: Any, components: np.ndarray) -> np.ndarray:
+    """Lignes TF-IDF (sparse) → vecteurs LSA normalisés, float32, par blocs de lignes."""
+    if X.shape[0] <= BLOCK_ROWS:
+        return _normalize(np.asarray(X @ components.T, dtype=np.float32))
+    return np.vstack([project(X[s : s + BLOCK_ROWS], components) for s in range(0, X.shape[0], BLOCK_ROWS)])
+
+
+def _assign(E: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(E.shape[0], dtype=np.int64)
+    for s in range(0, E.shape[0], BLOCK_ROWS):
+        out[s : s + BLOCK_ROWS] = np.argmax(E[s : s + BLOCK_ROWS] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(E: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Centroïdes (normalisés) d'un k-means cosinus, appris sur un échantillon d'au plus KMEANS_SAMPLE lignes."""
+    rng = np.random.default_rng(seed)
+    sample = E[rng.choice(E.shape[0], KMEANS_SAMPLE, replace=False)] if E.shape[0] > KMEANS_SAMPLE else E
+    nlist = min(nlist, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    rows = np.arange(sample.shape[0])
+    for _ in range(iterations):
+        assign = _assign(sample, centroids)
+        # somme des membres de chaque liste: un produit (indicatrice creuse) × échantillon
+        sums = np.asarray(csr_matrix((np.ones(rows.size, dtype=np.float32), (assign, rows)), shape=(nlist, rows.size)) @ sample)
+        filled = np.bincount(assign, minlength=nlist) > 0
+        # liste vide: son centroïde est conservé
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+
+def _inverted_lists(assign: np.ndarray, nlist: int) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+    return offsets, order.astype(np.int32)
+
+
+def auto_nlist(n_rows: int) -> int:
+    return int(max(1, min(round(np.sqrt(n_rows)), n_rows)))
+
+
+def build_dense(idx: ProductIndex, dims: int | None = None, nlist: int | None = None, nprobe: int | None = None, sample: int | None = None) -> DenseIndex:
+    """SVD tronquée de la base, listes IVF, mesure du rappel; sauvegarde et publie la table."""
+    t0 = time.monotonic()
+    n_rows, dim = idx.X.shape
+    if n_rows < 2 or dim < 2:
+        raise ValueError("dense index needs at least 2 products and 2 terms")
+    dims = max(1, min(dims or settings.ML_DENSE_DIMS, dim - 1, n_rows - 1))
+    svd = TruncatedSVD(n_components=dims, algorithm="randomized", random_state=0)
+    svd.fit(idx.X)
+    components = svd.components_.astype(np.float32)
+    embeddings = project(idx.X, components)
+    centroids = spherical_kmeans(embeddings, min(nlist or settings.ML_DENSE_NLIST or auto_nlist(n_rows), n_rows))
+    nlist = centroids.shape[0]
+    offsets, rows = _inverted_lists(_assign(embeddings, centroids), nlist)
+    table = DenseIndex(idx.built_at, components, embeddings, centroids, offsets, rows, nprobe=nprobe or settings.ML_DENSE_NPROBE)
+    quality = measure_recall(idx, table, sample or settings.ML_DENSE_RECALL_SAMPLE)
+    build = {"duration_ms": int((time.monotonic() - t0) * 1000), "explained_variance": float(svd.explained_variance_ratio_.sum())}
+    with artifact_lock(DENSE_NAME):
+        save_dense(table, idx.version, {**quality, **build})
+    _holder.publish(table)
+    logger.info("PRODUCT_DENSE_BUILT version=%s dims=%s nlist=%s nprobe=%s recall=%s", idx.version, dims, nlist, table.nprobe, quality["recall_vs_exact"])
+    return table
+
+
+def search_vectors(idx: ProductIndex, table: DenseIndex, q: np.ndarray, k: int, nprobe: int | None = None, exclude: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k (positions globales, cosinus LSA) de ``q``: listes IVF sondées de la base + lignes du delta."""
+    pos = table.probe(q, nprobe)
+    if idx.dead.size:
+        pos = pos[~np.isin(pos, idx.dead)]
+    sc = (table.embeddings[pos] @ q).astype(np.float64)
+    if idx.delta is not None and idx.delta.ids.size:
+        pos = np.concatenate([pos, np.arange(idx.ids.size, idx.size, dtype=np.int64)])
+        sc = np.concatenate([sc, (table.delta_embeddings(idx.delta) @ q).astype(np.float64)])
+    # cosinus LSA nul ou négatif: pas de candidat (comme un document sans terme commun en TF-IDF)
+    keep = sc > 0 if exclude is None else (sc > 0) & (pos != exclude)
+    pos, sc = pos[keep], sc[keep]
+    if pos.size == 0:
+        return EMPTY_POS, EMPTY_SCORES
+    return top_k(pos, sc, k)
+
+
+def row_vector(idx: ProductIndex, table: DenseIndex, pos: int) -> np.ndarray:
+    if pos < idx.ids.size:
+        return np.asarray(table.embeddings[pos])
+    return np.asarray(table.delta_embeddings(idx.delta)[pos - idx.ids.size])
+
+
+def measure_recall(idx: ProductIndex, table: DenseIndex, sample: int, k: int = 10) -> dict[str, Any]:
+    """Rappel@k des voisins ANN d'un échantillon de produits, contre la recherche exacte creuse et dense exhaustive."""
+    n_rows = idx.ids.size
+    rng = np.random.default_rng(0)
+    queries = rng.choice(n_rows, min(sample, n_rows), replace=False)
+    k = min(k, n_rows - 1)
+    full = table.nlist
+    hits_exact = hits_dense = total = 0
+    ann_s = dense_s = 0.0
+    for pos in queries.tolist():
+        q = table.embeddings[pos]
+        t = time.perf_counter()
+        ann = set(search_vectors(idx, table, q, k, exclude=pos)[0].tolist())
+        ann_s += time.perf_counter() - t
+        t = time.perf_counter()
+        dense = set(search_vectors(idx, table, q, k, nprobe=full, exclude=pos)[0].tolist())
+        dense_s += time.perf_counter() - t
+        exact_pos, exact_sc = rank(*idx.candidates(idx.X[pos], n_rows), k, idx.size, exclude=pos, skip=idx.dead)
+        exact = set(exact_pos[exact_sc > 0].tolist())
+        hits_exact += len(ann & exact)
+        hits_dense += len(ann & dense)
+        total += len(exact)
+    n = max(queries.size, 1)
+    return {
+        "recall_k": int(k),
+        "recall_sample": int(queries.size),
+        "recall_vs_exact": round(hits_exact / max(total, 1), 4),
+        "recall_vs_dense": round(hits_dense / max(queries.size * k, 1), 4),
+        "ann_ms": round(ann_s * 1000 / n, 3),
+        "dense_exhaustive_ms": round(dense_s * 1000 / n, 3),
+    }
+
+
+def rebase_dense(old: ProductIndex, new: ProductIndex) -> bool:
+    """Rattache à ``new`` (fusion du delta) une table à jour pour ``old``, sans réapprentissage."""
+    with artifact_lock(DENSE_NAME):
+        table = load_dense()
+        manifest = read_manifest(DENSE_NAME)
+        if table is None or not table.current_for(old):
+            return False
+        assign = np.empty(table.embeddings.shape[0], dtype=np.int64)
+        for j in range(table.nlist):
+            assign[table.list_rows[table.list_offsets[j] : table.list_offsets[j + 1]]] = j
+        alive = np.setdiff1d(np.arange(old.ids.size), old.dead)
+        added = table.project(old.delta.X) if old.delta is not None and old.delta.ids.size else np.zeros((0, table.dims), dtype=np.float32)
+        embeddings = np.vstack([table.embeddings[alive], added])
+        offsets, rows = _inverted_lists(np.concatenate([assign[alive], _assign(added, table.centroids)]), table.nlist)
+        rebased = DenseIndex(new.built_at, table.components, embeddings, table.centroids, offsets, rows, nprobe=table.nprobe)
+        save_dense(rebased, new.version, {**manifest.get("quality", {}), "rebased_from": old.version})
+    _holder.publish(rebased)
+    return True
+
+
+def save_dense(table: DenseIndex, index_version: str, quality: dict[str, Any]) -> None:
+    release, path = new_release(DENSE_DIR)
+    arrays = save_arrays(
+        path,
+        {"components": table.components, "embeddings": table.embeddings, "centroids": table.centroids, "list_offsets": table.list_offsets, "list_rows": table.list_rows},
+    )
+    table.built_at = publish(
+        DENSE_NAME,
+        {
+            "index_version": index_version,
+            "index_built_at": table.index_built_at,
+            "count": int(table.embeddings.shape[0]),
+            "dims": table.dims,
+            "nlist": table.nlist,
+            "nprobe": table.nprobe,
+            "format": FORMAT,
+            "dir": release,
+            "arrays": arrays,
+            "quality": quality,
+        },
+    )["timestamp"]
+
+
+def load_dense() -> DenseIndex | None:
+    manifest = read_manifest(DENSE_NAME)
+    if not manifest or manifest.get("format") != FORMAT:
+        return None
+    path = artifacts_dir() / manifest["dir"]
+    if not path.exists():
+        return None
+    arrays = load_arrays(path, manifest["arrays"])
+    return DenseIndex(
+        index_built_at=manifest["index_built_at"],
+        components=arrays["components"],
+        embeddings=arrays["embeddings"],
+        centroids=arrays["centroids"],
+        list_offsets=arrays["list_offsets"],
+        list_rows=arrays["list_rows"],
+        nprobe=manifest["nprobe"],
+        built_at=manifest["timestamp"],
+    )
+
+
+def _dense_nbytes(table: DenseIndex) -> int:
+    return int(table.components.nbytes + table.embeddings.nbytes + table.centroids.nbytes + table.list_offsets.nbytes + table.list_rows.nbytes)
+
+
+# sans table publiée: table vide, jamais à jour, la recherche reste exacte
+_holder: IndexHolder[DenseIndex] = IndexHolder(DENSE_NAME, lambda _previous: load_dense() or DenseIndex.empty(), _dense_nbytes)
+
+
+def get_table() -> DenseIndex:
+    return _holder.get()
+
+
+def index_stats() -> dict[str, Any]:
+    return _holder.stats()
@@ -0,0 +1,32 @@
+"""Diversification MMR (Maximal Marginal Relevance) sur un pool borné de candidats."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+
+def similarity_block(R: Any, categories: np.ndarray | None = None, category_weight: float = 0.0) -> np.ndarray:
+    """Similarités candidat × candidat des lignes ``R``, au moins ``category_weight`` dans une même catégorie."""
+    S = np.asarray((R @ R.T).todense(), dtype=np.float64)
+    if categories is not None and category_weight > 0:
+        same = categories[:, None] == categories[None, :]
+        S = np.where(same, np.maximum(S, category_weight), S)
+    return S
+
+
+def mmr_select(relevance: np.ndarray, sim: np.ndarray, k: int, mmr_lambda: float = 0.7) -> np.ndarray:
+    """Indices (dans le pool) des ``k`` candidats retenus, dans l'ordre de sélection."""
+    m = relevance.size
+    k = min(max(k, 0), m)
+    redundancy = np.zeros(m, dtype=np.float64)
+    available = np.ones(m, dtype=bool)
+    picks = np.empty(k, dtype=np.int64)
+    for step in range(k):
+        score = np.where(available, mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(score))
+        picks[step] = best
+        available[best] = False
+        np.maximum(redundancy, sim[best], out=redundancy)
+    return picks
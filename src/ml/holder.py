@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import logging
+import mmap
+import threading
+import time
+from collections.abc import Callable
+from typing import Any, Generic, TypeVar
+
+import numpy as np
+
+from . import versions
+from .utils import manifest_signature
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class IndexHolder(Generic[T]):
+    """Index résident partagé par les threads du processus, rechargé quand son manifest change."""
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[T | None], T],
+        sizer: Callable[[T], int] | None = None,
+        watch: tuple[str, ...] = (),
+        background: bool = False,
+        prewarm: Callable[[T], Any] | None = None,
+    ) -> None:
+        self.name = name
+        self._loader = loader
+        self._sizer = sizer
+        self._names = (name, *watch)
+        self._background = background
+        self._prewarm = prewarm
+        self._reloading = False
+        # un seul rechargement en arrière-plan à la fois; jamais tenu par les requêtes
+        self._reload_lock = threading.Lock()
+        # réentrant: un loader qui construit l'index appelle publish() sous le verrou de get()
+        self._lock = threading.RLock()
+        # incrémenté à chaque installation: un chargement dépassé par un publish() n'est pas installé
+        self._generation = 0
+        self._current: T | None = None
+        self._signature: tuple[tuple[str, int] | None, ...] | None = None
+        # signatures du contexte de versions lors de la dernière vérification: tant qu'elles ne changent pas, pas de stat
+        self._polled: tuple[tuple[str, int] | None, ...] | None = None
+        self._stats: dict[str, Any] = {"loads": 0, "load_ms": 0, "loaded_at": None, "resident_bytes": 0, "version": None}
+
+    def get(self, fresh: bool = False) -> T:
+        current = self._current
+        polled = versions.context.signatures(self._names)
+        if current is not None and not fresh and polled == self._polled:
+            return current
+        sig = self._read_signature()
+        if current is not None and sig == self._signature:
+            self._polled = polled
+            return current
+        if current is None or fresh:
+            # premier chargement (ou lecture fraîche demandée): bloquant
+            with self._lock:
+                if self._current is None or self._read_signature() != self._signature:
+                    self._reload()
+                return self._current  # type: ignore[return-value]
+        if self._background:
+            self._reload_in_background()
+            return current
+        # rechargement: un seul thread charge, les autres servent l'ancien index
+        if not self._lock.acquire(blocking=False):
+            return current
+        try:
+            if self._read_signature() != self._signature:
+                self._reload()
+        finally:
+            self._lock.release()
+        return self._current  # type: ignore[return-value]
+
+    @property
+    def current(self) -> T | None:
+        """Index installé, sans vérification du manifest (statistiques)."""
+        return self._current
+
+    def publish(self, value: T) -> None:
+        """Installe un index déjà en mémoire (ex: juste après un build)."""
+        with self._lock:
+            self._install(value, self._read_signature(), load_ms=0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._current = None
+            self._signature = None
+
+    def stats(self) -> dict[str, Any]:
+        return {"name": self.name, **self._stats, "reloading": self._reloading}
+
+    def _read_signature(self) -> tuple[tuple[str, int] | None, ...]:
+        return tuple(manifest_signature(n) for n in self._names)
+
+    def _reload_in_background(self) -> None:
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        self._reloading = True
+
+        def _run() -> None:
+            try:
+                # chargement et préchauffage sans verrou: les requêtes servent l'ancien index pendant ce temps
+                if self._read_signature() != self._signature:
+                    self._reload(prewarm=True, background=True)
+            except Exception:
+                # l'ancienne version reste servie; nouvel essai au prochain appel
+                logger.exception("INDEX_RELOAD_FAILED name=%s", self.name)
+            finally:
+                self._reloading = False
+                self._reload_lock.release()
+
+        threading.Thread(target=_run, name=f"{self.name}-reload", daemon=True).start()
+
+    def _reload(self, prewarm: bool = False, background: bool = False) -> None:
+        # la signature est lue avant le chargement: un manifest réécrit entre-temps déclenchera un nouveau rechargement
+        sig = self._read_signature()
+        generation = self._generation
+        t0 = time.monotonic()
+        value = self._loader(self._current)
+        if prewarm and self._prewarm is not None:
+            self._prewarm(value)
+        self._install(value, self._read_signature() if sig[0] is None else sig, load_ms=int((time.monotonic() - t0) * 1000), generation=generation if background else None)
+
+    def _install(self, value: T, sig: tuple[tuple[str, int] | None, ...], load_ms: int, generation: int | None = None) -> None:
+        size = self._sizer(value) if self._sizer else 0
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._generation += 1
+            self._current = value
+            self._signature = sig
+        self._stats = {
+            "loads": self._stats["loads"] + 1,
+            "load_ms": load_ms,
+            "loaded_at": time.time(),
+            "resident_bytes": int(size),
+            "version": getattr(value, "version", None),
+        }
+        logger.info("INDEX_LOADED name=%s version=%s load_ms=%s resident_bytes=%s", self.name, self._stats["version"], load_ms, size)
+
+
+def touch_pages(*arrays: Any) -> int:
+    """Lit un octet par page de chaque tableau: les pages des memmaps passent dans le page cache. Retourne les octets couverts."""
+    total = 0
+    for arr in arrays:
+        if arr is None or not getattr(arr, "size", 0):
+            continue
+        flat = np.asarray(arr).reshape(-1).view(np.uint8)
+        int(flat[:: mmap.PAGESIZE].sum())
+        total += flat.size
+    return total
+
+
+def sparse_nbytes(X: Any) -> int:
+    return int(sum(getattr(X, a).nbytes for a in ("data", "indices", "indptr") if hasattr(X, a)))
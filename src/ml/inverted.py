@@ -0,0 +1,101 @@
+"""Moteur de recherche sur index inversé avec élagage MaxScore, même classement que le noyau exhaustif."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .scoring import EMPTY_POS, EMPTY_SCORES, score_terms
+
+ENGINES = ("exact", "maxscore")
+# marge absolue contre les écarts d'arrondi entre sommes partielles et bornes
+EPS = 1e-12
+
+
+@dataclass
+class PruningStats:
+    postings_total: int = 0
+    postings_scanned: int = 0
+    probes: int = 0
+
+
+def term_upper_bounds(Xt: csr_matrix) -> np.ndarray:
+    """Poids maximal de chaque liste de postings (0 pour un terme sans posting)."""
+    out = np.zeros(Xt.shape[0], dtype=np.float64)
+    nonempty = np.flatnonzero(np.diff(Xt.indptr))
+    if nonempty.size:
+        out[nonempty] = np.maximum.reduceat(np.asarray(Xt.data), Xt.indptr[nonempty])
+    return out
+
+
+def _kth(scores: np.ndarray, k: int) -> float:
+    if scores.size < k:
+        return 0.0
+    return float(np.partition(scores, scores.size - k)[scores.size - k])
+
+
+def _probe(Xt: csr_matrix, term: int, weight: float, docs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Contributions du terme pour ``docs`` (positions triées) sans parcourir toute sa liste."""
+    s, e = int(Xt.indptr[term]), int(Xt.indptr[term + 1])
+    plist = Xt.indices[s:e]
+    at = np.searchsorted(plist, docs)
+    hit = at < plist.size
+    hit[hit] = plist[at[hit]] == docs[hit]
+    contrib = np.zeros(docs.size, dtype=np.float64)
+    contrib[hit] = Xt.data[s:e][at[hit]] * weight
+    return hit, contrib
+
+
+def maxscore(terms: np.ndarray, weights: np.ndarray, Xt: csr_matrix, upper: np.ndarray, k: int, stats: PruningStats | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Candidats (positions, scores exacts) contenant le top-k; à passer à ``scoring.rank``."""
+    stats = stats if stats is not None else PruningStats()
+    if terms.size == 0 or k <= 0:
+        return EMPTY_POS, EMPTY_SCORES
+    terms = np.asarray(terms, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    lengths = Xt.indptr[terms + 1] - Xt.indptr[terms]
+    stats.postings_total += int(lengths.sum())
+    bounds = weights * upper[terms]
+    order = np.argsort(-bounds, kind="stable")
+    # remaining[i]: score maximal atteignable via les termes order[i:]
+    remaining = np.append(np.cumsum(bounds[order][::-1])[::-1], 0.0)
+
+    # phase 1: listes "essentielles", parcourues intégralement
+    cand_pos, cand_sc = EMPTY_POS, EMPTY_SCORES
+    step = 0
+    while step < order.size:
+        if cand_pos.size >= k and remaining[step] + EPS < _kth(cand_sc, k):
+            break
+        j = order[step]
+        pos, sc = score_terms(terms[j : j + 1], weights[j : j + 1], Xt)
+        stats.postings_scanned += int(lengths[j])
+        if cand_pos.size:
+            pos, inv = np.unique(np.concatenate([cand_pos, pos]), return_inverse=True)
+            sc = np.bincount(inv, weights=np.concatenate([cand_sc, sc]))
+        cand_pos, cand_sc = pos, sc
+        step += 1
+
+    # phase 2: listes non essentielles, seulement sondées pour les candidats encore en course
+    for s in range(step, order.size):
+        keep = cand_sc + remaining[s] + EPS >= _kth(cand_sc, k)
+        cand_pos, cand_sc = cand_pos[keep], cand_sc[keep]
+        j = order[s]
+        _, contrib = _probe(Xt, int(terms[j]), float(weights[j]), cand_pos)
+        stats.probes += int(cand_pos.size)
+        cand_sc = cand_sc + contrib
+
+    # seuls les candidats au niveau du k-ième score (égalités comprises) sont recalculés exactement
+    keep = cand_sc + EPS >= _kth(cand_sc, k)
+    cand_pos = cand_pos[keep]
+    return cand_pos, _rescore(terms, weights, Xt, cand_pos)
+
+
+def _rescore(terms: np.ndarray, weights: np.ndarray, Xt: csr_matrix, docs: np.ndarray) -> np.ndarray:
+    """Scores recalculés dans l'ordre des termes de la requête (mêmes arrondis que ``score_terms``)."""
+    acc = np.zeros(docs.size, dtype=np.float64)
+    for t, w in zip(terms, weights, strict=True):
+        hit, contrib = _probe(Xt, int(t), float(w), docs)
+        acc[hit] = acc[hit] + contrib[hit]
+    return acc
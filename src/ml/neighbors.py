@@ -0,0 +1,255 @@
+"""Table de voisins précalculée: pour chaque produit, ses N voisins les plus proches dans l'index."""
+
+from __future__ import annotations
+
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from django.conf import settings
+
+from .holder import IndexHolder
+from .releases import new_release, publish
+from .scoring import top_k
+from .storage import FORMAT, load_arrays, save_arrays
+from .utils import artifact_lock, artifacts_dir, read_manifest, write_manifest
+
+if TYPE_CHECKING:
+    from .products_index import ProductIndex
+
+logger = logging.getLogger(__name__)
+
+NEIGHBORS_NAME = "product_neighbors"
+NEIGHBORS_DIR = "product_neighbors"
+PAD = -1
+# précision float16 (~3 chiffres significatifs): marge pour comparer un score exact à un score stocké
+FLOAT16_TOL = 1e-3
+
+
+@dataclass
+class NeighborTable:
+    index_version: str
+    delta_seq: int
+    ids: np.ndarray  # ids produits sources (triés)
+    neighbors: np.ndarray  # (n, N) ids voisins, int32
+    scores: np.ndarray  # (n, N) float16
+    index_built_at: str = ""  # horodatage du manifest de la base décrite (la version peut être réutilisée)
+
+    @classmethod
+    def empty(cls, width: int = 0) -> NeighborTable:
+        return cls(index_version="", delta_seq=0, ids=np.array([], dtype=np.int32), neighbors=np.zeros((0, width), dtype=np.int32), scores=np.zeros((0, width), dtype=np.float16))
+
+    @property
+    def version(self) -> str:
+        return f"{self.index_version}@{self.delta_seq}" if self.index_version else ""
+
+    @property
+    def width(self) -> int:
+        return int(self.neighbors.shape[1])
+
+    def current_for(self, idx: ProductIndex) -> bool:
+        return bool(self.index_built_at) and self.index_built_at == idx.built_at and self.delta_seq == delta_seq(idx)
+
+    def lookup(self, product_id: int) -> tuple[np.ndarray, np.ndarray] | None:
+        """Voisins (ids, scores) du produit, ou None s'il n'a pas de ligne."""
+        at = int(np.searchsorted(self.ids, product_id))
+        if at >= self.ids.size or self.ids[at] != product_id:
+            return None
+        row = self.neighbors[at]
+        n = int(np.count_nonzero(row != PAD))
+        return row[:n].astype(np.int64), self.scores[at, :n].astype(np.float64)
+
+
+def delta_seq(idx: ProductIndex) -> int:
+    return idx.delta.seq if idx.delta is not None else 0
+
+
+def live_positions(idx: ProductIndex) -> np.ndarray:
+    return np.setdiff1d(np.arange(idx.size, dtype=np.int64), idx.dead)
+
+
+def _block(idx: ProductIndex, start: int, stop: int) -> Any:
+    """Lignes [start, stop) en positions globales; le bloc ne chevauche jamais base et delta."""
+    base = idx.ids.size
+    if stop <= base:
+        return idx.X[start:stop]
+    return idx.delta.X[start - base : stop - base]
+
+
+def _chunks(idx: ProductIndex, chunk: int) -> Iterator[tuple[int, int]]:
+    base = idx.ids.size
+    for lo, hi in ((0, base), (base, idx.size)):
+        for s in range(lo, hi, chunk):
+            yield s, min(s + chunk, hi)
+
+
+def top_neighbors(idx: ProductIndex, Q: Any, positions: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top-``width`` voisins (positions globales, scores) des lignes ``Q``, complétés par -1."""
+    out_pos = np.full((positions.size, width), PAD, dtype=np.int64)
+    out_sc = np.zeros((positions.size, width), dtype=np.float64)
+    for r, (pos, sc) in enumerate(idx.candidates_many(Q)):
+        keep = (pos != positions[r]) & (sc > 0)
+        top_pos, top_sc = top_k(pos[keep], sc[keep], width)
+        out_pos[r, : top_pos.size] = top_pos
+        out_sc[r, : top_sc.size] = top_sc
+    return out_pos, out_sc
+
+
+def _chunk_neighbors(idx: ProductIndex, start: int, stop: int, width: int) -> tuple[int, np.ndarray, np.ndarray]:
+    return start, *top_neighbors(idx, _block(idx, start, stop), np.arange(start, stop, dtype=np.int64), width)
+
+
+def build_neighbors(idx: ProductIndex, width: int | None = None, workers: int | None = None, chunk: int | None = None) -> NeighborTable:
+    """Calcule la table complète pour l'état courant de l'index, la sauvegarde et la publie."""
+    width = width or settings.ML_RECO_NEIGHBORS
+    workers = workers or settings.ML_RECO_NEIGHBORS_WORKERS or os.cpu_count() or 1
+    chunk = chunk or settings.ML_RECO_NEIGHBORS_CHUNK
+    nbr_pos = np.full((idx.size, width), PAD, dtype=np.int64)
+    nbr_sc = np.zeros((idx.size, width), dtype=np.float64)
+    tasks = list(_chunks(idx, chunk))
+    if workers <= 1 or len(tasks) <= 1:
+        results: Iterable[tuple[int, np.ndarray, np.ndarray]] = [_chunk_neighbors(idx, s, e, width) for s, e in tasks]
+    else:
+        # threads: l'index (memmaps) est partagé tel quel; pas de fork d'un processus déjà multithreadé
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="neighbors-build") as pool:
+            results = list(pool.map(lambda t: _chunk_neighbors(idx, *t, width), tasks))
+    for start, pos, sc in results:
+        nbr_pos[start : start + pos.shape[0]] = pos
+        nbr_sc[start : start + sc.shape[0]] = sc
+    live = live_positions(idx)
+    table = _table(idx, live, nbr_pos[live], nbr_sc[live])
+    with artifact_lock(NEIGHBORS_NAME):
+        save_neighbors(table)
+    _holder.publish(table)
+    logger.info("PRODUCT_NEIGHBORS_BUILT version=%s rows=%s width=%s workers=%s", table.version, table.ids.size, width, workers)
+    return table
+
+
+def refresh_neighbors(idx: ProductIndex, product_ids: Iterable[int], since_seq: int | None = None) -> NeighborTable | None:
+    """Recalcule les lignes touchées et rattache la table à ``idx``; None si elle n'était pas à jour."""
+    changed = np.unique(np.fromiter((int(i) for i in product_ids), dtype=np.int64))
+    with artifact_lock(NEIGHBORS_NAME):
+        table = load_neighbors()
+        expected = delta_seq(idx) if since_seq is None else since_seq
+        if table is None or table.index_built_at != idx.built_at or table.delta_seq != expected:
+            return None
+        if changed.size == 0:
+            # seules des colonnes (disponibilité, catégorie) ont changé: les voisins ne dépendent que du texte
+            write_manifest(NEIGHBORS_NAME, {**read_manifest(NEIGHBORS_NAME), "index_version": idx.version, "index_built_at": idx.built_at, "delta_seq": delta_seq(idx)})
+            return replace(table, index_version=idx.version, index_built_at=idx.built_at, delta_seq=delta_seq(idx))
+        affected = [changed, table.ids[np.any(np.isin(table.neighbors, changed), axis=1)].astype(np.int64)]
+        changed_pos = idx.positions_of(changed)
+        changed_pos = changed_pos[changed_pos >= 0]
+        if changed_pos.size and table.ids.size:
+            # seuil d'entrée de chaque ligne: son N-ième score (0 si la ligne n'est pas pleine)
+            floor = np.where(table.neighbors[:, -1] != PAD, table.scores[:, -1].astype(np.float64), 0.0)
+            for pos, sc in idx.candidates_many(idx.rows(changed_pos.tolist())):
+                ids = idx.all_ids[pos]
+                at = np.minimum(np.searchsorted(table.ids, ids), table.ids.size - 1)
+                enters = (table.ids[at] == ids) & (sc + FLOAT16_TOL >= floor[at])
+                affected.append(ids[enters].astype(np.int64))
+        affected_ids = np.unique(np.concatenate(affected))
+        recompute = idx.positions_of(affected_ids)
+        recompute = np.sort(recompute[recompute >= 0])
+        width = table.width
+        nbr_pos = np.full((recompute.size, width), PAD, dtype=np.int64)
+        nbr_sc = np.zeros((recompute.size, width), dtype=np.float64)
+        for s in range(0, recompute.size, settings.ML_RECO_NEIGHBORS_CHUNK):
+            part = recompute[s : s + settings.ML_RECO_NEIGHBORS_CHUNK]
+            nbr_pos[s : s + part.size], nbr_sc[s : s + part.size] = top_neighbors(idx, idx.rows(part.tolist()), part, width)
+        fresh = _table(idx, recompute, nbr_pos, nbr_sc)
+        keep = ~np.isin(table.ids, affected_ids)
+        merged = NeighborTable(
+            index_version=idx.version,
+            delta_seq=delta_seq(idx),
+            ids=np.concatenate([table.ids[keep], fresh.ids]),
+            neighbors=np.concatenate([table.neighbors[keep], fresh.neighbors]),
+            scores=np.concatenate([table.scores[keep], fresh.scores]),
+            index_built_at=idx.built_at,
+        )
+        order = np.argsort(merged.ids, kind="stable")
+        merged = replace(merged, ids=merged.ids[order], neighbors=merged.neighbors[order], scores=merged.scores[order])
+        save_neighbors(merged)
+    _holder.publish(merged)
+    logger.info("PRODUCT_NEIGHBORS_REFRESHED version=%s changed=%s recomputed=%s", merged.version, changed.size, recompute.size)
+    return merged
+
+
+def rebase_neighbors(old: ProductIndex, new: ProductIndex) -> bool:
+    """Rattache une table à jour pour ``old`` à ``new`` quand leur contenu est identique (fusion du delta)."""
+    with artifact_lock(NEIGHBORS_NAME):
+        manifest = read_manifest(NEIGHBORS_NAME)
+        if not manifest or manifest.get("index_built_at") != old.built_at or manifest.get("delta_seq") != delta_seq(old):
+            return False
+        write_manifest(NEIGHBORS_NAME, {**manifest, "index_version": new.version, "index_built_at": new.built_at, "delta_seq": delta_seq(new)})
+    return True
+
+
+def _table(idx: ProductIndex, positions: np.ndarray, nbr_pos: np.ndarray, nbr_sc: np.ndarray) -> NeighborTable:
+    ids = idx.all_ids[positions]
+    order = np.argsort(ids, kind="stable")
+    neighbors = np.where(nbr_pos >= 0, idx.all_ids[np.maximum(nbr_pos, 0)], PAD)
+    return NeighborTable(
+        index_version=idx.version,
+        delta_seq=delta_seq(idx),
+        ids=ids[order].astype(np.int32),
+        neighbors=neighbors[order].astype(np.int32),
+        scores=nbr_sc[order].astype(np.float16),
+        index_built_at=idx.built_at,
+    )
+
+
+def save_neighbors(table: NeighborTable) -> None:
+    release, path = new_release(NEIGHBORS_DIR)
+    arrays = save_arrays(path, {"ids": table.ids, "neighbors": table.neighbors, "scores": table.scores})
+    publish(
+        NEIGHBORS_NAME,
+        {
+            "index_version": table.index_version,
+            "index_built_at": table.index_built_at,
+            "delta_seq": table.delta_seq,
+            "count": int(table.ids.size),
+            "width": table.width,
+            "format": FORMAT,
+            "dir": release,
+            "arrays": arrays,
+        },
+    )
+
+
+def load_neighbors() -> NeighborTable | None:
+    manifest = read_manifest(NEIGHBORS_NAME)
+    if not manifest or manifest.get("format") != FORMAT:
+        return None
+    path = artifacts_dir() / manifest["dir"]
+    if not path.exists():
+        return None
+    arrays = load_arrays(path, manifest["arrays"])
+    return NeighborTable(
+        index_version=manifest["index_version"],
+        delta_seq=manifest["delta_seq"],
+        ids=arrays["ids"],
+        neighbors=arrays["neighbors"],
+        scores=arrays["scores"],
+        index_built_at=manifest.get("index_built_at", ""),
+    )
+
+
+def _table_nbytes(table: NeighborTable) -> int:
+    return int(table.ids.nbytes + table.neighbors.nbytes + table.scores.nbytes)
+
+
+# sans table publiée: table vide, jamais à jour, recommend() calcule les voisins à la volée
+_holder: IndexHolder[NeighborTable] = IndexHolder(NEIGHBORS_NAME, lambda _previous: load_neighbors() or NeighborTable.empty(), _table_nbytes)
+
+
+def get_table() -> NeighborTable:
+    return _holder.get()
+
+
+def index_stats() -> dict[str, Any]:
+    return _holder.stats()
@@ -1,103 +1,439 @@
 from __future__ import annotations
 
 import logging
-import pickle
-from dataclasses import dataclass
+import shutil
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field, replace
+from functools import cached_property
 from typing import Any
 
 import numpy as np
+from django.conf import settings
+from django.db import connection
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 from catalog.models import Product
 
+from . import dense as dense_index
+from . import neighbors, releases
+from .delta import DELTA_NAME, DeltaSegment, clear_delta, load_delta, save_delta
+from .diversity import mmr_select, similarity_block
+from .holder import IndexHolder, sparse_nbytes, touch_pages
+from .inverted import ENGINES, term_upper_bounds
+from .query import QueryEncoder
+from .releases import new_release
+from .scoring import EMPTY_POS, l2_rows, precision_agreement, rank
+from .shards import Shard, build_shards, postings_prefix, scatter, shard_bounds, shard_candidates
+from .storage import (
+    FORMAT,
+    arrays_spec,
+    check_precision,
+    compact_csr,
+    csr_arrays,
+    csr_from_arrays,
+    load_arrays,
+    load_vocabulary,
+    reset_dir,
+    save_arrays,
+    save_vocabulary,
+    vectorizer_from,
+)
+from .streaming import ShardWriter, VocabularyCounter, assemble_csr, batched, concat_column, exact_df, peak_rss_bytes, smooth_idf, transpose_csr
 from .text import normalize
-from .utils import artifacts_dir, read_manifest, write_manifest
+from .utils import artifact_lock, artifacts_dir, read_manifest, vocabulary_nbytes
 
 logger = logging.getLogger(__name__)
 
 INDEX_NAME = "product_index"
-PICKLE_FILE = "product_index.pkl"
+INDEX_DIR = "product_index"
+RECO_POOL_FACTOR = 4
 
 
 @dataclass
 class ProductIndex:
     version: str
     ids: np.ndarray
-    X: Any  # scipy sparse
+    X: Any  # scipy sparse, lignes normalisées L2
     vectorizer: TfidfVectorizer
+    shards: list[Shard] | None = field(default=None, repr=False)  # postings terme → produits, par tranche de lignes
+    upper: np.ndarray | None = field(default=None, repr=False)  # poids max par terme (MaxScore), tous shards confondus
+    engine: str = "exact"
+    precision: str = "float64"  # valeurs de X et des postings (storage.PRECISIONS)
+    built_at: str = ""  # horodatage du manifest de la base
+    delta: DeltaSegment | None = field(default=None, repr=False)
+    terms: np.ndarray | None = field(default=None, repr=False)  # vocabulaire inverse: colonne → terme
+    # colonnes des lignes de la base: disponible (actif et en stock), code catégorie (-1: aucune)
+    base_available: np.ndarray | None = field(default=None, repr=False)
+    base_category: np.ndarray | None = field(default=None, repr=False)
+    encoder: QueryEncoder | None = field(default=None, repr=False)  # vectorisation des requêtes (vocabulaire et idf de la base)
+    # positions globales: lignes de la base puis lignes du delta
+    all_ids: np.ndarray = field(init=False, repr=False)
+    dead: np.ndarray = field(init=False, repr=False)  # positions de la base retirées (triées)
+    available: np.ndarray = field(init=False, repr=False)  # masque par position globale (faux pour les lignes retirées)
+    category: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.terms is None:
+            self.terms = self.vectorizer.get_feature_names_out()
+        if self.encoder is None:
+            self.encoder = QueryEncoder(self.vectorizer)
+        if self.shards is None:
+            self.shards = build_shards(self.X, 1)
+        if self.upper is None:
+            self.upper = np.max([term_upper_bounds(s.Xt) for s in self.shards], axis=0)
+        if self.base_available is None:
+            self.base_available = np.ones(self.ids.size, dtype=bool)
+        if self.base_category is None:
+            self.base_category = np.full(self.ids.size, -1, dtype=np.int32)
+        if self.delta is None or self.delta.changes == 0:
+            self.all_ids, self.dead = self.ids, EMPTY_POS
+            self.available, self.category = self.base_available, self.base_category
+            return
+        self.all_ids = np.concatenate([self.ids, self.delta.ids])
+        self.dead = np.flatnonzero(np.isin(self.ids, self.delta.tombstones))
+        self.available = np.concatenate([self.base_available, np.zeros(self.delta.ids.size, dtype=bool)])
+        self.category = np.concatenate([self.base_category, np.full(self.delta.ids.size, -1, dtype=np.int32)])
+        self.available[self.dead] = False
+        pos = self.positions_of(self.delta.col_ids)
+        hit = pos >= 0
+        self.available[pos[hit]] = self.delta.col_available[hit]
+        self.category[pos[hit]] = self.delta.col_category[hit]
+
+    @property
+    def size(self) -> int:
+        return int(self.all_ids.size)
+
+    @cached_property
+    def _id_lookup(self) -> tuple[np.ndarray, np.ndarray]:
+        """(ids vivants triés, positions globales correspondantes), calculé une fois par état de l'index."""
+        live = np.setdiff1d(np.arange(self.size, dtype=np.int64), self.dead)
+        order = np.argsort(self.all_ids[live], kind="stable")
+        return self.all_ids[live][order], live[order]
+
+    def positions_of(self, product_ids: Any) -> np.ndarray:
+        """Positions globales des lignes courantes des produits (-1 si absent ou retiré)."""
+        ids, pos = self._id_lookup
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if ids.size == 0:
+            return np.full(product_ids.shape, -1, dtype=np.int64)
+        at = np.minimum(np.searchsorted(ids, product_ids), ids.size - 1)
+        return np.where(ids[at] == product_ids, pos[at], -1)
+
+    def position(self, product_id: int) -> int | None:
+        """Position globale de la ligne courante du produit (la ligne delta prime sur la base)."""
+        pos = int(self.positions_of([product_id])[0])
+        return None if pos < 0 else pos
+
+    def row(self, pos: int) -> Any:
+        if pos < self.ids.size:
+            return self.X[pos]
+        return self.delta.X[pos - self.ids.size]
+
+    def rows(self, positions: list[int]) -> Any:
+        return vstack([self.row(int(p)) for p in positions]).tocsr()
+
+    def _segments(self) -> list[Shard]:
+        """Shards de la base, puis le delta comme shard supplémentaire (positions après la base)."""
+        if self.delta is None or not self.delta.ids.size:
+            return self.shards
+        return [*self.shards, Shard(self.ids.size, self.size, self.delta.Xt)]
+
+    def candidates_many(self, Q: Any) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Documents touchés par chaque ligne de ``Q``, via un seul produit matriciel sparse par segment."""
+        segments = self._segments()
+        # requêtes dans la précision de l'index: scipy convertirait sinon les postings float32 en float64
+        Q = Q.astype(self.X.dtype, copy=False)
+        products = scatter(lambda s: (Q @ s.Xt).tocsr(), segments)
+        out = []
+        for r in range(Q.shape[0]):
+            pos = np.concatenate([S.indices[S.indptr[r] : S.indptr[r + 1]].astype(np.int64) + s.start for s, S in zip(segments, products, strict=True)])
+            sc = np.concatenate([S.data[S.indptr[r] : S.indptr[r + 1]] for S in products])
+            if self.dead.size:
+                keep = ~np.isin(pos, self.dead)
+                pos, sc = pos[keep], sc[keep]
+            out.append((pos, sc))
+        return out
+
+    def candidates(self, qv: Any, k: int, engine: str = "exact") -> tuple[np.ndarray, np.ndarray]:
+        """Candidats contenant le top-k de ``qv`` (positions globales, lignes retirées exclues)."""
+        qv = qv.tocsr()
+        parts = scatter(lambda s: shard_candidates(s, qv, k, engine if s.start < self.ids.size else "exact", self.upper, self.dead), self._segments())
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p for p, _ in parts]), np.concatenate([s for _, s in parts])
+
+
+def _doc_text(name: str, description: str | None, category_name: str | None) -> str:
+    return normalize(" ".join([name, description or "", category_name or ""]))
 
 
 def _product_doc(p: Product) -> str:
-    parts = [p.name, p.description or "", getattr(p.category, "name", "")]
-    return normalize(" ".join(parts))
+    return _doc_text(p.name, p.description, getattr(p.category, "name", ""))
 
 
-def _build_corpus() -> tuple[list[int], list[str]]:
-    qs = Product.objects.all().select_related("category").only("id", "name", "description", "category__name")
-    ids, docs = [], []
+def _columns(p: Product) -> tuple[bool, int]:
+    return bool(p.is_active and p.stock > 0), p.category_id if p.category_id is not None else -1
+
+
+def _build_corpus() -> tuple[list[int], list[str], list[tuple[bool, int]]]:
+    qs = Product.objects.all().select_related("category").only("id", "name", "description", "is_active", "stock", "category__name")
+    ids, docs, cols = [], [], []
     for p in qs:
         ids.append(p.id)
         docs.append(_product_doc(p))
-    return ids, docs
-
-
-def build_index(version: str | None = None) -> ProductIndex:
-    ids, docs = _build_corpus()
+        cols.append(_columns(p))
+    return ids, docs, cols
+
+
+# champs lus par la construction en flux (tuples, sans instancier de modèles)
+STREAM_FIELDS = ("id", "name", "description", "category__name", "is_active", "stock", "category_id")
+
+
+def _product_rows(chunk: int) -> Iterator[list[tuple[Any, ...]]]:
+    """Blocs de ``chunk`` tuples lus par curseur serveur: jamais plus d'un bloc de lignes en mémoire."""
+    return batched(Product.objects.order_by("id").values_list(*STREAM_FIELDS).iterator(chunk_size=chunk), chunk)
+
+
+def _row_docs(rows: list[tuple[Any, ...]]) -> list[str]:
+    return [_doc_text(name, desc, cat) for _, name, desc, cat, *_ in rows]
+
+
+def build_index(
+    version: str | None = None, engine: str | None = None, streaming: bool | None = None, chunk: int | None = None, shards: int | None = None, precision: str | None = None
+) -> ProductIndex:
+    """Construit, sauvegarde et publie l'index produits."""
+    engine = engine or settings.ML_PRODUCT_SEARCH_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"unknown search engine: {engine}")
+    shards = shards or settings.ML_PRODUCT_INDEX_SHARDS
+    precision = check_precision(precision or settings.ML_INDEX_PRECISION)
+    if settings.ML_INDEX_BUILD_STREAMING if streaming is None else streaming:
+        idx = _build_streaming(version, engine, chunk or settings.ML_INDEX_BUILD_CHUNK, shards, precision)
+        if idx is not None:
+            return idx
+    ids, docs, cols = _build_corpus()
+    idx, quality = index_from_corpus(ids, docs, cols, version=version, engine=engine, shards=shards, precision=precision)
+    # construite sans verrou: seuls la publication et le rejeu des écritures concurrentes le prennent
+    with artifact_lock(INDEX_NAME):
+        pending = _pending_changes()
+        save_index(idx, build={"mode": "memory", "peak_rss_bytes": peak_rss_bytes()}, precision=quality)
+        _holder.publish(idx)
+        _replay(pending)
+    return _holder.current or idx
+
+
+def index_from_corpus(
+    ids: list[int], docs: list[str], cols: list[tuple[bool, int]], version: str | None = None, engine: str = "exact", shards: int = 1, precision: str = "float64"
+) -> tuple[ProductIndex, dict[str, Any]]:
+    """Index en mémoire d'un corpus déjà lu: (index, bloc "precision" du manifest)."""
     n_docs = len(docs)
     vec = TfidfVectorizer(ngram_range=(1, 2), max_df=(1.0 if n_docs < 2 else 0.9), min_df=1, stop_words=None)
     if n_docs == 0:
         vec.fit(["vide"])
-        from scipy.sparse import csr_matrix
-
         X = csr_matrix((0, len(vec.vocabulary_)))
         ids_arr = np.array([], dtype=int)
     else:
-        X = vec.fit_transform(docs)
+        X = l2_rows(vec.fit_transform(docs))
         ids_arr = np.array(ids)
-    idx = ProductIndex(version=version or str(len(ids)), ids=ids_arr, X=X, vectorizer=vec)
-    save_index(idx)
-    return idx
+    compact = compact_csr(X, precision)
+    quality = _precision_quality(X, compact, precision)
+    idx = ProductIndex(
+        version=version or str(len(ids)),
+        ids=ids_arr,
+        X=compact,
+        vectorizer=vec,
+        shards=build_shards(compact, shards),
+        engine=engine,
+        precision=precision,
+        base_available=np.array([a for a, _ in cols], dtype=bool),
+        base_category=np.array([c for _, c in cols], dtype=np.int32),
+    )
+    return idx, quality
 
 
-def save_index(idx: ProductIndex) -> None:
-    artifacts = artifacts_dir()
-    blob = {
-        "version": idx.version,
-        "ids": idx.ids,
-        "X": idx.X,
-        "vectorizer": idx.vectorizer,
+def _precision_quality(X: Any, compact: Any, precision: str) -> dict[str, Any]:
+    """Bloc "precision" du manifest: précision retenue et, hors float64, accord des top-k contre ``X`` (float64)."""
+    if precision == "float64" or X.shape[0] == 0:
+        return {"dtype": precision}
+    return {"dtype": precision, "measured_rows": int(X.shape[0]), **precision_agreement(X, compact, settings.ML_INDEX_PRECISION_SAMPLE)}
+
+
+def _build_streaming(version: str | None, engine: str, chunk: int, shards: int, precision: str = "float64") -> ProductIndex | None:
+    """Construction hors mémoire (voir ``ml.streaming``); None pour un catalogue vide."""
+    t0 = time.monotonic()
+    counter = VocabularyCounter(settings.ML_INDEX_BUILD_MAX_TERMS)
+    for rows in _product_rows(chunk):
+        counter.add(_row_docs(rows))
+    n_docs = counter.n_docs
+    if n_docs == 0:
+        return None
+    terms = sorted(counter.df)
+    pruned = counter.pruned
+    if pruned:
+        # comptes approximatifs après élagage: recomptage exact des termes survivants
+        df = exact_df(terms, (_row_docs(rows) for rows in _product_rows(chunk)))
+    else:
+        df = np.array([counter.df[t] for t in terms], dtype=np.int64)
+    del counter
+    # mêmes bornes que le build en mémoire (max_df=0.9, ou 1.0 sous 2 documents)
+    keep = (df >= 1) & (df <= (n_docs if n_docs < 2 else 0.9 * n_docs))
+    terms = [t for t, k in zip(terms, keep, strict=True) if k]
+    if not terms:
+        raise ValueError("After pruning, no terms remain")
+    vec = vectorizer_from(terms, smooth_idf(df[keep], n_docs))
+    dim = len(terms)
+
+    release, path = new_release(INDEX_DIR)
+    work = reset_dir(path / "_build")
+    blocks = ShardWriter(work)
+    for rows in _product_rows(chunk):
+        blocks.write(
+            l2_rows(vec.transform(_row_docs(rows))),
+            ids=np.array([r[0] for r in rows], dtype=np.int64),
+            available=np.array([bool(r[4] and r[5] > 0) for r in rows], dtype=bool),
+            category=np.array([-1 if r[6] is None else r[6] for r in rows], dtype=np.int32),
+        )
+    version = version or str(blocks.rows)
+    # accord mesuré sur le premier bloc: la matrice float64 complète n'existe jamais en mémoire
+    first = blocks.shards[0]
+    sample = csr_matrix(tuple(np.asarray(blocks.load(first, n)) for n in ("data", "indices", "indptr")), shape=(first["rows"], dim))
+    quality = _precision_quality(sample, compact_csr(sample, precision), precision)
+    assemble_csr(blocks, dim, path, precision=precision)
+    # shards d'index alignés sur les blocs écrits: chaque shard transpose ses propres blocs
+    groups = [g for g in np.array_split(np.arange(len(blocks.shards)), max(1, shards)) if g.size]
+    bounds, upper, names = [], np.zeros(dim, dtype=np.float64), ["X_data", "X_indices", "X_indptr"]
+    for i, group in enumerate(groups):
+        parts = [blocks.shards[b] for b in group]
+        prefix = postings_prefix(i, len(groups))
+        start = bounds[-1][1] if bounds else 0
+        bounds.append((start, start + sum(b["rows"] for b in parts)))
+        transpose_csr(blocks, dim, path, prefix=prefix, parts=parts, precision=precision)
+        shard_names = [f"{prefix}_data", f"{prefix}_indices", f"{prefix}_indptr"]
+        Xt = csr_from_arrays({n: np.load(path / f"{n}.npy", mmap_mode="r") for n in shard_names}, bounds[-1][1] - start, prefix=prefix)
+        np.maximum(upper, term_upper_bounds(Xt), out=upper)
+        names += shard_names
+    for name, dtype in (("ids", np.int64), ("available", bool), ("category", np.int32)):
+        concat_column(blocks, name, path, dtype)
+    np.save(path / "term_max.npy", upper, allow_pickle=False)
+    np.save(path / "idf.npy", vec.idf_, allow_pickle=False)
+    names += ["ids", "idf", "term_max", "available", "category"]
+    build = {
+        "mode": "streaming",
+        "chunk": chunk,
+        "blocks": len(blocks.shards),
+        "pruned_terms": int(pruned),
+        "duration_ms": int((time.monotonic() - t0) * 1000),
+        "peak_rss_bytes": peak_rss_bytes(),
     }
-    with (artifacts / PICKLE_FILE).open("wb") as f:
-        pickle.dump(blob, f)
-    write_manifest(
-        INDEX_NAME,
+    shutil.rmtree(work, ignore_errors=True)
+    with artifact_lock(INDEX_NAME):
+        pending = _pending_changes()
+        _write_index_manifest(release, version, blocks.rows, dim, arrays_spec(path, names), save_vocabulary(path, vec), engine, build, bounds, quality)
+        idx = load_index()
+        _holder.publish(idx)
+        _replay(pending)
+    logger.info("PRODUCT_INDEX_STREAMED version=%s count=%s dim=%s shards=%s peak_rss_bytes=%s", version, blocks.rows, dim, len(bounds), build["peak_rss_bytes"])
+    return idx
+
+
+def save_index(idx: ProductIndex, build: dict[str, Any] | None = None, precision: dict[str, Any] | None = None) -> None:
+    """Écrit et publie une release de la base; ``precision``: bloc du manifest (défaut: la seule précision de ``idx``)."""
+    release, path = new_release(INDEX_DIR)
+    arrays = save_arrays(
+        path,
         {
-            "version": idx.version,
-            "count": int(idx.ids.size),
-            "dim": int(idx.X.shape[1]),
-            "file": PICKLE_FILE,
-            "vectorizer": "tfidf(1,2)-fr",
+            **csr_arrays(idx.X, precision=idx.precision),
+            **{k: v for i, s in enumerate(idx.shards) for k, v in csr_arrays(s.Xt, prefix=postings_prefix(i, len(idx.shards)), precision=idx.precision).items()},
+            "ids": idx.ids.astype(np.int64),
+            "idf": idx.vectorizer.idf_,
+            "term_max": idx.upper,
+            "available": idx.base_available,
+            "category": idx.base_category,
         },
     )
-    logger.info("PRODUCT_INDEX_SAVED version=%s count=%s dim=%s", idx.version, idx.ids.size, idx.X.shape[1])
-
-
-def load_index() -> ProductIndex | None:
-    artifacts = artifacts_dir()
-    p = artifacts / PICKLE_FILE
-    if not p.exists():
+    vocab = save_vocabulary(path, idx.vectorizer)
+    bounds = [(s.start, s.stop) for s in idx.shards]
+    quality = precision or {"dtype": idx.precision}
+    idx.built_at = _write_index_manifest(release, idx.version, int(idx.ids.size), int(idx.X.shape[1]), arrays, vocab, idx.engine, build, bounds, quality)
+    logger.info("PRODUCT_INDEX_SAVED version=%s count=%s dim=%s shards=%s", idx.version, idx.ids.size, idx.X.shape[1], len(bounds))
+
+
+def _write_index_manifest(
+    release: str,
+    version: str,
+    count: int,
+    dim: int,
+    arrays: dict[str, Any],
+    vocab: dict[str, Any],
+    engine: str,
+    build: dict[str, Any] | None,
+    shards: list[tuple[int, int]],
+    precision: dict[str, Any],
+) -> str:
+    """Publie la release de la base (sous le verrou de build) et retourne l'horodatage de son manifest."""
+    manifest = {
+        "version": version,
+        "count": count,
+        "dim": dim,
+        "format": FORMAT,
+        "dir": release,
+        "arrays": arrays,
+        "vocabulary": vocab,
+        "vectorizer": "tfidf(1,2)-fr",
+        "engine": engine,
+        "shards": [list(b) for b in shards],
+        "precision": precision,
+    }
+    if build:
+        manifest["build"] = build
+    with artifact_lock(INDEX_NAME):
+        # une nouvelle base absorbe toutes les mises à jour incrémentales
+        clear_delta(version, dim)
+        return releases.publish(INDEX_NAME, manifest)["timestamp"]
+
+
+def load_index(verify: bool = False, manifest: dict[str, Any] | None = None) -> ProductIndex | None:
+    """Base publiée, ou celle décrite par ``manifest`` (ex: une release conservée, voir ``load_release``)."""
+    manifest = manifest or read_manifest(INDEX_NAME)
+    if not manifest or manifest.get("format") != FORMAT:
+        return None
+    path = artifacts_dir() / manifest["dir"]
+    if not path.exists():
         return None
-    with p.open("rb") as f:
-        blob = pickle.load(f)
+    arrays = load_arrays(path, manifest["arrays"], verify=verify)
+    # une seule liste de termes: partagée par le vocabulaire du vectorizer et le vocabulaire inverse
+    terms = load_vocabulary(path, manifest["vocabulary"])
+    # index antérieurs au partitionnement: un seul shard, postings sous le préfixe historique "Xt"
+    bounds = manifest.get("shards") or shard_bounds(manifest["count"], 1)
+    shards = [Shard(a, b, csr_from_arrays(arrays, b - a, prefix=postings_prefix(i, len(bounds)))) for i, (a, b) in enumerate(bounds)]
     return ProductIndex(
-        version=read_manifest(INDEX_NAME)["version"] if read_manifest(INDEX_NAME) else "0",
-        ids=blob["ids"],
-        X=blob["X"],
-        vectorizer=blob["vectorizer"],
+        version=manifest["version"],
+        ids=arrays["ids"],
+        X=csr_from_arrays(arrays, manifest["dim"]),
+        vectorizer=vectorizer_from(terms, arrays["idf"]),
+        terms=np.array(terms, dtype=object),
+        shards=shards,
+        upper=arrays["term_max"],
+        engine=manifest.get("engine", "exact"),
+        precision=manifest.get("precision", {}).get("dtype", "float64"),
+        built_at=manifest["timestamp"],
+        # index antérieurs aux colonnes: tout disponible, sans catégorie, jusqu'à la prochaine réconciliation
+        base_available=arrays.get("available"),
+        base_category=arrays.get("category"),
     )
 
 
+def load_release(release: str) -> ProductIndex:
+    """Base d'une release conservée (identifiant, chemin relatif ou "previous"), sans delta ni publication."""
+    idx = load_index(manifest=releases.release_manifest(INDEX_NAME, release))
+    if idx is None:
+        raise ValueError(f"unreadable release for {INDEX_NAME}: {release}")
+    return idx
+
+
 def load_or_build() -> ProductIndex:
     idx = load_index()
     if idx is None:
@@ -105,60 +441,138 @@ def load_or_build() -> ProductIndex:
     return idx
 
 
-def _top_terms(vec, vocab, topk=5) -> list[str]:
-    arr = vec.toarray().ravel()
-    if arr.size == 0:
-        return []
-    nz = arr.nonzero()[0]
-    pairs = sorted(((arr[i], i) for i in nz), reverse=True)[:topk]
-    inv_vocab = {v: k for k, v in vocab.items()}
-    return [inv_vocab[i] for _, i in pairs if i in inv_vocab]
+def _load_resident(previous: ProductIndex | None) -> ProductIndex:
+    """Recharge la base seulement si elle a changé; sinon ne relit que le segment delta."""
+    manifest = read_manifest(INDEX_NAME)
+    if previous is not None and manifest and previous.built_at == manifest.get("timestamp"):
+        base = previous
+    else:
+        base = load_or_build()
+    return replace(base, delta=load_delta(base.version, int(base.X.shape[1])))
 
 
-def search(q: str, k: int = 10) -> list[dict[str, Any]]:
-    idx = load_or_build()
-    if idx.ids.size == 0:
+def _resident_bytes(idx: ProductIndex) -> int:
+    size = sparse_nbytes(idx.X) + sum(sparse_nbytes(s.Xt) for s in idx.shards) + int(idx.ids.nbytes) + int(idx.upper.nbytes) + vocabulary_nbytes(idx.vectorizer.vocabulary_)
+    size += int(idx.terms.nbytes)
+    size += int(idx.available.nbytes + idx.category.nbytes)
+    if idx.delta is not None:
+        size += sparse_nbytes(idx.delta.X) + sparse_nbytes(idx.delta.Xt) + int(idx.all_ids.nbytes)
+    return size
+
+
+def _prewarm(idx: ProductIndex) -> None:
+    """Charge les pages de la nouvelle version et ses tables dérivées avant qu'elle ne serve des requêtes."""
+    touch_pages(idx.X.data, idx.X.indices, idx.X.indptr, idx.ids, idx.upper, idx.available, idx.category)
+    for shard in idx.shards:
+        touch_pages(shard.Xt.data, shard.Xt.indices, shard.Xt.indptr)
+    idx._id_lookup  # noqa: B018
+
+
+_holder: IndexHolder[ProductIndex] = IndexHolder(INDEX_NAME, _load_resident, _resident_bytes, watch=(DELTA_NAME,), background=settings.ML_INDEX_BACKGROUND_RELOAD, prewarm=_prewarm)
+
+
+def get_index() -> ProductIndex:
+    return _holder.get()
+
+
+def index_stats() -> dict[str, Any]:
+    idx = _holder.current
+    return {**_holder.stats(), "query_vectors": idx.encoder.stats() if idx is not None else None}
+
+
+def _top_terms(vec: Any, terms: np.ndarray, topk: int = 5) -> list[str]:
+    """Termes de plus fort poids d'une ligne sparse."""
+    row = vec.tocsr()
+    keep = row.data != 0
+    data, indices = row.data[keep], row.indices[keep]
+    order = np.lexsort((-indices, -data))[:topk]
+    return terms[indices[order]].tolist()
+
+
+def _dense_table(idx: ProductIndex, dense: bool | None, default: bool) -> dense_index.DenseIndex | None:
+    """Table dense à utiliser (choix de la requête, sinon réglage); None si non demandée ou pas à jour pour ``idx``."""
+    if not (default if dense is None else dense):
+        return None
+    table = dense_index.get_table()
+    return table if table.current_for(idx) else None
+
+
+def search(q: str, k: int = 10, engine: str | None = None, dense: bool | None = None, nprobe: int | None = None, idx: ProductIndex | None = None) -> list[dict[str, Any]]:
+    """Top-k produits pour ``q``; ``dense`` cherche dans l'espace LSA si la table est à jour."""
+    return search_in(idx or get_index(), q, k, engine, dense, nprobe)
+
+
+def search_in(idx: ProductIndex, q: str, k: int = 10, engine: str | None = None, dense: bool | None = None, nprobe: int | None = None) -> list[dict[str, Any]]:
+    """``search`` sur un index donné (ex: une release chargée par ``load_release``)."""
+    if idx.size == 0:
         return []
-    qn = normalize(q)
-    qv = idx.vectorizer.transform([qn])
-    sims = cosine_similarity(qv, idx.X).ravel()
-    order = np.argsort(-sims)[: max(k, 1)]
-    ids = idx.ids[order]
-    results = []
-    for pid, s in zip(ids, sims[order], strict=False):
-        results.append({"product_id": int(pid), "score": float(s), "reason": f"Correspondance sur caractéristiques: {', '.join(_top_terms(qv, idx.vectorizer.vocabulary_))}"})
-    return results
-
-
-def recommend(product_id: int, k: int = 10, exclude_self: bool = True, ensure_diversity: bool = True) -> list[dict[str, Any]]:
-    idx = load_or_build()
-    if idx.ids.size == 0:
+    qv = idx.encoder.transform(normalize(q))
+    k = max(k, 1)
+    table = _dense_table(idx, dense, settings.ML_SEARCH_DENSE)
+    if table is not None:
+        order, scores = rank(*dense_index.search_vectors(idx, table, table.project(qv)[0], k, nprobe), k, idx.size, skip=idx.dead)
+    else:
+        order, scores = rank(*idx.candidates(qv, k, engine or idx.engine), k, idx.size, skip=idx.dead)
+    return _search_hits(idx, qv, order, scores)
+
+
+def search_many(queries: list[tuple[str, int]], idx: ProductIndex | None = None) -> list[list[dict[str, Any]]]:
+    """Recherche par lot: une seule vectorisation et un seul produit matriciel pour toutes les requêtes."""
+    idx = idx or get_index()
+    if idx.size == 0 or not queries:
+        return [[] for _ in queries]
+    Q = idx.encoder.transform_many([normalize(q) for q, _ in queries])
+    out = []
+    for r, ((_, k), (pos, sc)) in enumerate(zip(queries, idx.candidates_many(Q), strict=True)):
+        order, scores = rank(pos, sc, max(k, 1), idx.size, skip=idx.dead)
+        out.append(_search_hits(idx, Q[r], order, scores))
+    return out
+
+
+def _search_hits(idx: ProductIndex, qv: Any, order: np.ndarray, scores: np.ndarray) -> list[dict[str, Any]]:
+    reason = f"Correspondance sur caractéristiques: {', '.join(_top_terms(qv, idx.terms))}"
+    return [{"product_id": int(pid), "score": float(s), "reason": reason} for pid, s in zip(idx.all_ids[order], scores, strict=False)]
+
+
+def recommend(
+    product_id: int,
+    k: int = 10,
+    exclude_self: bool = True,
+    ensure_diversity: bool = True,
+    dense: bool | None = None,
+    nprobe: int | None = None,
+    idx: ProductIndex | None = None,
+) -> list[dict[str, Any]]:
+    """Produits similaires; ``dense`` (défaut: ML_RECO_DENSE) tire le pool de candidats de l'index ANN LSA."""
+    idx = idx or get_index()
+    if idx.size == 0:
         return []
-    try:
-        pos = int(np.where(idx.ids == product_id)[0][0])
-    except IndexError:
+    pos = idx.position(product_id)
+    if pos is None:
         return []
-    pv = idx.X[pos]
-    sims = cosine_similarity(pv, idx.X).ravel()
-    # Exclure soi-même
-    if exclude_self:
-        sims[pos] = -1.0
-    order = np.argsort(-sims)
-    # Filtrage: actifs, stock > 0
-    candidates = []
-    qs = Product.objects.filter(id__in=list(idx.ids)).select_related("category").only("id", "is_active", "stock", "category__name", "name", "description")
-    flags = {p.id: (p.is_active and p.stock > 0) for p in qs}
-    cats = {p.id: getattr(p.category, "name", "") for p in qs}
-    for i in order:
-        pid = int(idx.ids[i])
-        if not flags.get(pid, True):
-            continue
-        candidates.append((pid, float(sims[i])))
+    pv = idx.row(pos)
+    table = _dense_table(idx, dense, settings.ML_RECO_DENSE)
+    # Pool de candidats borné (soi-même relégué en dernier si exclu), élargi si le filtrage en écarte trop
+    pool = max(RECO_POOL_FACTOR * k, 32)
+    while True:
+        if table is not None:
+            order, sims = _dense_pool(idx, table, pos, pool, nprobe, exclude_self)
+        elif exclude_self:
+            order, sims = _neighbor_pool(idx, product_id, pos, pv, pool)
+        else:
+            order, sims = rank(*idx.candidates(pv, idx.size), pool, idx.size, skip=idx.dead)
+        # Filtrage (actifs, stock > 0) par masque sur les colonnes de l'index: aucune requête en base
+        ok = idx.available[order]
+        order, sims = order[ok], sims[ok]
+        if order.size >= RECO_POOL_FACTOR * k or pool >= idx.size:
+            break
+        pool *= RECO_POOL_FACTOR
+    candidates = list(zip(idx.all_ids[order].tolist(), sims.tolist(), strict=True))
+    cats = idx.category[order].tolist()
     # Diversité minimale (catégories différentes si possible)
     if ensure_diversity and candidates:
         selected, seen = [], set()
-        for pid, sc in candidates:
-            c = cats.get(pid, "")
+        for (pid, sc), c in zip(candidates, cats, strict=True):
             if c not in seen or len(selected) < max(2, k // 2):
                 selected.append((pid, sc))
                 seen.add(c)
@@ -169,49 +583,271 @@ def recommend(product_id: int, k: int = 10, exclude_self: bool = True, ensure_di
     else:
         selected = candidates[:k]
     # Raisons: termes proches du produit source
-    vocab = idx.vectorizer.vocabulary_
-    reasons = ", ".join(_top_terms(pv, vocab))
+    reasons = ", ".join(_top_terms(pv, idx.terms))
     return [{"product_id": pid, "score": sc, "reason": f"Produits similaires (caractéristiques communes: {reasons})"} for pid, sc in selected]
 
 
-def recommend_mmr(product_id: int, k: int = 10, mmr_lambda: float = 0.7) -> list[dict[str, Any]]:
-    """Maximal Marginal Relevance pour diversifier les recommandations.
-
-    mmr_lambda proche de 1 privilégie la similarité à la requête; proche de 0 privilégie la diversité.
-    """
-    idx = load_or_build()
-    if idx.ids.size == 0:
+def _dense_pool(idx: ProductIndex, table: dense_index.DenseIndex, pos: int, size: int, nprobe: int | None, exclude_self: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    """Top-``size`` voisins LSA approchés (soi-même relégué en dernier si exclu, comme le pool exact)."""
+    exclude = pos if exclude_self else None
+    return rank(*dense_index.search_vectors(idx, table, dense_index.row_vector(idx, table, pos), size, nprobe, exclude=exclude), size, idx.size, exclude=exclude, skip=idx.dead)
+
+
+def _neighbor_pool(idx: ProductIndex, product_id: int, pos: int, pv: Any, size: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top-``size`` (positions, similarités) hors soi-même: table de voisins si à jour et assez large, sinon calcul à la volée."""
+    table = neighbors.get_table()
+    stored = table.lookup(product_id) if table.current_for(idx) else None
+    if stored is not None and stored[0].size >= size:
+        pos, sims = idx.positions_of(stored[0][:size]), stored[1][:size]
+        # voisin sans ligne dans l'index: écarté plutôt que lu en position -1
+        keep = pos >= 0
+        return pos[keep], sims[keep]
+    return rank(*idx.candidates(pv, idx.size), size, idx.size, exclude=pos, skip=idx.dead)
+
+
+def recommend_mmr(
+    product_id: int,
+    k: int = 10,
+    mmr_lambda: float | None = None,
+    category_weight: float | None = None,
+    pool: int | None = None,
+    dense: bool | None = None,
+    nprobe: int | None = None,
+    idx: ProductIndex | None = None,
+) -> list[dict[str, Any]]:
+    """Maximal Marginal Relevance pour diversifier les recommandations."""
+    mmr_lambda = settings.ML_RECO_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    category_weight = settings.ML_RECO_MMR_CATEGORY_WEIGHT if category_weight is None else category_weight
+    idx = idx or get_index()
+    if idx.size == 0:
         return []
-    try:
-        pos = int(np.where(idx.ids == product_id)[0][0])
-    except IndexError:
+    pos = idx.position(product_id)
+    if pos is None:
         return []
-    pv = idx.X[pos]
-    sims_to_q = cosine_similarity(pv, idx.X).ravel()
-    sims_to_q[pos] = -1.0  # exclure soi-même
-
-    candidates = np.argsort(-sims_to_q).tolist()
-    selected: list[int] = []
-    selected_scores: list[float] = []
-
-    while len(selected) < k and candidates:
-        best_i, best_score = None, -1e9
-        for i in candidates:
-            if selected:
-                sims_to_sel = cosine_similarity(idx.X[i], idx.X[selected]).ravel()
-                redundancy = float(np.max(sims_to_sel))
-            else:
-                redundancy = 0.0
-            score = mmr_lambda * float(sims_to_q[i]) - (1.0 - mmr_lambda) * redundancy
-            if score > best_score:
-                best_i, best_score = i, score
-        selected.append(best_i)
-        selected_scores.append(float(sims_to_q[best_i]))
-        candidates.remove(best_i)
-
-    vocab = idx.vectorizer.vocabulary_
-    reasons = ", ".join(_top_terms(pv, vocab))
-    return [{"product_id": int(idx.ids[i]), "score": sc, "reason": f"Diversification MMR (caractéristiques: {reasons})"} for i, sc in zip(selected, selected_scores, strict=False)]
-
-
-# (supprimé doublon)
+    pv = idx.row(pos)
+    size = max(pool or settings.ML_RECO_MMR_POOL, k)
+    table = _dense_table(idx, dense, settings.ML_RECO_DENSE)
+    order, relevance = _dense_pool(idx, table, pos, size, nprobe) if table is not None else _neighbor_pool(idx, product_id, pos, pv, size)
+    ok = idx.available[order]
+    order, relevance = order[ok], relevance[ok]
+    if order.size == 0:
+        return []
+    pool_ids = idx.all_ids[order]
+    picks = mmr_select(relevance, similarity_block(idx.rows(order.tolist()), idx.category[order], category_weight), k, mmr_lambda)
+
+    reasons = ", ".join(_top_terms(pv, idx.terms))
+    return [{"product_id": int(pool_ids[i]), "score": float(relevance[i]), "reason": f"Diversification MMR (caractéristiques: {reasons})"} for i in picks]
+
+
+def apply_product_changes(product_ids: Iterable[int]) -> DeltaSegment | None:
+    """Répercute l'état courant des produits donnés dans le segment delta."""
+    wanted = {int(i) for i in product_ids}
+    if not wanted or read_manifest(INDEX_NAME) is None:
+        return None
+    with artifact_lock(INDEX_NAME):
+        idx = _holder.get(fresh=True)
+        delta = idx.delta or DeltaSegment.empty(idx.version, int(idx.X.shape[1]))
+        rows = Product.objects.filter(id__in=wanted).select_related("category").only("id", "name", "description", "is_active", "stock", "category__name")
+        live = {p.id: p for p in rows if p.is_active}
+        live_ids = sorted(live)
+        vecs = compact_csr(l2_rows(idx.vectorizer.transform([_product_doc(live[i]) for i in live_ids])) if live_ids else csr_matrix((0, idx.X.shape[1])), idx.precision)
+        # produit inchangé déjà présent dans la base: rien à écrire
+        changed = np.flatnonzero(~_same_as_base(idx, live_ids, vecs)).tolist()
+        touched = np.array(sorted(wanted - set(live_ids) | {live_ids[r] for r in changed}), dtype=np.int64)
+        # colonnes: toute nouvelle ligne, et toute ligne dont la disponibilité ou la catégorie a changé
+        new_row_ids = set(touched.tolist())
+        col_ids = [pid for pid in live_ids if pid in new_row_ids or _columns(live[pid]) != _columns_at(idx, pid)]
+        if touched.size == 0 and not col_ids:
+            return delta
+        keep = ~np.isin(delta.ids, touched)
+        # surcharges remplacées (nouvelle entrée) ou sans objet (produit retiré); les autres restent à jour
+        keep_cols = ~np.isin(delta.col_ids, sorted(set(col_ids) | (wanted - set(live_ids))))
+        new_rows = np.array([live_ids[r] for r in changed], dtype=np.int64)
+        updated = DeltaSegment(
+            base_version=idx.version,
+            seq=delta.seq + 1,
+            ids=np.concatenate([delta.ids[keep], new_rows]),
+            X=compact_csr(vstack([delta.X[np.flatnonzero(keep)], vecs[changed]]), idx.precision),
+            tombstones=np.union1d(delta.tombstones, touched[np.isin(touched, idx.ids)]),
+            col_ids=np.concatenate([delta.col_ids[keep_cols], np.array(col_ids, dtype=np.int64)]),
+            col_available=np.concatenate([delta.col_available[keep_cols], np.array([_columns(live[i])[0] for i in col_ids], dtype=bool)]),
+            col_category=np.concatenate([delta.col_category[keep_cols], np.array([_columns(live[i])[1] for i in col_ids], dtype=np.int32)]),
+        )
+        save_delta(updated)
+        current = replace(idx, delta=updated)
+        _holder.publish(current)
+        # la table de voisins suit le delta: seules les lignes touchées sont recalculées
+        neighbors.refresh_neighbors(current, touched, since_seq=delta.seq)
+        table = dense_index.get_table()
+        if table.current_for(current):
+            table.delta_embeddings(updated)
+    logger.info("PRODUCT_INDEX_DELTA seq=%s rows=%s tombstones=%s columns=%s", updated.seq, updated.ids.size, updated.tombstones.size, updated.col_ids.size)
+    if _needs_compaction(idx.ids.size, updated):
+        schedule_compaction()
+    return updated
+
+
+def _columns_at(idx: ProductIndex, product_id: int) -> tuple[bool, int] | None:
+    pos = idx.position(product_id)
+    return None if pos is None else (bool(idx.available[pos]), int(idx.category[pos]))
+
+
+def _same_as_base(idx: ProductIndex, product_ids: list[int], vecs: Any) -> np.ndarray:
+    """Masque des produits dont la ligne courante est celle de la base, à l'identique de ``vecs``."""
+    same = np.zeros(len(product_ids), dtype=bool)
+    pos = idx.positions_of(product_ids)
+    # ligne delta (position >= base) ou produit retiré (-1): déjà modifié depuis la base
+    rows = np.flatnonzero((pos >= 0) & (pos < idx.ids.size))
+    if rows.size:
+        # comparaison indépendante de l'ordre des indices (fit_transform ne les trie pas)
+        diff = abs(idx.X[pos[rows]] - vecs[rows])
+        same[rows] = diff.max(axis=1).toarray().ravel() <= 1e-12
+    return same
+
+
+def _drift(base_rows: int, delta: DeltaSegment) -> float:
+    return delta.row_changes / max(base_rows, 1)
+
+
+def _refit_drift(idx: ProductIndex) -> float:
+    """Dérive depuis le dernier réapprentissage de l'idf: fusions successives comprises."""
+    merged = (read_manifest(INDEX_NAME) or {}).get("build", {}).get("drift", 0.0)
+    return merged + (_drift(idx.ids.size, idx.delta) if idx.delta is not None else 0.0)
+
+
+def _needs_compaction(base_rows: int, delta: DeltaSegment) -> bool:
+    return _drift(base_rows, delta) >= settings.ML_INDEX_REFIT_DRIFT or delta.ids.size + delta.col_ids.size >= settings.ML_INDEX_DELTA_MERGE_ROWS
+
+
+def _pending_changes() -> np.ndarray:
+    """Produits présents dans le delta publié (à appeler sous le verrou de l'index, avant de publier une nouvelle base)."""
+    manifest = read_manifest(INDEX_NAME)
+    delta = load_delta(manifest["version"], manifest["dim"]) if manifest else None
+    if delta is None:
+        return np.array([], dtype=np.int64)
+    return np.union1d(np.union1d(delta.ids, delta.tombstones), delta.col_ids)
+
+
+def _replay(product_ids: np.ndarray) -> None:
+    # écritures arrivées pendant la construction: déjà absorbées par la nouvelle base (rien à écrire) ou rejouées
+    if product_ids.size:
+        apply_product_changes(product_ids.tolist())
+
+
+def compact_index(refit: bool | None = None) -> str:
+    """Fusionne le delta dans une nouvelle base, ou réapprend l'idf si la dérive le demande."""
+    idx = _holder.get(fresh=True)
+    delta = idx.delta
+    if delta is None or delta.changes == 0:
+        return "noop"
+    if refit is None:
+        refit = _refit_drift(idx) >= settings.ML_INDEX_REFIT_DRIFT
+    if refit:
+        build_index(engine=idx.engine, precision=idx.precision)
+        logger.info("PRODUCT_INDEX_COMPACTED action=refit rows=%s tombstones=%s", delta.ids.size, delta.tombstones.size)
+        return "refit"
+    alive = np.setdiff1d(np.arange(idx.ids.size), idx.dead)
+    rows = np.concatenate([alive, np.arange(idx.ids.size, idx.size)])
+    X = compact_csr(vstack([idx.X[alive], delta.X]), idx.precision)
+    merged = ProductIndex(
+        version=f"{idx.version.split('+')[0]}+{delta.seq}",
+        ids=idx.all_ids[rows],
+        X=X,
+        vectorizer=idx.vectorizer,
+        encoder=idx.encoder,
+        shards=build_shards(X, len(idx.shards)),
+        terms=idx.terms,
+        engine=idx.engine,
+        precision=idx.precision,
+        base_available=idx.available[rows],
+        base_category=idx.category[rows],
+    )
+    with artifact_lock(INDEX_NAME):
+        manifest = read_manifest(INDEX_NAME)
+        if manifest.get("timestamp") != idx.built_at:
+            # base remplacée pendant la fusion (autre processus): la fusion est obsolète
+            return "noop"
+        pending = _pending_changes()
+        build = {"mode": "merge", "drift": round(_refit_drift(idx), 6)}
+        # mêmes lignes que la base et le delta: l'accord mesuré au build reste celui de la précision
+        save_index(merged, build=build, precision=manifest.get("precision"))
+        _holder.publish(merged)
+        # même contenu, mêmes voisins: la table reste valable pour la nouvelle base
+        neighbors.rebase_neighbors(idx, merged)
+        dense_index.rebase_dense(idx, merged)
+        _replay(pending)
+    logger.info("PRODUCT_INDEX_COMPACTED action=merge rows=%s tombstones=%s", delta.ids.size, delta.tombstones.size)
+    return "merge"
+
+
+def rollback_index(release: str | None = None) -> dict[str, Any]:
+    """Republie une release conservée de la base (par défaut la précédente) et vide le delta."""
+    with artifact_lock(INDEX_NAME):
+        manifest = releases.rollback(INDEX_NAME, release)
+        clear_delta(manifest["version"], manifest["dim"])
+        idx = _holder.get(fresh=True)
+    logger.info("PRODUCT_INDEX_ROLLED_BACK version=%s dir=%s", idx.version, manifest["dir"])
+    return manifest
+
+
+def reconcile_index(batch: int = 2000) -> int:
+    """Corrige via le delta les écarts entre l'index et la base; retourne le nombre de produits corrigés."""
+    if read_manifest(INDEX_NAME) is None:
+        return 0
+    idx = get_index()
+    drifted, db_ids = [], []
+    rows = Product.objects.order_by("id").values_list("id", "is_active", "stock", "category_id")
+    chunk: list[tuple[int, bool, int, int | None]] = []
+    for row in rows.iterator(chunk_size=batch):
+        chunk.append(row)
+        if len(chunk) >= batch:
+            drifted.extend(_drifted(idx, chunk))
+            db_ids.extend(r[0] for r in chunk)
+            chunk = []
+    if chunk:
+        drifted.extend(_drifted(idx, chunk))
+        db_ids.extend(r[0] for r in chunk)
+    # produits supprimés en base mais encore présents dans l'index
+    drifted.extend(np.setdiff1d(idx._id_lookup[0], np.array(db_ids, dtype=np.int64)).tolist())
+    for s in range(0, len(drifted), batch):
+        apply_product_changes(drifted[s : s + batch])
+    logger.info("PRODUCT_INDEX_RECONCILED products=%s drifted=%s", len(db_ids), len(drifted))
+    return len(drifted)
+
+
+def _drifted(idx: ProductIndex, chunk: list[tuple[int, bool, int, int | None]]) -> list[int]:
+    ids = np.array([r[0] for r in chunk], dtype=np.int64)
+    active = np.array([r[1] for r in chunk], dtype=bool)
+    available = active & (np.array([r[2] for r in chunk]) > 0)
+    category = np.array([-1 if r[3] is None else r[3] for r in chunk], dtype=np.int32)
+    pos = idx.positions_of(ids)
+    present = pos >= 0
+    wrong = np.zeros(ids.size, dtype=bool)
+    wrong[present] = (idx.available[pos[present]] != available[present]) | (idx.category[pos[present]] != category[present])
+    # produit actif absent de l'index (ajout manqué); un produit inactif absent est déjà à jour
+    wrong |= active & ~present
+    return ids[wrong].tolist()
+
+
+_compaction_lock = threading.Lock()
+
+
+def schedule_compaction() -> None:
+    """Lance la fusion du delta hors du chemin de la requête."""
+    if not settings.ML_INDEX_BACKGROUND_COMPACTION:
+        return
+    if not _compaction_lock.acquire(blocking=False):
+        return
+
+    def _run() -> None:
+        try:
+            if _refit_drift(_holder.get()) >= settings.ML_INDEX_REFIT_DRIFT:
+                logger.warning("PRODUCT_INDEX_REFIT_DUE: lancer compact_product_index")
+            compact_index(refit=False)
+        except Exception:
+            logger.exception("PRODUCT_INDEX_COMPACTION_FAILED")
+        finally:
+            connection.close()
+            _compaction_lock.release()
+
+    threading.Thread(target=_run, name="product-index-compaction", daemon=True).start()
@@ -0,0 +1,86 @@
+"""Vectorisation rapide des requêtes, à l'identique de ``TfidfVectorizer.transform``."""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from math import sqrt
+from typing import Any
+
+import numpy as np
+from django.conf import settings
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+class QueryEncoder:
+    def __init__(self, vectorizer: TfidfVectorizer, cache_size: int | None = None) -> None:
+        self.vocabulary: dict[str, int] = vectorizer.vocabulary_
+        self.idf = np.asarray(vectorizer.idf_, dtype=np.float64)
+        self.dim = len(self.vocabulary)
+        self._token = re.compile(vectorizer.token_pattern)
+        self._lowercase = vectorizer.lowercase
+        self._min_n, self._max_n = vectorizer.ngram_range
+        self._cache: OrderedDict[str, csr_matrix] = OrderedDict()
+        self._cache_size = settings.ML_QUERY_VECTOR_CACHE if cache_size is None else cache_size
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def terms(self, text: str) -> tuple[list[int], list[float]]:
+        """(colonnes croissantes, poids TF-IDF normalisés L2) des termes connus de ``text``."""
+        if self._lowercase:
+            text = text.lower()
+        tokens = self._token.findall(text)
+        counts: dict[int, int] = {}
+        vocab = self.vocabulary
+        for n in range(self._min_n, self._max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                col = vocab.get(tokens[i] if n == 1 else " ".join(tokens[i : i + n]))
+                if col is not None:
+                    counts[col] = counts.get(col, 0) + 1
+        cols = sorted(counts)
+        idf = self.idf
+        weights = [float(counts[c]) * float(idf[c]) for c in cols]
+        # somme des carrés séquentielle, comme sklearn.preprocessing.normalize (ordre des colonnes)
+        norm = 0.0
+        for w in weights:
+            norm += w * w
+        if norm != 0.0:
+            norm = sqrt(norm)
+            weights = [w / norm for w in weights]
+        return cols, weights
+
+    def transform(self, text: str) -> csr_matrix:
+        """Vecteur 1×dim de ``text`` (déjà normalisé par ``ml.text.normalize``), via le LRU. Ne pas modifier."""
+        if self._cache_size > 0:
+            with self._lock:
+                hit = self._cache.get(text)
+                if hit is not None:
+                    self._cache.move_to_end(text)
+                    self.hits += 1
+                    return hit
+        qv = self.transform_many([text])
+        if self._cache_size > 0:
+            with self._lock:
+                self.misses += 1
+                self._cache[text] = qv
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return qv
+
+    def transform_many(self, texts: list[str]) -> csr_matrix:
+        """Matrice len(texts)×dim, sans passer par le LRU (lots de requêtes)."""
+        indptr = np.zeros(len(texts) + 1, dtype=np.int32)
+        indices: list[int] = []
+        data: list[float] = []
+        for r, text in enumerate(texts):
+            cols, weights = self.terms(text)
+            indices.extend(cols)
+            data.extend(weights)
+            indptr[r + 1] = len(indices)
+        return csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), indptr), shape=(len(texts), self.dim))
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._cache), "capacity": self._cache_size, "hits": self.hits, "misses": self.misses, "hit_ratio": round(self.hits / total, 4) if total else 0.0}
@@ -0,0 +1,93 @@
+"""Publication atomique et versionnée des artefacts d'index."""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+import shutil
+from datetime import UTC, datetime
+from json import loads
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+
+from .utils import artifact_lock, artifacts_dir, read_manifest, replace_manifest, stamp_manifest, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+RELEASE_MANIFEST = "manifest.json"
+_counter = itertools.count()
+
+
+def new_release(dir_name: str) -> tuple[str, Path]:
+    """Répertoire vide d'une nouvelle release: (chemin relatif pour le manifest, chemin absolu)."""
+    release = f"{datetime.now(UTC):%Y%m%dT%H%M%S%f}-{os.getpid()}-{next(_counter)}"
+    path = artifacts_dir() / dir_name / release
+    path.mkdir(parents=True)
+    return f"{dir_name}/{release}", path
+
+
+def publish(name: str, manifest: dict[str, Any]) -> dict[str, Any]:
+    """Publie la release désignée par ``manifest["dir"]`` et élague les plus anciennes; retourne le manifest écrit."""
+    stamped = stamp_manifest(name, manifest)
+    release = artifacts_dir() / manifest["dir"]
+    with artifact_lock(name):
+        write_json_atomic(release / RELEASE_MANIFEST, stamped)
+        replace_manifest(name, stamped)
+        prune(name)
+    return stamped
+
+
+def releases(name: str) -> list[str]:
+    """Releases publiées de l'artefact (chemins relatifs), de la plus ancienne à la plus récente."""
+    manifest = read_manifest(name)
+    if not manifest or "/" not in manifest.get("dir", ""):
+        return []
+    root = artifacts_dir() / manifest["dir"].rsplit("/", 1)[0]
+    return sorted(f"{root.name}/{p.name}" for p in root.iterdir() if (p / RELEASE_MANIFEST).exists())
+
+
+def prune(name: str, keep: int | None = None) -> list[str]:
+    """Supprime les releases au-delà des ``keep`` plus récentes (la release publiée est toujours gardée)."""
+    keep = max(keep or settings.ML_INDEX_KEEP_RELEASES, 1)
+    current = (read_manifest(name) or {}).get("dir")
+    removed = [r for r in releases(name)[:-keep] if r != current]
+    for rel in removed:
+        # un processus qui mappe encore ces fichiers garde ses pages: seuls les noms disparaissent
+        shutil.rmtree(artifacts_dir() / rel, ignore_errors=True)
+    return removed
+
+
+def resolve(name: str, release: str | None = None) -> str:
+    """Chemin relatif d'une release conservée, par défaut celle qui précède la release publiée."""
+    current = (read_manifest(name) or {}).get("dir")
+    known = releases(name)
+    if release is None or release == "previous":
+        older = [r for r in known if r < (current or "")]
+        if not older:
+            raise ValueError(f"no previous release for {name}")
+        return older[-1]
+    match = [r for r in known if r == release or r.endswith(f"/{release}")]
+    if not match:
+        raise ValueError(f"unknown release for {name}: {release}")
+    return match[0]
+
+
+def release_manifest(name: str, release: str | None = None) -> dict[str, Any]:
+    """Manifest d'une release conservée (voir ``resolve``)."""
+    return loads((artifacts_dir() / resolve(name, release) / RELEASE_MANIFEST).read_text(encoding="utf-8"))
+
+
+def rollback(name: str, release: str | None = None) -> dict[str, Any]:
+    """Republie une release conservée: ``release`` (chemin relatif ou identifiant), sinon celle qui précède la release publiée."""
+    with artifact_lock(name):
+        current = (read_manifest(name) or {}).get("dir")
+        target = resolve(name, release)
+        manifest = loads((artifacts_dir() / target / RELEASE_MANIFEST).read_text(encoding="utf-8"))
+        # nouvel horodatage: les processus voient un nouveau manifest et rechargent
+        stamped = stamp_manifest(name, {k: v for k, v in manifest.items() if k not in ("name", "timestamp")})
+        replace_manifest(name, stamped)
+    logger.info("INDEX_ROLLED_BACK name=%s from=%s to=%s", name, current, target)
+    return stamped
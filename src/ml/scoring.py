@@ -0,0 +1,111 @@
+"""Noyau de scoring top-k sur des lignes TF-IDF normalisées L2."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize as l2_normalize
+
+EMPTY_POS = np.array([], dtype=np.int64)
+EMPTY_SCORES = np.array([], dtype=np.float64)
+# au-delà de n/8 postings touchées, accumuler dans un vecteur dense est moins cher que trier
+DENSE_ACCUMULATION_RATIO = 8
+
+
+def l2_rows(X: Any) -> csr_matrix:
+    """Normalise les lignes une fois pour toutes: le cosinus devient un simple produit scalaire."""
+    return l2_normalize(X.tocsr(), norm="l2", copy=False)
+
+
+def postings(X: Any) -> csr_matrix:
+    """Matrice terme → documents (X transposée en CSR): la ligne t est la liste des postings du terme t."""
+    Xt = csr_matrix(X).T.tocsr()
+    # postings triées par position: requis pour les sondages dichotomiques de ml.inverted
+    Xt.sort_indices()
+    return Xt
+
+
+def score_terms(terms: np.ndarray, weights: np.ndarray, Xt: csr_matrix) -> tuple[np.ndarray, np.ndarray]:
+    """Scores (positions, valeurs) des seuls documents touchés par les termes de la requête."""
+    if terms.size == 0:
+        return EMPTY_POS, EMPTY_SCORES
+    # poids dans la précision des postings: les produits restent en float32 pour un index compact
+    weights = np.asarray(weights, dtype=Xt.data.dtype)
+    starts, ends = Xt.indptr[terms], Xt.indptr[terms + 1]
+    if terms.size == 1:
+        s, e = int(starts[0]), int(ends[0])
+        return np.asarray(Xt.indices[s:e], dtype=np.int64), Xt.data[s:e] * float(weights[0])
+    docs = np.concatenate([Xt.indices[s:e] for s, e in zip(starts, ends, strict=True)])
+    vals = np.concatenate([Xt.data[s:e] * w for s, e, w in zip(starts, ends, weights, strict=True)])
+    if docs.size == 0:
+        return EMPTY_POS, EMPTY_SCORES
+    if docs.size * DENSE_ACCUMULATION_RATIO > Xt.shape[1]:
+        # postings très longues (termes fréquents): un accumulateur dense évite le tri de np.unique
+        acc = np.bincount(docs, weights=vals, minlength=Xt.shape[1])
+        pos = np.flatnonzero(acc)
+        return pos, acc[pos]
+    pos, inv = np.unique(docs, return_inverse=True)
+    return pos.astype(np.int64, copy=False), np.bincount(inv, weights=vals)
+
+
+def score_row(qv: Any, Xt: csr_matrix) -> tuple[np.ndarray, np.ndarray]:
+    """Variante de ``score_terms`` pour un vecteur requête sparse 1×dim."""
+    qv = qv.tocsr()
+    return score_terms(np.asarray(qv.indices, dtype=np.int64), qv.data, Xt)
+
+
+def top_k(positions: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k par score décroissant, égalités départagées par position croissante (ordre stable)."""
+    if k <= 0 or positions.size == 0:
+        return EMPTY_POS, EMPTY_SCORES
+    if positions.size > k:
+        kth = np.partition(scores, positions.size - k)[positions.size - k]
+        # on garde toutes les égalités au seuil pour que le départage reste déterministe
+        keep = np.flatnonzero(scores >= kth)
+        positions, scores = positions[keep], scores[keep]
+    order = np.lexsort((positions, -scores))[:k]
+    return positions[order], scores[order]
+
+
+def rank(positions: np.ndarray, scores: np.ndarray, k: int, n_rows: int, exclude: int | None = None, skip: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k complété par des documents de score nul, comme un tri complet du catalogue."""
+    skip = EMPTY_POS if skip is None else skip
+    k = min(max(k, 0), n_rows - skip.size)
+    if exclude is not None and positions.size:
+        keep = positions != exclude
+        positions, scores = positions[keep], scores[keep]
+    top_pos, top_scores = top_k(positions, scores, k)
+    missing = k - top_pos.size
+    if missing <= 0:
+        return top_pos, top_scores
+    never = np.concatenate([positions, skip]) if exclude is None else np.concatenate([positions, skip, [exclude]])
+    pad = np.setdiff1d(np.arange(min(n_rows, missing + never.size), dtype=np.int64), never)[:missing]
+    top_pos, top_scores = np.concatenate([top_pos, pad]), np.concatenate([top_scores, np.zeros(pad.size)])
+    if exclude is not None and top_pos.size < k:
+        top_pos, top_scores = np.append(top_pos, exclude), np.append(top_scores, -1.0)
+    return top_pos, top_scores
+
+
+def precision_agreement(X: Any, compact: Any, sample: int, k: int = 10) -> dict[str, Any]:
+    """Accord des top-k d'un échantillon de lignes entre ``X`` et sa version ``compact``."""
+    n_rows = X.shape[0]
+    rows = np.random.default_rng(0).choice(n_rows, min(sample, n_rows), replace=False)
+    Xt, Ct = postings(X), postings(compact)
+    shared = same = 0
+    error = 0.0
+    for r in rows.tolist():
+        ref_pos, ref_sc = rank(*score_row(X[r], Xt), k, n_rows)
+        pos, sc = rank(*score_row(compact[r], Ct), k, n_rows)
+        shared += np.intersect1d(ref_pos, pos).size
+        same += int(np.array_equal(ref_pos, pos))
+        error = max(error, float(np.abs(ref_sc - sc).max(initial=0.0)))
+    n = max(rows.size, 1)
+    return {
+        "agreement_k": int(min(k, n_rows)),
+        "agreement_sample": int(rows.size),
+        "top_k_agreement": round(shared / max(rows.size * min(k, n_rows), 1), 4),
+        "identical_top_k": round(same / n, 4),
+        "max_score_error": error,
+    }
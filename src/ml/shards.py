@@ -0,0 +1,88 @@
+"""Partitionnement de l'index produits en shards de lignes et recherche scatter-gather."""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import numpy as np
+from django.conf import settings
+
+from .inverted import maxscore
+from .scoring import postings, score_row, top_k
+
+T = TypeVar("T")
+
+
+@dataclass
+class Shard:
+    start: int  # première position (globale) du shard
+    stop: int
+    Xt: Any  # postings terme → positions locales
+
+    @property
+    def rows(self) -> int:
+        return self.stop - self.start
+
+
+def shard_bounds(n_rows: int, count: int) -> list[tuple[int, int]]:
+    """Tranches contiguës de tailles égales (à une ligne près); au plus une par ligne, au moins une."""
+    count = max(1, min(count, n_rows))
+    edges = np.linspace(0, n_rows, count + 1).round().astype(np.int64)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:], strict=True)]
+
+
+def postings_prefix(i: int, count: int) -> str:
+    """Préfixe des tableaux de postings du shard ``i``: ``Xt`` pour un index non partitionné (format historique)."""
+    return "Xt" if count == 1 else f"Xt{i}"
+
+
+def build_shards(X: Any, count: int, workers: int | None = None) -> list[Shard]:
+    """Postings de chaque shard, calculées en parallèle par des threads (transpositions scipy; ni fork ni sérialisation)."""
+    bounds = shard_bounds(X.shape[0], count)
+    workers = min(workers or settings.ML_INDEX_SHARD_BUILD_WORKERS or len(bounds), len(bounds))
+    if workers <= 1:
+        parts = [postings(X[a:b]) for a, b in bounds]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-shard-build") as pool:
+            parts = list(pool.map(lambda b: postings(X[b[0] : b[1]]), bounds))
+    return [Shard(a, b, Xt) for (a, b), Xt in zip(bounds, parts, strict=True)]
+
+
+def shard_candidates(shard: Shard, qv: Any, k: int, engine: str, upper: np.ndarray, dead: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Candidats d'un shard (positions globales, lignes retirées exclues), réduits à son top-k."""
+    dead = dead[(dead >= shard.start) & (dead < shard.stop)]
+    if engine == "maxscore":
+        # les lignes retirées peuvent occuper le top-k du shard: on en demande d'autant plus
+        pos, sc = maxscore(qv.indices, qv.data, shard.Xt, upper, k + dead.size)
+    else:
+        pos, sc = score_row(qv, shard.Xt)
+    pos = pos + shard.start
+    if dead.size:
+        keep = ~np.isin(pos, dead)
+        pos, sc = pos[keep], sc[keep]
+    if pos.size > k:
+        pos, sc = top_k(pos, sc, k)
+    return pos, sc
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ML_SEARCH_SHARD_WORKERS, thread_name_prefix="index-shard")
+        return _executor
+
+
+def scatter(fn: Callable[[Shard], T], shards: Sequence[Shard]) -> list[T]:
+    """Applique ``fn`` à chaque shard, en parallèle sur le pool de threads du processus."""
+    if len(shards) <= 1 or settings.ML_SEARCH_SHARD_WORKERS <= 1:
+        return [fn(s) for s in shards]
+    return list(_get_executor().map(fn, shards))
@@ -0,0 +1,137 @@
+"""Format disque des index: tableaux ``.npy`` ouverts en mmap et vocabulaire texte."""
+
+from __future__ import annotations
+
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+FORMAT = "npy-v1"
+VOCAB_FILE = "vocab.txt"
+VECTORIZER_PARAMS = {"ngram_range": (1, 2)}
+# précision des valeurs des matrices d'index; float16 n'est qu'un encodage disque (scipy.sparse n'a pas de
+# demi-précision): les valeurs sont décodées en float32 au chargement, arrondies comme à l'écriture
+PRECISIONS = ("float64", "float32", "float16")
+# lignes normalisées L2: valeurs dans (0, 1]. Le facteur (puissance de 2: multiplication exacte) éloigne les plus
+# petites de la plage sous-normale du float16 sans risque de débordement
+FLOAT16_SCALE = 2.0**15
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def reset_dir(path: Path) -> Path:
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+    return path
+
+
+def save_arrays(path: Path, arrays: dict[str, np.ndarray]) -> dict[str, dict[str, Any]]:
+    """Écrit chaque tableau en ``<nom>.npy`` et retourne leur description pour le manifest."""
+    for name, arr in arrays.items():
+        np.save(path / f"{name}.npy", np.ascontiguousarray(arr), allow_pickle=False)
+    return arrays_spec(path, list(arrays))
+
+
+def arrays_spec(path: Path, names: list[str]) -> dict[str, dict[str, Any]]:
+    """Description pour le manifest de tableaux ``<nom>.npy`` déjà écrits (ex: remplis par memmap)."""
+    spec = {}
+    for name in names:
+        f = path / f"{name}.npy"
+        arr = np.load(f, mmap_mode="r", allow_pickle=False)
+        spec[name] = {"file": f.name, "dtype": arr.dtype.str, "shape": list(arr.shape), "sha256": file_sha256(f)}
+    return spec
+
+
+def load_arrays(path: Path, spec: dict[str, dict[str, Any]], mmap: bool = True, verify: bool = False) -> dict[str, np.ndarray]:
+    out = {}
+    for name, desc in spec.items():
+        f = path / desc["file"]
+        if verify and file_sha256(f) != desc["sha256"]:
+            raise ValueError(f"checksum mismatch for {f}")
+        arr = np.load(f, mmap_mode="r" if mmap else None, allow_pickle=False)
+        if arr.dtype.str != desc["dtype"] or list(arr.shape) != desc["shape"]:
+            raise ValueError(f"unexpected dtype/shape for {f}: {arr.dtype.str}{arr.shape}")
+        out[name] = arr
+    return out
+
+
+def index_dtype(*sizes: int) -> type:
+    """Type d'indice commun à indices et indptr (scipy recopierait des memmaps de types différents)."""
+    return np.int32 if max(sizes, default=0) < np.iinfo(np.int32).max else np.int64
+
+
+def check_precision(precision: str) -> str:
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown index precision: {precision}")
+    return precision
+
+
+def encode_values(data: np.ndarray, precision: str) -> np.ndarray:
+    """Valeurs telles qu'écrites sur disque (float16: multipliées par FLOAT16_SCALE)."""
+    if precision == "float16":
+        return (np.asarray(data, dtype=np.float32) * np.float32(FLOAT16_SCALE)).astype(np.float16)
+    return np.asarray(data, dtype=precision)
+
+
+def decode_values(data: np.ndarray) -> np.ndarray:
+    """Valeurs de calcul d'un tableau écrit par ``encode_values`` (float16 → float32; sinon inchangé, sans copie)."""
+    if data.dtype == np.float16:
+        return np.asarray(data, dtype=np.float32) / np.float32(FLOAT16_SCALE)
+    return data
+
+
+def compact_csr(X: Any, precision: str) -> csr_matrix:
+    """Matrice de calcul dans la précision demandée: valeurs float32 (arrondies en float16), indices int32."""
+    X = X.tocsr()
+    if precision == "float64":
+        return X
+    itype = index_dtype(X.nnz, *X.shape)
+    data = decode_values(encode_values(X.data, precision)) if precision == "float16" else X.data.astype(np.float32)
+    return csr_matrix((data, X.indices.astype(itype), X.indptr.astype(itype)), shape=X.shape, copy=False)
+
+
+def csr_arrays(X: csr_matrix, prefix: str = "X", precision: str | None = None) -> dict[str, np.ndarray]:
+    """Tableaux d'une CSR; ``precision`` encode les valeurs (par défaut: telles quelles)."""
+    X = X.tocsr()
+    data = X.data if precision is None else encode_values(X.data, precision)
+    return {f"{prefix}_data": data, f"{prefix}_indices": X.indices, f"{prefix}_indptr": X.indptr}
+
+
+def csr_from_arrays(arrays: dict[str, np.ndarray], dim: int, prefix: str = "X") -> csr_matrix:
+    indptr = arrays[f"{prefix}_indptr"]
+    # copy=False: la matrice garde les memmaps, rien n'est recopié en mémoire privée (sauf valeurs float16, décodées)
+    return csr_matrix((decode_values(arrays[f"{prefix}_data"]), arrays[f"{prefix}_indices"], indptr), shape=(len(indptr) - 1, dim), copy=False)
+
+
+def save_vocabulary(path: Path, vectorizer: TfidfVectorizer) -> dict[str, Any]:
+    """Un terme par ligne, dans l'ordre des colonnes (la ligne i est le terme de la colonne i)."""
+    terms = vectorizer.get_feature_names_out()
+    f = path / VOCAB_FILE
+    f.write_text("\n".join(terms) + "\n", encoding="utf-8")
+    return {"file": f.name, "size": int(len(terms)), "sha256": file_sha256(f)}
+
+
+def load_vocabulary(path: Path, desc: dict[str, Any]) -> list[str]:
+    terms = (path / desc["file"]).read_text(encoding="utf-8").split("\n")[: desc["size"]]
+    if len(terms) != desc["size"]:
+        raise ValueError(f"truncated vocabulary in {path}")
+    return terms
+
+
+def vectorizer_from(terms: list[str], idf: np.ndarray) -> TfidfVectorizer:
+    """Reconstruit un TfidfVectorizer prêt pour ``transform`` à partir du vocabulaire et de l'idf."""
+    vec = TfidfVectorizer(**VECTORIZER_PARAMS, vocabulary={t: i for i, t in enumerate(terms)})
+    vec.idf_ = np.asarray(idf)
+    return vec
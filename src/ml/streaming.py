@@ -0,0 +1,169 @@
+"""Construction hors mémoire d'un index TF-IDF, bloc par bloc."""
+
+from __future__ import annotations
+
+import resource
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+
+from .storage import VECTORIZER_PARAMS, encode_values, index_dtype
+
+
+def peak_rss_bytes() -> int:
+    """Pic de mémoire résidente du processus (ru_maxrss est en Kio sous Linux)."""
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) * 1024
+
+
+class VocabularyCounter:
+    """Fréquences documentaires par terme, en mémoire bornée à ``max_terms`` entrées."""
+
+    def __init__(self, max_terms: int) -> None:
+        self.max_terms = max_terms
+        self.df: dict[str, int] = {}
+        self.n_docs = 0
+        self.pruned = 0
+
+    def add(self, docs: list[str]) -> None:
+        if not docs:
+            return
+        self.n_docs += len(docs)
+        cv = CountVectorizer(**VECTORIZER_PARAMS, binary=True)
+        try:
+            X = cv.fit_transform(docs)
+        except ValueError:
+            # bloc sans aucun terme (documents vides)
+            return
+        counts = np.bincount(X.indices, minlength=len(cv.vocabulary_))
+        df = self.df
+        for term, col in cv.vocabulary_.items():
+            df[term] = df.get(term, 0) + int(counts[col])
+        if len(df) > self.max_terms:
+            self._prune()
+
+    def _prune(self) -> None:
+        counts = np.fromiter(self.df.values(), dtype=np.int64, count=len(self.df))
+        floor = int(np.partition(counts, self.max_terms // 2)[self.max_terms // 2])
+        before = len(self.df)
+        self.df = {t: c for t, c in self.df.items() if c > floor}
+        self.pruned += before - len(self.df)
+
+
+def exact_df(terms: list[str], chunks: Iterable[list[str]]) -> np.ndarray:
+    """Fréquences documentaires exactes des ``terms`` (vocabulaire figé) sur tous les blocs."""
+    cv = CountVectorizer(**VECTORIZER_PARAMS, binary=True, vocabulary={t: i for i, t in enumerate(terms)})
+    df = np.zeros(len(terms), dtype=np.int64)
+    for docs in chunks:
+        if docs:
+            df += np.bincount(cv.transform(docs).indices, minlength=len(terms))
+    return df
+
+
+def smooth_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """idf lissé, calculé comme ``TfidfTransformer`` (smooth_idf=True)."""
+    df = df.astype(np.float64) + 1.0
+    return np.log((n_docs + 1) / df) + 1.0
+
+
+class ShardWriter:
+    """Écrit des blocs de lignes CSR (et des colonnes par ligne) en fichiers ``.npy`` numérotés."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.shards: list[dict[str, Any]] = []
+
+    def write(self, X: csr_matrix, **columns: np.ndarray) -> None:
+        i = len(self.shards)
+        files = {}
+        for name, arr in {"data": X.data, "indices": X.indices, "indptr": X.indptr, **columns}.items():
+            f = self.path / f"shard{i:05d}_{name}.npy"
+            np.save(f, np.ascontiguousarray(arr), allow_pickle=False)
+            files[name] = f
+        self.shards.append({"files": files, "rows": int(X.shape[0]), "nnz": int(X.nnz)})
+
+    def load(self, shard: dict[str, Any], name: str) -> np.ndarray:
+        return np.load(shard["files"][name], mmap_mode="r", allow_pickle=False)
+
+    @property
+    def rows(self) -> int:
+        return sum(s["rows"] for s in self.shards)
+
+    @property
+    def nnz(self) -> int:
+        return sum(s["nnz"] for s in self.shards)
+
+
+def assemble_csr(shards: ShardWriter, dim: int, path: Path, prefix: str = "X", precision: str = "float64") -> tuple[int, int]:
+    """Concatène les shards en ``<prefix>_data/indices/indptr.npy``; retourne (lignes, nnz)."""
+    rows, nnz = shards.rows, shards.nnz
+    itype = index_dtype(nnz, rows, dim)
+    data = open_memmap(path / f"{prefix}_data.npy", mode="w+", dtype=precision, shape=(nnz,))
+    indices = open_memmap(path / f"{prefix}_indices.npy", mode="w+", dtype=itype, shape=(nnz,))
+    indptr = open_memmap(path / f"{prefix}_indptr.npy", mode="w+", dtype=itype, shape=(rows + 1,))
+    indptr[0] = 0
+    r, z = 0, 0
+    for shard in shards.shards:
+        n, k = shard["rows"], shard["nnz"]
+        data[z : z + k] = encode_values(shards.load(shard, "data"), precision)
+        indices[z : z + k] = shards.load(shard, "indices")
+        indptr[r + 1 : r + n + 1] = shards.load(shard, "indptr")[1:] + z
+        r, z = r + n, z + k
+    for arr in (data, indices, indptr):
+        arr.flush()
+    return rows, nnz
+
+
+def transpose_csr(shards: ShardWriter, dim: int, path: Path, prefix: str = "Xt", parts: list[dict[str, Any]] | None = None, precision: str = "float64") -> None:
+    """Postings (X transposée, indices triés) écrites bloc par bloc."""
+    parts = shards.shards if parts is None else parts
+    rows, nnz = sum(s["rows"] for s in parts), sum(s["nnz"] for s in parts)
+    itype = index_dtype(nnz, rows, dim)
+    counts = np.zeros(dim, dtype=np.int64)
+    for shard in parts:
+        counts += np.bincount(shards.load(shard, "indices"), minlength=dim)
+    indptr = open_memmap(path / f"{prefix}_indptr.npy", mode="w+", dtype=itype, shape=(dim + 1,))
+    indptr[0] = 0
+    indptr[1:] = np.cumsum(counts)
+    data = open_memmap(path / f"{prefix}_data.npy", mode="w+", dtype=precision, shape=(nnz,))
+    indices = open_memmap(path / f"{prefix}_indices.npy", mode="w+", dtype=itype, shape=(nnz,))
+    nxt = np.asarray(indptr[:-1], dtype=np.int64).copy()
+    row0 = 0
+    for shard in parts:
+        s_indptr = np.asarray(shards.load(shard, "indptr"))
+        cols = np.asarray(shards.load(shard, "indices"))
+        # tri stable par colonne: dans chaque colonne, les lignes restent croissantes
+        order = np.argsort(cols, kind="stable")
+        c = cols[order]
+        rank = np.arange(c.size) - np.searchsorted(c, c, side="left")
+        dest = nxt[c] + rank
+        indices[dest] = (row0 + np.repeat(np.arange(shard["rows"]), np.diff(s_indptr)))[order]
+        data[dest] = encode_values(np.asarray(shards.load(shard, "data"))[order], precision)
+        nxt += np.bincount(cols, minlength=dim)
+        row0 += shard["rows"]
+    for arr in (data, indices, indptr):
+        arr.flush()
+
+
+def concat_column(shards: ShardWriter, name: str, path: Path, dtype: Any) -> None:
+    out = open_memmap(path / f"{name}.npy", mode="w+", dtype=dtype, shape=(shards.rows,))
+    r = 0
+    for shard in shards.shards:
+        out[r : r + shard["rows"]] = shards.load(shard, name)
+        r += shard["rows"]
+    out.flush()
+
+
+def batched(rows: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    chunk: list[Any] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,10 +1,11 @@
-from re import U, compile, sub
+from re import U, compile
 
 _ws = compile(r"\s+")
+_punct = compile(r"[^\w\s-]", U)
 
 
 def normalize(s: str) -> str:
     s = (s or "").strip().lower()
-    s = sub(r"[^\w\s-]", " ", s, flags=U)
+    s = _punct.sub(" ", s)
     s = _ws.sub(" ", s)
     return s
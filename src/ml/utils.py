@@ -1,6 +1,12 @@
+import fcntl
+import os
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
 from datetime import UTC, datetime
 from json import dump, loads
 from pathlib import Path
+from sys import getsizeof
 from typing import Any
 
 from django.conf import settings
@@ -16,16 +22,86 @@ def artifacts_dir() -> Path:
     return p
 
 
-def write_manifest(name: str, manifest: dict[str, Any]) -> Path:
-    manifest = {**manifest, "name": name, "timestamp": datetime.now(UTC).isoformat().replace("+00:00", "Z")}
-    path = artifacts_dir() / f"{name}_manifest.json"
-    with path.open("w", encoding="utf-8") as f:
-        dump(manifest, f, ensure_ascii=False, indent=2)
+_held = threading.local()
+
+
+@contextmanager
+def artifact_lock(name: str) -> Iterator[None]:
+    """Verrou exclusif inter-processus (flock) sur un artefact, réentrant dans un même thread."""
+    held = _held.__dict__.setdefault("names", {})
+    if name in held:
+        # flock sur un second descripteur du même fichier se bloquerait lui-même
+        held[name] += 1
+        try:
+            yield
+        finally:
+            held[name] -= 1
+        return
+    with (artifacts_dir() / f".{name}.lock").open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        held[name] = 1
+        try:
+            yield
+        finally:
+            del held[name]
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def manifest_path(name: str) -> Path:
+    return artifacts_dir() / f"{name}_manifest.json"
+
+
+def manifest_signature(name: str) -> tuple[str, int] | None:
+    """Signature (chemin, mtime_ns) du manifest; None si absent. Un simple stat, pas de parsing JSON."""
+    path = manifest_path(name)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return str(path), st.st_mtime_ns
+
+
+def stamp_manifest(name: str, manifest: dict[str, Any]) -> dict[str, Any]:
+    return {**manifest, "name": name, "timestamp": datetime.now(UTC).isoformat().replace("+00:00", "Z")}
+
+
+def write_json_atomic(path: Path, data: dict[str, Any]) -> Path:
+    """Écrit dans un fichier temporaire voisin puis le renomme: un lecteur voit l'ancien ou le nouveau contenu."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
     return path
 
 
+# écritures de manifests par ce processus: le contexte de versions les voit sans attendre son prochain sondage
+_manifest_writes = [0]
+
+
+def manifest_generation() -> int:
+    return _manifest_writes[0]
+
+
+def replace_manifest(name: str, stamped: dict[str, Any]) -> Path:
+    """Remplace atomiquement le manifest publié de ``name`` par ``stamped`` (déjà horodaté)."""
+    path = write_json_atomic(manifest_path(name), stamped)
+    _manifest_writes[0] += 1
+    return path
+
+
+def write_manifest(name: str, manifest: dict[str, Any]) -> Path:
+    return replace_manifest(name, stamp_manifest(name, manifest))
+
+
 def read_manifest(name: str) -> dict[str, Any] | None:
-    path = artifacts_dir() / f"{name}_manifest.json"
+    path = manifest_path(name)
     if not path.exists():
         return None
     return loads(path.read_text(encoding="utf-8"))
+
+
+def vocabulary_nbytes(vocab: dict[str, int]) -> int:
+    """Estimation de l'empreinte mémoire d'un vocabulaire sklearn (dict + clés)."""
+    return getsizeof(vocab) + sum(getsizeof(t) for t in vocab)
@@ -0,0 +1,109 @@
+"""Signatures des manifests d'index et buster du cache, gardées en mémoire et rafraîchies par un thread."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import manifest_generation, manifest_signature
+
+logger = logging.getLogger(__name__)
+
+BUSTER_KEY = "catalog:buster"
+
+
+class VersionContext:
+    def __init__(self) -> None:
+        # manifests suivis (ceux des index résidents, ajoutés au premier accès) et leur dernière signature
+        self._signatures: dict[str, tuple[str, int] | None] = {}
+        self._buster = "0"
+        # état vu au dernier rafraîchissement: écritures de manifests du processus, répertoire des artefacts
+        self._seen: tuple[int, str] | None = None
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.refreshes = 0
+        self.refreshed_at: float | None = None
+
+    def signatures(self, names: tuple[str, ...]) -> tuple[tuple[str, int] | None, ...]:
+        """Signatures connues des manifests ``names``, sans I/O une fois suivis."""
+        self._check()
+        if any(n not in self._signatures for n in names):
+            with self._lock:
+                for n in names:
+                    if n not in self._signatures:
+                        self._signatures[n] = manifest_signature(n)
+        return tuple(self._signatures[n] for n in names)
+
+    def buster(self) -> str:
+        self._check()
+        return self._buster
+
+    def set_buster(self, value: object) -> None:
+        self._buster = str(value)
+
+    def refresh(self) -> None:
+        """Relit les signatures des manifests et le buster (appelé par le thread de rafraîchissement)."""
+        with self._lock:
+            self._refresh_signatures()
+            try:
+                self._buster = str(cache.get(BUSTER_KEY) or "0")
+            except Exception:
+                # cache partagé injoignable: on garde la dernière valeur connue
+                logger.exception("VERSION_CONTEXT_BUSTER_FAILED")
+            self.refreshes += 1
+            self.refreshed_at = time.time()
+
+    def _check(self) -> None:
+        seen = (manifest_generation(), str(settings.ML_ARTIFACTS_DIR))
+        if seen != self._seen:
+            # premier accès, manifest écrit par ce processus ou autre répertoire d'artefacts: relecture immédiate
+            if self._seen is None:
+                self.refresh()
+            else:
+                with self._lock:
+                    self._refresh_signatures()
+        interval = settings.ML_VERSION_REFRESH_INTERVAL
+        if interval <= 0:
+            # sans thread: relecture à chaque accès
+            self.refresh()
+        elif self._thread is None or not self._thread.is_alive():
+            self._start(interval)
+
+    def _refresh_signatures(self) -> None:
+        seen = (manifest_generation(), str(settings.ML_ARTIFACTS_DIR))
+        for name in list(self._signatures):
+            self._signatures[name] = manifest_signature(name)
+        self._seen = seen
+
+    def _start(self, interval: float) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            def _run() -> None:
+                while True:
+                    time.sleep(settings.ML_VERSION_REFRESH_INTERVAL or interval)
+                    try:
+                        self.refresh()
+                    except Exception:
+                        logger.exception("VERSION_CONTEXT_REFRESH_FAILED")
+
+            self._thread = threading.Thread(target=_run, name="version-context", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "manifests": sorted(self._signatures),
+            "buster": self._buster,
+            "refreshes": self.refreshes,
+            "refreshed_at": self.refreshed_at,
+            "interval_s": settings.ML_VERSION_REFRESH_INTERVAL,
+        }
+
+
+context = VersionContext()